@@ -0,0 +1,176 @@
+"""
+批量处理：
+1. prepare_session —— /api/init_sessions 在进程池中解码、校验每个条目；
+2. 命令行 —— 不启动界面，用进程池批量清洗整个数据集 (目录或 JSONL)，支持检查点续跑。
+用法: python batch.py INPUT_DIR_OR_JSONL OUTPUT [--workers 8] [--resume] [--report report.jsonl]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from viz_core import SystemBlockViz
+from image_store import probe_image, write_image_file
+
+def prepare_session(item, image_root=None, max_image_bytes=None, max_pixels=None):
+    """
+    批量创建会话时在工作进程中执行：校验 JSON (validate_connections，不建命中索引) 并导出紧凑的规范化 JSON，
+    解码图片、只读文件头得到尺寸。image_root 不为空时图片直接写入图片仓库目录，只返回哈希。
+    返回 {"ok": True, "json", "digest", "data", "mime", "size", "validation"} 或 {"ok": False, "msg"}，validation 为清洗报告。
+    """
+    try:
+        diagram, report = SystemBlockViz.normalize(item.get("json_str"), with_report=True)
+    except Exception as e:
+        return {"ok": False, "msg": f"JSON Parse Error: {e}"}
+    img_b64 = item.get("image_b64") or ""
+    try:
+        data = base64.b64decode(img_b64.split(",", 1)[1] if "," in img_b64 else img_b64)
+    except Exception as e:
+        return {"ok": False, "msg": f"Image decode error: {e}"}
+    if max_image_bytes and len(data) > max_image_bytes:
+        return {"ok": False, "msg": f"图片超过 {max_image_bytes} 字节"}
+    info = probe_image(data[:256 << 10])
+    if info is None:
+        return {"ok": False, "msg": "无法识别的图片格式"}
+    w, h, mime = info
+    if max_pixels and w * h > max_pixels:
+        return {"ok": False, "msg": f"图片像素过多: {w}x{h}"}
+    digest = hashlib.sha256(data).hexdigest()
+    if image_root:
+        write_image_file(image_root, digest, data, mime)
+        data = None
+    return {"ok": True, "json": json.dumps(diagram, ensure_ascii=False, separators=(",", ":")), "digest": digest, "data": data, "mime": mime, "size": (w, h), "validation": report}
+
+# ==========================================
+# 命令行：批量清洗数据集
+# ==========================================
+
+def normalize_text(text):
+    """清洗一份 JSON 文本，返回 (清洗后的数据, 报告)；报告记录被剔除的节点数、连接数及各原因的个数"""
+    data, report = SystemBlockViz.normalize(json.loads(text), with_report=True)
+    return data, {"ok": True, "connections": report["connections_kept"], "dropped_connections": report["connections_dropped"],
+                  "dropped_nodes": report["nodes_dropped"], "reasons": report["reasons"]}
+
+def atomic_write(path, text):
+    """先写同目录下的临时文件再 os.replace，中断时不会留下写了一半的输出"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f: f.write(text)
+    os.replace(tmp, path)
+
+def process_file(task):
+    """目录模式的工作函数：读入、清洗、按 export_json 的格式原子写出"""
+    src, dst, rel = task
+    try:
+        with open(src, encoding="utf-8") as f: data, report = normalize_text(f.read())
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        atomic_write(dst, json.dumps(data, indent=2, ensure_ascii=False))
+    except Exception as e:
+        report = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    report["file"] = rel
+    return report
+
+def process_line(task):
+    """JSONL 模式的工作函数：返回 (行号, 输出行, 报告)，输出为紧凑的单行 JSON；空行没有报告"""
+    lineno, line = task
+    if not line.strip(): return lineno, None, None
+    try:
+        data, report = normalize_text(line)
+        out = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    except Exception as e:
+        out, report = None, {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    report["line"] = lineno
+    return lineno, out, report
+
+def iter_dir_tasks(src_dir, dst_dir, done):
+    for root, _, files in os.walk(src_dir):
+        for name in sorted(files):
+            if not name.endswith(".json"): continue
+            src = os.path.join(root, name)
+            rel = os.path.relpath(src, src_dir)
+            if rel not in done: yield src, os.path.join(dst_dir, rel), rel
+
+def run_dir(args, pool, emit):
+    # 检查点是已成功处理的文件的追加日志，恢复时跳过其中的文件；失败的文件不记录，恢复时重试
+    ckpt = args.checkpoint or os.path.join(args.output, ".batch_checkpoint")
+    os.makedirs(args.output, exist_ok=True)
+    done = set()
+    if args.resume and os.path.exists(ckpt):
+        with open(ckpt, encoding="utf-8") as f: done = {line.rstrip("\n") for line in f if line.strip()}
+    with open(ckpt, "a" if args.resume else "w", encoding="utf-8") as log:
+        for report in pool.imap_unordered(process_file, iter_dir_tasks(args.input, args.output, done), chunksize=args.chunksize):
+            emit(report)
+            if not report["ok"]: continue
+            log.write(report["file"] + "\n")
+            log.flush()
+    return len(done)
+
+def run_jsonl(args, pool, emit):
+    # 输出先写入 .part 文件，检查点记录已写出的行数与字节偏移；全部完成后原子地替换为最终文件
+    part = args.output + ".part"
+    ckpt = args.checkpoint or args.output + ".checkpoint"
+    skip, offset = 0, 0
+    if args.resume and os.path.exists(ckpt) and os.path.exists(part):
+        with open(ckpt, encoding="utf-8") as f: state = json.load(f)
+        skip, offset = state["lines"], state["offset"]
+    out = open(part, "r+b" if offset else "wb")
+    out.truncate(offset)
+    out.seek(offset)
+
+    def tasks():
+        with open(args.input, encoding="utf-8") as f:
+            for lineno, line in enumerate(f):
+                if lineno >= skip: yield lineno, line
+
+    lines, last_save = skip, time.monotonic()
+    for lineno, text, report in pool.imap(process_line, tasks(), chunksize=args.chunksize):
+        if report is not None: emit(report)
+        # 失败的行和空行输出 null 占位，保持输入输出行号一一对应
+        out.write(((text if text is not None else "null") + "\n").encode("utf-8"))
+        lines = lineno + 1
+        if time.monotonic() - last_save > 1:
+            out.flush()
+            os.fsync(out.fileno())
+            atomic_write(ckpt, json.dumps({"lines": lines, "offset": out.tell()}))
+            last_save = time.monotonic()
+    out.close()
+    os.replace(part, args.output)
+    if os.path.exists(ckpt): os.remove(ckpt)
+    return skip
+
+def main():
+    parser = argparse.ArgumentParser(description="批量清洗标注 JSON：ensure_structure + validate_connections，按 export_json 格式输出")
+    parser.add_argument("input", help="输入目录 (递归处理 *.json) 或 .jsonl 文件 (每行一张图)")
+    parser.add_argument("output", help="输出目录或 .jsonl 文件")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunksize", type=int, default=16)
+    parser.add_argument("--checkpoint", help="检查点文件 (默认放在输出旁边)")
+    parser.add_argument("--resume", action="store_true", help="从检查点继续，跳过已处理的输入")
+    parser.add_argument("--report", help="逐文件报告 (JSONL)，默认输出到标准输出；续跑时检查点之后的条目可能重复报告")
+    args = parser.parse_args()
+
+    report_file = open(args.report, "a" if args.resume else "w", encoding="utf-8") if args.report else sys.stdout
+    totals = {"files": 0, "failed": 0, "dropped_nodes": 0, "dropped_connections": 0}
+    def emit(report):
+        report_file.write(json.dumps(report, ensure_ascii=False) + "\n")
+        totals["files"] += 1
+        totals["failed"] += not report["ok"]
+        totals["dropped_nodes"] += report.get("dropped_nodes", 0)
+        totals["dropped_connections"] += report.get("dropped_connections", 0)
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.workers) as pool:
+        run = run_dir if os.path.isdir(args.input) else run_jsonl
+        skipped = run(args, pool, emit)
+    elapsed = time.perf_counter() - start
+    if report_file is not sys.stdout: report_file.close()
+    print(f"处理 {totals['files']} 个 (跳过已完成 {skipped} 个, 失败 {totals['failed']} 个), "
+          f"剔除节点 {totals['dropped_nodes']} 个、连接 {totals['dropped_connections']} 条, "
+          f"用时 {elapsed:.1f}s ({totals['files'] / max(elapsed, 1e-9):.0f} 个/s)", file=sys.stderr)
+    return 1 if totals["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
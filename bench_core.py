@@ -0,0 +1,176 @@
+"""
+viz_core 微基准：确定性的合成电路生成器 + 覆盖主要操作的计时套件，结果可写成 JSON 并与基线对比。
+用法:
+  python bench_core.py [--sizes 1000 5000] [--ports 4] [--nets N] [--fanout 3] [--external 16] [--repeat 5]
+                       [--json out.json] [--save-baseline bench_baseline.json] [--baseline bench_baseline.json]
+                       [--threshold 0.25] [--fail-on-regression]
+基线与机器相关，应在同一台机器上用 --save-baseline 生成后再比较；中位数比基线慢超过 threshold 的用例标记为 REGRESSION。
+"""
+import argparse
+import copy
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import numpy as np
+from viz_core import SystemBlockViz
+from viz_render import SvgRenderer
+
+def make_circuit(n_comps, ports_per_comp=4, n_nets=None, fanout=3, n_external=16, invalid_ratio=0.0, seed=0):
+    """
+    生成合成标注数据：组件框随机散布在与规模相称的画布上，端口落在框的边上；
+    n_nets 条连接 (默认 n_comps // 2)，每条平均 fanout 个节点，部分连接接到外部端口。
+    invalid_ratio 为额外加入的无效节点 (引用不存在的端口) 比例，用于测量 validate_connections 的清洗开销。
+    同样的参数与 seed 总是得到同样的数据。
+    """
+    rng = random.Random(seed)
+    n_nets = n_comps // 2 if n_nets is None else n_nets
+    side = int((n_comps ** 0.5) * 120) + 200
+    comps = {}
+    for i in range(n_comps):
+        w, h = rng.randint(20, 100), rng.randint(20, 100)
+        x, y = rng.randint(0, side - w), rng.randint(0, side - h)
+        ports = []
+        for j in range(ports_per_comp):
+            edge = j % 4
+            t = rng.random()
+            px, py = [(x + t * w, y), (x + w, y + t * h), (x + t * w, y + h), (x, y + t * h)][edge]
+            ports.append({"name": f"p{j}", "coord": [int(px), int(py)]})
+        comps[f"U{i}"] = {"type": rng.choice(("IC", "R", "C", "L", "D", "Q")), "box": [x, y, x + w, y + h], "ports": ports}
+    ext = {}
+    for i in range(n_external):
+        t = rng.randint(0, side)
+        ext[f"EXT{i}"] = {"type": "in" if i % 2 else "out", "coord": rng.choice([[t, 0], [t, side], [0, t], [side, t]])}
+    names, ext_names = list(comps), list(ext)
+    conns = []
+    for _ in range(n_nets):
+        # 节点数为 2 + 均值 fanout - 2 的几何分布，近似真实网表中大量两端连接、少量大扇出的情况
+        k = min(2 + int(rng.expovariate(1 / (fanout - 2))), 64) if fanout > 2 else 2
+        nodes, seen = [], set()
+        for _ in range(k):
+            if ext_names and rng.random() < 0.02: node = ("external", rng.choice(ext_names))
+            elif ports_per_comp: node = (rng.choice(names), f"p{rng.randrange(ports_per_comp)}")
+            else: continue
+            if node in seen: continue
+            seen.add(node)
+            nodes.append({"component": node[0], "port": node[1]})
+        if invalid_ratio and rng.random() < invalid_ratio * len(nodes):
+            nodes.insert(rng.randrange(len(nodes) + 1), {"component": rng.choice(names + ["missing"]), "port": "nope"})
+        conns.append({"nodes": nodes, "points": []})
+    return {"components": comps, "external_ports": ext, "connections": conns}
+
+def measure(run, repeat, setup=None):
+    """每次计时前调用 setup() 准备参数 (不计入耗时)，返回每次耗时 (ms) 的列表"""
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        run(arg)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def bench(data, repeat, seed=0):
+    """对一份数据跑全部用例，返回 {用例: [每次耗时 ms]}"""
+    rng = random.Random(seed)
+    viz = SystemBlockViz(copy.deepcopy(data))
+    names = list(viz.data["components"])
+    ports = [(c, p["name"]) for c in names for p in viz.data["components"][c]["ports"]]
+    xs = [c for info in viz.data["components"].values() for c in info["box"][0::2]] or [0]
+    ys = [c for info in viz.data["components"].values() for c in info["box"][1::2]] or [0]
+    points = [(rng.uniform(min(xs), max(xs)), rng.uniform(min(ys), max(ys))) for _ in range(1000)]
+    k = min(100, len(names) // 2)
+    fresh = lambda: SystemBlockViz(copy.deepcopy(data))
+    results = {}
+
+    results["init"] = measure(lambda d: SystemBlockViz(d), repeat, lambda: copy.deepcopy(data))
+    results["validate_connections"] = measure(lambda v: v.validate_connections(), repeat, lambda: _bare(data))
+    results["hit_test x1000"] = measure(lambda _: [viz.hit_test(x, y) for x, y in points], repeat)
+    n_conns = len(viz.data["connections"])
+    results["centroid all nets"] = measure(lambda _: [viz.get_connection_centroid(i) for i in range(n_conns)], repeat)
+    results["clone_data"] = measure(lambda _: viz.clone_data(), repeat)
+    pairs = [(rng.choice(ports), rng.choice(ports)) for _ in range(k)] if ports else []
+    results[f"connect_nodes x{k}"] = measure(
+        lambda v: [v.connect_nodes({"comp": a[0], "port": a[1]}, {"comp": b[0], "port": b[1]}) for a, b in pairs if a != b], repeat, fresh)
+    results[f"rename_component x{k}"] = measure(lambda v: [v.rename_component(n, n + "_r") for n in names[:k]], repeat, fresh)
+    results[f"delete_component x{k}"] = measure(lambda v: [v.delete_component(n) for n in names[:k]], repeat, fresh)
+    # export_json 按版本缓存，每次计时前先改动一处让缓存失效
+    results["export_json"] = measure(lambda _: viz.export_json(), repeat, lambda: viz.update_component_type(names[0], str(rng.random())))
+    # 与 refresh_canvas 相同的 SVG 生成：首次打开 (整图) 与一次编辑后的重绘
+    results["svg full"] = measure(lambda r: (r.markup(), r.highlight(None)), repeat, lambda: SvgRenderer(viz))
+    renderer = SvgRenderer(viz)
+    renderer.markup()
+    results["svg edit"] = measure(lambda _: (renderer.markup(), renderer.highlight({"type": "component", "name": names[-1]})), repeat,
+                                  lambda: viz.update_component_type(names[rng.randrange(len(names))], str(rng.random())))
+    return results
+
+def _bare(data):
+    """只带数据、不建索引的实例，用于单独测量 validate_connections"""
+    viz = SystemBlockViz.__new__(SystemBlockViz)
+    viz.data = copy.deepcopy(data)
+    viz.ensure_structure()
+    return viz
+
+def summarize(times):
+    return {"median_ms": round(statistics.median(times), 4), "min_ms": round(min(times), 4), "runs": len(times)}
+
+def compare(results, baseline, threshold):
+    """返回 [(规模, 用例, 当前中位数, 基线中位数, 比值, 是否回归)]"""
+    rows = []
+    for size, cases in results.items():
+        for case, stat in cases.items():
+            base = baseline.get("results", {}).get(size, {}).get(case)
+            if not base or not base["median_ms"]: continue
+            ratio = stat["median_ms"] / base["median_ms"]
+            rows.append((size, case, stat["median_ms"], base["median_ms"], ratio, ratio > 1 + threshold))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="viz_core 微基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000], help="组件数")
+    parser.add_argument("--ports", type=int, default=4, help="每个组件的端口数")
+    parser.add_argument("--nets", type=int, default=None, help="连接数 (默认组件数 / 2)")
+    parser.add_argument("--fanout", type=float, default=3, help="每条连接的平均节点数")
+    parser.add_argument("--external", type=int, default=16, help="外部端口数")
+    parser.add_argument("--invalid", type=float, default=0.05, help="无效节点比例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="把结果写入此 JSON 文件")
+    parser.add_argument("--save-baseline", help="把结果保存为基线")
+    parser.add_argument("--baseline", help="与此基线比较")
+    parser.add_argument("--threshold", type=float, default=0.25, help="中位数比基线慢超过此比例视为回归")
+    parser.add_argument("--fail-on-regression", action="store_true", help="有回归时以状态码 1 退出")
+    args = parser.parse_args()
+
+    params = {"ports": args.ports, "nets": args.nets, "fanout": args.fanout, "external": args.external, "invalid": args.invalid, "seed": args.seed}
+    results = {}
+    for n in args.sizes:
+        data = make_circuit(n, args.ports, args.nets, args.fanout, args.external, args.invalid, args.seed)
+        results[str(n)] = {case: summarize(times) for case, times in bench(data, args.repeat, args.seed).items()}
+    report = {"meta": {"python": sys.version.split()[0], "numpy": np.__version__, "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%d %H:%M:%S"), "repeat": args.repeat, "params": params},
+              "results": results}
+
+    labels = list(next(iter(results.values())))
+    print(f"{'median ms':<24}" + "".join(f"{n:>12}" for n in results))
+    for label in labels:
+        print(f"{label:<24}" + "".join(f"{results[n][label]['median_ms']:>12.3f}" for n in results))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f: baseline = json.load(f)
+        if baseline.get("meta", {}).get("params") != params: print("注意: 基线的生成参数与本次不同")
+        rows = compare(results, baseline, args.threshold)
+        print(f"\n{'vs baseline':<24}{'size':>8}{'now':>12}{'base':>12}{'ratio':>8}")
+        for size, case, now, base, ratio, bad in rows:
+            print(f"{case:<24}{size:>8}{now:>12.3f}{base:>12.3f}{ratio:>8.2f}" + ("  REGRESSION" if bad else ""))
+        regressions = [r for r in rows if r[5]]
+        report["regressions"] = [{"size": r[0], "case": r[1], "ratio": round(r[4], 3)} for r in regressions]
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f: json.dump(report, f, indent=2, ensure_ascii=False)
+    if regressions and args.fail_on_regression: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
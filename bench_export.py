@@ -0,0 +1,42 @@
+"""
+导出格式基准：比较各格式 (见 viz_codec) 在大图上的体积与编码/解码耗时，以及按版本缓存后重复导出的开销。
+用法: python bench_export.py [--sizes 1000 5000 20000] [--repeat 5]
+"""
+import argparse
+import time
+import viz_codec
+from viz_core import SystemBlockViz
+from bench_render import make_diagram
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat): result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+def bench(n_comps, repeat):
+    viz = SystemBlockViz(make_diagram(n_comps))
+    rows = {}
+    for fmt in viz_codec.FORMATS:
+        enc_ms, payload = timed(lambda: viz_codec.dumps(viz.data, fmt), repeat)
+        dec_ms, decoded = timed(lambda: viz_codec.loads(payload, fmt), repeat)
+        assert decoded == viz.data
+        viz.export(fmt)
+        cached_ms, _ = timed(lambda: viz.export(fmt), repeat)
+        rows[fmt] = (len(payload), enc_ms, dec_ms, cached_ms)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for n in args.sizes:
+        rows = bench(n, args.repeat)
+        print(f"{n} components")
+        print(f"  {'format':<10}{'KB':>10}{'vs json':>10}{'encode ms':>12}{'decode ms':>12}{'cached ms':>12}")
+        base = rows["json"][0]
+        for fmt, (size, enc, dec, cached) in rows.items():
+            print(f"  {fmt:<10}{size / 1024:>10.1f}{size / base:>10.2f}{enc:>12.2f}{dec:>12.2f}{cached:>12.4f}")
+
+if __name__ == "__main__":
+    main()
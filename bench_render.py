@@ -0,0 +1,84 @@
+"""
+SvgRenderer 重绘开销基准：对比整图重建与增量重绘，观察开销随改动元素数而非图规模增长；
+以及编辑器静态文档 (markup) 整图下发与按视口裁剪、按缩放简化后的开销，和编辑一处后重画一张栅格瓦片的开销。
+用法: python bench_render.py [--sizes 1000 5000 20000] [--repeat 20]
+"""
+import argparse
+import random
+import time
+from viz_core import SystemBlockViz
+from viz_render import SvgRenderer, view_region
+from viz_raster import TileRenderer
+
+def make_diagram(n_comps, ports_per_comp=2, seed=0):
+    rng = random.Random(seed)
+    side = int((n_comps ** 0.5) * 120) + 200
+    comps = {}
+    for i in range(n_comps):
+        x, y = rng.randint(0, side), rng.randint(0, side)
+        w, h = rng.randint(20, 100), rng.randint(20, 100)
+        comps[f"U{i}"] = {"type": "IC", "box": [x, y, x + w, y + h],
+                          "ports": [{"name": f"p{j}", "coord": [x + rng.randint(0, w), y + rng.randint(0, h)]} for j in range(ports_per_comp)]}
+    names = list(comps)
+    conns = []
+    for i in range(n_comps // 2):
+        a, b = rng.sample(names, 2)
+        conns.append({"nodes": [{"component": a, "port": "p0"}, {"component": b, "port": "p1"}], "points": []})
+    return {"components": comps, "external_ports": {}, "connections": conns}
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for i in range(repeat): fn(i)
+    return (time.perf_counter() - start) / repeat * 1000
+
+def bench(n_comps, repeat):
+    viz = SystemBlockViz(make_diagram(n_comps))
+    renderer = SvgRenderer(viz)
+    names = list(viz.data["components"])
+    rows = {}
+    # 整图重建：每次新建渲染器，相当于原先每次都重新拼接所有元素
+    rows["full rebuild"] = timed(lambda i: SvgRenderer(viz).render({"type": "component", "name": names[i]}), repeat)
+    renderer.render()
+    for name in names[:2]: renderer.render({"type": "component", "name": name})
+    # 在两个对象间来回切换选中：命中文档 LRU
+    rows["toggle selection"] = timed(lambda i: renderer.render({"type": "component", "name": names[i % 2]}), repeat)
+    # 每次选中新对象：只替换高亮元素的片段
+    rows["new selection"] = timed(lambda i: renderer.render({"type": "component", "name": names[100 + i]}), repeat)
+    # 修改 k 个组件后重绘：只重新生成这些组件的片段
+    for k in (1, 10, 100):
+        def edit_and_render(i):
+            for name in names[i * k:(i + 1) * k]:
+                viz.update_component_type(name, "edited")
+            renderer.render()
+        rows[f"edit {k} + render"] = timed(edit_and_render, repeat)
+    # 编辑一处后重新生成 markup：整图，与 1200x800 像素的视口位于图中央、不同缩放比例下的裁剪文档
+    side = max(max(info["box"][2], info["box"][3]) for info in viz.data["components"].values())
+    rows["edit 1 + markup"] = timed(lambda i: (viz.update_component_type(names[i], "m"), renderer.markup()), repeat)
+    for scale in (1.0, 0.3, 0.1):
+        w, h = 1200 / scale, 800 / scale
+        view = (view_region((side / 2 - w / 2, side / 2 - h / 2, side / 2 + w / 2, side / 2 + h / 2)), scale)
+        renderer.markup(view)
+        rows[f"edit 1 + view x{scale}"] = timed(lambda i: (viz.update_component_type(names[i], f"v{scale}"), renderer.markup(view)), repeat)
+    # 栅格瓦片：重命名一个组件后重画它所在的 1:1 瓦片 (其它瓦片仍命中缓存)
+    tiles = TileRenderer(viz)
+    tiles.tile(0, 0, 0)
+    def rename_and_tile(i):
+        box = viz.data["components"][names[i]]["box"]
+        viz.rename_component(names[i], names[i] + "_t")
+        tiles.tile(0, int(box[0] // 256), int(box[1] // 256))
+    rows["edit 1 + tile"] = timed(rename_and_tile, repeat)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    results = {n: bench(n, args.repeat) for n in args.sizes}
+    labels = list(next(iter(results.values())))
+    print(f"{'ms / redraw':<20}" + "".join(f"{n:>12}" for n in args.sizes))
+    for label in labels:
+        print(f"{label:<20}" + "".join(f"{results[n][label]:>12.3f}" for n in args.sizes))
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import gradio as gr
 import requests
+import httpx
+import os
 import json
-import base64
 
 # ================= 配置区 =================
 NICEGUI_HOST = "http://localhost:8060" 
@@ -15,21 +16,11 @@ def init_session_api(image, json_input):
     if image is None or not json_input:
         return None, "⚠️ 请先上传图片和JSON", None, gr.Timer(active=False)
     
-    # 图片转 Base64
     try:
+        # 以 multipart 直接上传图片文件 (不再 base64 编码，服务端按块写入图片仓库)
         with open(image, "rb") as f:
-            img_b64 = "data:image/png;base64," + base64.b64encode(f.read()).decode("utf-8")
-    except Exception as e:
-        return None, f"❌ 图片读取失败: {e}", None, gr.Timer(active=False)
-
-    payload = {
-        "image_b64": img_b64,
-        "json_str": json_input
-    }
-    
-    try:
-        # 请求 NiceGUI 服务
-        response = requests.post(f"{NICEGUI_HOST}/api/init_session", json=payload)
+            response = requests.post(f"{NICEGUI_HOST}/api/init_session_upload",
+                                     files={"image": (os.path.basename(image), f)}, data={"json_str": json_input})
         
         if response.status_code != 200:
             return None, f"❌ 服务端错误: {response.text}", None, gr.Timer(active=False)
@@ -47,15 +38,53 @@ def init_session_api(image, json_input):
         </div>
         """
         
-        # 关键：返回 gr.Timer(active=True) 启动轮询
-        return session_id, "⏳ 会话已建立，正在等待标注结果...", html_link, gr.Timer(active=True, value=1)
+        # 结果由 wait_result_api 等待推送，定时器只在推送不可用时启动
+        return session_id, "⏳ 会话已建立，正在等待标注结果...", html_link, gr.Timer(active=False)
         
     except Exception as e:
         return None, f"❌ 连接失败 (检查 viz_server.py 是否运行): {e}", None, gr.Timer(active=False)
 
+def handle_result(data):
+    """把 get_result 的返回转换成界面更新：(结果 JSON, 状态, 定时器)"""
+    if data["status"] == "done":
+        # ✅ 成功拿到结果
+        new_json = json.dumps(json.loads(data["json"]), indent=2, ensure_ascii=False)
+        # 更新 JSON 内容，更新状态，**关闭定时器**
+        return new_json, "✅ 标注完成！结果已更新。", gr.Timer(active=False)
+    
+    elif data["status"] == "expired":
+        return gr.update(), "⌛ 会话已过期，请重新提交", gr.Timer(active=False)
+    
+    elif data["status"] == "error":
+        return gr.update(), f"❌ 错误: {data.get('msg')}", gr.Timer(active=False)
+    
+    else:
+        # ⏳ 还在标注中，保持定时器开启
+        return gr.update(), "⏳ 正在 NiceGUI 中标注... (请在弹出的页面点击保存)", gr.Timer(active=True)
+
+async def wait_result_api(session_id):
+    """
+    等待结果：订阅服务端的 SSE 推送，标注页面保存后立即拿到结果，等待期间没有轮询请求。
+    推送不可用时 (旧版服务端、连接中断) 启动定时器，退回到每秒轮询。
+    """
+    if not session_id:
+        return gr.update(), gr.update(), gr.Timer(active=False)
+    try:
+        # 服务端每 15 秒发送一次心跳，读超时留足余量
+        async with httpx.AsyncClient(timeout=httpx.Timeout(10, read=60)) as client:
+            async with client.stream("GET", f"{NICEGUI_HOST}/api/result_stream/{session_id}") as res:
+                if res.status_code != 200:
+                    raise RuntimeError(f"HTTP {res.status_code}")
+                async for line in res.aiter_lines():
+                    if line.startswith("data:"):
+                        return handle_result(json.loads(line[5:]))
+        raise RuntimeError("推送连接已关闭")
+    except Exception:
+        return gr.update(), "⏳ 正在 NiceGUI 中标注... (推送不可用，改为定时查询)", gr.Timer(active=True, value=1)
+
 def check_result_api(session_id):
     """
-    轮询函数：
+    轮询函数 (推送不可用时的后备)：
     - 如果拿到结果：更新 JSON，并关闭定时器。
     - 如果还在做：保持定时器开启。
     """
@@ -64,20 +93,7 @@ def check_result_api(session_id):
     
     try:
         res = requests.get(f"{NICEGUI_HOST}/api/get_result", params={"session_id": session_id})
-        data = res.json()
-        
-        if data["status"] == "done":
-            # ✅ 成功拿到结果
-            new_json = json.dumps(json.loads(data["json"]), indent=2, ensure_ascii=False)
-            # 更新 JSON 内容，更新状态，**关闭定时器**
-            return new_json, "✅ 标注完成！结果已更新。", gr.Timer(active=False)
-        
-        elif data["status"] == "error":
-            return gr.update(), f"❌ 错误: {data.get('msg')}", gr.Timer(active=False)
-        
-        else:
-            # ⏳ 还在标注中，保持定时器开启
-            return gr.update(), "⏳ 正在 NiceGUI 中标注... (请在弹出的页面点击保存)", gr.Timer(active=True)
+        return handle_result(res.json())
             
     except Exception as e:
         return gr.update(), f"❌ 轮询错误: {e}", gr.Timer(active=False)
@@ -106,23 +122,28 @@ with gr.Blocks(title="电路图修正系统", theme=gr.themes.Soft()) as demo:
             # 结果显示区
             result_output = gr.Code(language="json", label="3. 修正后的结果 (自动刷新)", lines=25)
 
-    # 定时器 (初始状态为关闭)
+    # 定时器 (初始状态为关闭，只作为推送不可用时的后备轮询)
     timer = gr.Timer(active=False)
 
     # --- 交互逻辑 ---
 
-    # 1. 点击按钮 -> 发送请求 -> 启动定时器 -> 触发 JS 跳转
+    # 1. 点击按钮 -> 发送请求 -> 触发 JS 跳转 -> 等待结果推送
     btn_annotate.click(
         fn=init_session_api,
         inputs=[img_input, json_input],
-        outputs=[state_session_id, status_box, link_output, timer] # 更新 timer 状态为 active=True
+        outputs=[state_session_id, status_box, link_output, timer]
     ).then(
         fn=None,
         inputs=[state_session_id],
         js=f"(s) => {{ if(s) window.open('{NICEGUI_HOST}/edit/' + s, '_blank'); }}", # JS 自动跳转
+    ).then(
+        fn=wait_result_api,
+        inputs=[state_session_id],
+        outputs=[result_output, status_box, timer],
+        concurrency_limit=None, # 等待是异步的，不占用工作线程，各标签页互不阻塞
     )
 
-    # 2. 定时器每秒触发一次 check_result_api
+    # 2. 推送不可用时，定时器每秒触发一次 check_result_api
     # check_result_api 会返回新的 JSON 和 新的 Timer 状态 (完成时设为 False)
     timer.tick(
         fn=check_result_api,
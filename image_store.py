@@ -0,0 +1,184 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+from PIL import Image
+
+IMAGE_ROUTE = "/api/image"
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+
+def image_url(digest):
+    return f"{IMAGE_ROUTE}/{digest}"
+
+def image_digest(url):
+    """从图片地址取回内容哈希；不是图片仓库地址 (例如旧的 data: URL) 时返回 None"""
+    if not url or not url.startswith(IMAGE_ROUTE + "/"): return None
+    return url[len(IMAGE_ROUTE) + 1:]
+
+def write_image_file(root, digest, data, mime):
+    """按仓库格式 (第一行 mime，之后是原始字节) 原子地写入 root/<hash>，多个进程同时写同一张图也安全"""
+    path = os.path.join(root, digest)
+    if os.path.exists(path): return
+    fd, tmp = tempfile.mkstemp(dir=root, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f: f.write(mime.encode() + b"\n" + data)
+    os.replace(tmp, path)
+
+class ImageTooLarge(ValueError):
+    pass
+
+def probe_image(head):
+    """只根据文件开头的字节读出 (宽, 高, mime)，不解码像素；识别不了时返回 None"""
+    try:
+        img = Image.open(io.BytesIO(head))
+        return img.size[0], img.size[1], Image.MIME.get(img.format, "application/octet-stream")
+    except Exception:
+        return None
+
+class ImageWriter:
+    """
+    流式写入一张图片：边接收边计算哈希，字节直接写入仓库目录下的临时文件 (无 root 时写入溢出到磁盘的临时文件)，
+    内存中只保留开头 HEAD_BYTES 用于探测尺寸。超过 max_bytes 或像素数超过 max_pixels 时立即抛出 ImageTooLarge。
+    """
+    HEAD_BYTES = 256 << 10
+
+    def __init__(self, store, max_bytes, max_pixels=None):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.size = 0
+        self.info = None   # (宽, 高, mime)
+        self._hash = hashlib.sha256()
+        self._head = bytearray()
+        if store.root:
+            fd, self._tmp = tempfile.mkstemp(dir=store.root, suffix=".tmp")
+            self._file = os.fdopen(fd, "wb")
+        else:
+            self._tmp, self._file = None, tempfile.SpooledTemporaryFile(max_size=1 << 20)
+
+    def _probe(self):
+        self.info = probe_image(bytes(self._head))
+        if self.info is None: raise ValueError("无法识别的图片格式")
+        w, h, mime = self.info
+        if self.max_pixels and w * h > self.max_pixels: raise ImageTooLarge(f"图片像素过多: {w}x{h}")
+        # 仓库文件的第一行是 mime，之后是原始字节
+        if self._tmp: self._file.write(mime.encode() + b"\n")
+        self._file.write(self._head)
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes: raise ImageTooLarge(f"图片超过 {self.max_bytes} 字节")
+        self._hash.update(chunk)
+        if self.info is None:
+            self._head += chunk
+            if len(self._head) >= self.HEAD_BYTES: self._probe()
+        else:
+            self._file.write(chunk)
+
+    def commit(self):
+        """完成写入，返回 (内容哈希, 宽, 高)"""
+        if self.info is None: self._probe()
+        digest = self._hash.hexdigest()
+        w, h, mime = self.info
+        store = self.store
+        if self._tmp:
+            self._file.close()
+            if os.path.exists(store._path(digest)):
+                os.remove(self._tmp)
+                store.stats["deduplicated"] += 1
+            else:
+                os.replace(self._tmp, store._path(digest))
+                store.stats["stored"] += 1
+        else:
+            self._file.seek(0)
+            store.put(self._file.read(), mime)
+            self._file.close()
+        return digest, w, h
+
+    def abort(self):
+        self._file.close()
+        if self._tmp and os.path.exists(self._tmp): os.remove(self._tmp)
+
+class ImageStore:
+    """
+    按内容哈希 (sha256) 去重的图片仓库：同一张图无论被多少个会话引用，内存中只保留一份字节。
+    会话加载时 incref、卸载时 decref，引用数归零即释放内存。
+    指定 root 时图片同时写入 root/<hash> 文件，供其它进程和重启后按需读取；
+    不再被任何会话记录引用的文件由 gc() 清理。
+    """
+    GC_MIN_AGE = 3600   # 刚写入的文件可能属于其它进程尚未落盘的会话，暂不清理
+
+    def __init__(self, root=None):
+        self.root = root
+        self._images = {}   # digest -> [bytes, mime, refcount]
+        if root: os.makedirs(root, exist_ok=True)
+        self.stats = {"stored": 0, "deduplicated": 0, "released": 0, "disk_reads": 0, "collected": 0}
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest)
+
+    def put(self, data, mime="image/png"):
+        """保存图片字节并返回内容哈希；已存在时不重复保存。引用数由会话加载时 incref 增加"""
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in self._images or (self.root and os.path.exists(self._path(digest))):
+            self.stats["deduplicated"] += 1
+        else:
+            self.stats["stored"] += 1
+            if self.root: write_image_file(self.root, digest, data, mime)
+        if digest not in self._images: self._images[digest] = [data, mime, 0]
+        return digest
+
+    def writer(self, max_bytes, max_pixels=None):
+        """流式写入的入口，见 ImageWriter"""
+        return ImageWriter(self, max_bytes, max_pixels)
+
+    def _read(self, digest):
+        if not self.root or not DIGEST_RE.fullmatch(digest) or not os.path.exists(self._path(digest)): return None
+        self.stats["disk_reads"] += 1
+        with open(self._path(digest), "rb") as f: mime, data = f.read().split(b"\n", 1)
+        return [data, mime.decode(), 0]
+
+    def get(self, digest):
+        """返回 (bytes, mime)，不存在时返回 None；未被引用的图片只从磁盘读出，不常驻内存"""
+        entry = self._images.get(digest) or self._read(digest)
+        return (entry[0], entry[1]) if entry else None
+
+    def incref(self, digest):
+        entry = self._images.get(digest)
+        if entry is None:
+            entry = self._read(digest)
+            if entry is None: return False
+            self._images[digest] = entry
+        entry[2] += 1
+        return True
+
+    def decref(self, digest):
+        entry = self._images.get(digest)
+        if entry is None: return
+        entry[2] -= 1
+        if entry[2] <= 0:
+            del self._images[digest]
+            self.stats["released"] += 1
+
+    def discard(self, digest):
+        """放弃刚写入、还没有会话引用的图片 (例如创建会话失败)；已被其它会话引用时不受影响"""
+        entry = self._images.get(digest)
+        if entry is not None and entry[2] <= 0:
+            del self._images[digest]
+            self.stats["released"] += 1
+
+    def gc(self, live):
+        """删除既不在 live (所有会话记录引用的哈希) 中、也没有被当前进程引用的图片文件"""
+        if not self.root: return
+        cutoff = time.time() - self.GC_MIN_AGE
+        for name in os.listdir(self.root):
+            path = self._path(name)
+            if name in live or name in self._images or os.path.getmtime(path) > cutoff: continue
+            try: os.remove(path)
+            except OSError: continue
+            self.stats["collected"] += 1
+
+    def info(self):
+        return dict(self.stats, images=len(self._images), image_bytes=sum(len(e[0]) for e in self._images.values()),
+                    image_refs=sum(e[2] for e in self._images.values()))
@@ -4,16 +4,17 @@ import base64
 import io
 from PIL import Image
 from viz_core import SystemBlockViz
+from viz_render import SvgRenderer, HIGHLIGHT_HEAD_HTML
 
 app_state = {
     "viz": None,
+    "renderer": None,
     "mode": "VIEW",       
     "img_src": None,      
     "img_size": (1000, 1000), 
     "selected": None,     
-    "temp_draw": None,    
     "connect_start": None,
-    "history": [],
+    "sent_highlight": None,
     "zoom": 1.0,
     "ui": {
         "img": None,      
@@ -21,32 +22,38 @@ app_state = {
         "info_panel": None, 
         "mode_btns": {},  
         "ref_img": None,  
-        "undo_btn": None
+        "undo_btn": None,
+        "redo_btn": None
     }
 }
 
 # --- Undo/Redo ---
 def save_history():
+    # 只标记撤销分组的边界，具体的逆操作由 viz 在编辑时记录
     if not app_state["viz"]: return
-    app_state["history"].append(app_state["viz"].clone_data())
-    if len(app_state["history"]) > 20: app_state["history"].pop(0)
-    update_undo_btn()
+    app_state["viz"].checkpoint()
 
 def undo():
-    if not app_state["history"]: return
-    prev_data = app_state["history"].pop()
-    app_state["viz"].restore_data(prev_data)
+    if not app_state["viz"] or not app_state["viz"].undo(): return
     app_state["selected"] = None
-    update_undo_btn()
     update_info_panel(None)
     refresh_canvas()
     ui.notify("已撤销")
 
-def update_undo_btn():
-    btn = app_state["ui"]["undo_btn"]
-    if btn:
-        if app_state["history"]: btn.enable()
-        else: btn.disable()
+def redo():
+    if not app_state["viz"] or not app_state["viz"].redo(): return
+    app_state["selected"] = None
+    update_info_panel(None)
+    refresh_canvas()
+    ui.notify("已重做")
+
+def update_history_btns():
+    viz = app_state["viz"]
+    for key, ok in (("undo_btn", viz and viz.can_undo()), ("redo_btn", viz and viz.can_redo())):
+        btn = app_state["ui"][key]
+        if btn:
+            if ok: btn.enable()
+            else: btn.disable()
 
 # --- Zoom ---
 def set_zoom(val):
@@ -63,7 +70,9 @@ def set_mode(mode):
     app_state["mode"] = mode
     app_state["selected"] = None
     app_state["connect_start"] = None
-    app_state["temp_draw"] = None
+    # 画框预览在浏览器中绘制，只需切换开关
+    img = app_state["ui"]["img"]
+    if img: img.client.run_javascript(f'vizDrawMode({json.dumps(img.html_id)}, {json.dumps(mode == "ADD_COMP")})')
     btns = app_state["ui"]["mode_btns"]
     for k, btn in btns.items():
         if k == mode: btn.props('color=primary')
@@ -98,8 +107,8 @@ def handle_json_upload(e: events.UploadEventArguments):
     try:
         content = e.content.read().decode('utf-8')
         app_state["viz"] = SystemBlockViz(content)
-        app_state["history"] = []
-        update_undo_btn()
+        app_state["renderer"] = SvgRenderer(app_state["viz"])
+        update_history_btns()
         refresh_canvas()
         ui.notify("JSON 数据已加载")
         set_mode('VIEW')
@@ -139,6 +148,7 @@ def on_component_type_change(new_val):
     if not sel: return
     save_history()
     app_state["viz"].update_component_type(sel["name"], new_val)
+    update_history_btns()
 
 def on_port_rename(new_val):
     sel = app_state["selected"]
@@ -180,110 +190,27 @@ def update_info_panel(hit):
         ui.button('删除', on_click=delete_selection, color='red', icon='delete').classes('w-full')
 
 # --- Rendering ---
-def refresh_canvas(draw_only_temp=False):
+def refresh_canvas():
     img_comp = app_state["ui"]["img"]
     w, h = app_state["img_size"]
     if not img_comp: return
+    update_history_btns()
     
     svg_content = ""
     
-    if not draw_only_temp and app_state["viz"]:
-        viz = app_state["viz"]
-        sel = app_state["selected"]
-        dim_mode = (sel is not None)
-
-        # 1. 组件
-        sorted_comps = viz.get_component_list_sorted()
-        for comp in reversed(sorted_comps):
-            name = comp["name"]
-            box = comp["info"]["box"]
-            bx, by = min(box[0], box[2]), min(box[1], box[3])
-            bw, bh = abs(box[2]-box[0]), abs(box[3]-box[1])
-            fill_opacity = 0.05
-            stroke = "blue"; sw = 2
-            if dim_mode:
-                is_target = (sel["type"] == "component" and sel["name"] == name)
-                if is_target: stroke = "red"; sw = 4; fill_opacity = 0
-                else: stroke = "rgba(0,0,255,0.3)"; fill_opacity = 0.02
-            svg_content += f'<rect x="{bx}" y="{by}" width="{bw}" height="{bh}" fill="rgba(0,0,255,{fill_opacity})" stroke="{stroke}" stroke-width="{sw}" />'
-            if not dim_mode or (sel["type"] == "component" and sel["name"] == name):
-                svg_content += f'<text x="{bx}" y="{by-5}" fill="{stroke}" font-size="16" font-weight="bold">{name}</text>'
-
-        # 2. 连线 (全新高亮逻辑)
-        for idx, conn in enumerate(viz.data["connections"]):
-            center = viz.get_connection_centroid(idx)
-            if not center: continue
-            
-            # --- 判定逻辑 ---
-            # network_high: 是否高亮整个网络
-            network_high = False
-            
-            if sel:
-                # 1. 选中中心 -> 高亮全网
-                if sel["type"] == "conn_center" and sel["index"] == idx:
-                    network_high = True
-                # 2. 选中组件 -> 高亮与该组件相关的所有网络
-                elif sel["type"] == "component":
-                    for node in conn["nodes"]:
-                        if node["component"] == sel["name"]:
-                            network_high = True; break
-                # 3. 选中端口 -> 高亮与该端口相关的所有网络
-                elif sel["type"] == "port":
-                     for node in conn["nodes"]:
-                        if node["component"] == sel["comp"] and node["port"] == sel["port"]:
-                            network_high = True; break
-            
-            # 绘制中心
-            c_color = "red" if network_high else ("#00cc00" if not dim_mode else "rgba(0,200,0,0.2)")
-            svg_content += f'<circle cx="{center[0]}" cy="{center[1]}" r="{6 if network_high else 4}" fill="{c_color}" stroke="white" stroke-width="1" />'
-
-            # 绘制分支线
-            for node in conn["nodes"]:
-                p_coord = viz.get_port_coord(node["component"], node["port"])
-                if p_coord:
-                    # 单根线高亮判定
-                    edge_high = False
-                    
-                    if network_high: 
-                        edge_high = True # 如果全网高亮，线也高亮
-                    elif sel and sel["type"] == "conn_edge" and sel["index"] == idx:
-                        # 如果只选中了这一根线
-                        if sel["node"]["component"] == node["component"] and sel["node"]["port"] == node["port"]:
-                            edge_high = True
-                    
-                    l_color = "red" if edge_high else ("#00cc00" if not dim_mode else "rgba(0,200,0,0.2)")
-                    l_width = 4 if edge_high else 2
-                    
-                    svg_content += f'<line x1="{p_coord[0]}" y1="{p_coord[1]}" x2="{center[0]}" y2="{center[1]}" stroke="{l_color}" stroke-width="{l_width}" />'
-
-        # 3. 端口 (外部端口修复)
-        all_ports = []
-        for pname, pinfo in viz.data["external_ports"].items(): all_ports.append({"comp": "external", "name": pname, "coord": pinfo["coord"], "type": "ext"})
-        for cname, cinfo in viz.data["components"].items():
-            for p in cinfo["ports"]: all_ports.append({"comp": cname, "name": p["name"], "coord": p["coord"], "type": "int"})
-        
-        for p in all_ports:
-            cx, cy = p["coord"]
-            is_ext = (p["type"] == "ext")
-            r = 10 if is_ext else 5 # 外部端口画大一点
-            
-            p_high = False
-            if sel and sel["type"] == "port" and sel["comp"] == p["comp"] and sel["port"] == p["name"]: p_high = True
-            if app_state["connect_start"] and app_state["connect_start"]["comp"] == p["comp"] and app_state["connect_start"]["port"] == p["name"]: p_high = True
-            
-            fill = "yellow" if p_high else ("orange" if is_ext else "purple")
-            stroke = "black" if p_high else "white"
-            if dim_mode and not p_high: fill = "#cccccc"
-            
-            svg_content += f'<circle cx="{cx}" cy="{cy}" r="{r}" fill="{fill}" stroke="{stroke}" stroke-width="{2 if p_high else 1}" />'
+    if app_state["viz"]:
+        # 静态文档只随数据版本变化，内容不变时不会重新下发；选中高亮只推送 class 切换
+        svg_content = app_state["renderer"].markup()
+        push_highlight()
 
-    if app_state["temp_draw"]:
-        s, c = app_state["temp_draw"]['start'], app_state["temp_draw"]['curr']
-        x, y = min(s[0], c[0]), min(s[1], c[1])
-        w_box, h_box = abs(s[0]-c[0]), abs(s[1]-c[1])
-        svg_content += f'<rect x="{x}" y="{y}" width="{w_box}" height="{h_box}" fill="none" stroke="red" stroke-width="3" stroke-dasharray="5,5" />'
+    img_comp.content = f'<svg class="viz" viewBox="0 0 {w} {h}">{svg_content}</svg>'
 
-    img_comp.content = f'<svg viewBox="0 0 {w} {h}">{svg_content}</svg>'
+def push_highlight():
+    img_comp = app_state["ui"]["img"]
+    hl = app_state["renderer"].highlight(app_state["selected"], app_state["connect_start"])
+    if hl == app_state["sent_highlight"]: return
+    app_state["sent_highlight"] = hl
+    img_comp.client.run_javascript(f'vizHighlight({json.dumps(img_comp.html_id)}, {json.dumps(hl)})')
 
 # --- Interaction ---
 async def open_add_comp_dialog(box):
@@ -318,25 +245,22 @@ async def open_add_port_dialog(comp_name, coord):
             ui.button('确定', on_click=on_confirm)
     dialog.open()
 
+async def handle_draw_box(e):
+    img = app_state["ui"]["img"]
+    if not app_state["viz"] or not img or e.args.get("id") != img.html_id or app_state["mode"] != 'ADD_COMP': return
+    box = e.args["box"]
+    if abs(box[2]-box[0]) > 5: await open_add_comp_dialog(box)
+
 async def handle_mouse(e: events.MouseEventArguments):
     if not app_state["viz"]: return
     viz = app_state["viz"]
     mode = app_state["mode"]
     x, y = e.image_x, e.image_y
 
-    if mode == 'ADD_COMP':
-        if e.type == 'mousedown': app_state["temp_draw"] = {'start': (x, y), 'curr': (x, y)}
-        elif e.type == 'mousemove' and app_state["temp_draw"]:
-            app_state["temp_draw"]['curr'] = (x, y)
-            refresh_canvas(draw_only_temp=True) 
-        elif e.type == 'mouseup' and app_state["temp_draw"]:
-            s, end = app_state["temp_draw"]['start'], (x, y)
-            box = [min(s[0], end[0]), min(s[1], end[1]), max(s[0], end[0]), max(s[1], end[1])]
-            app_state["temp_draw"] = None
-            refresh_canvas()
-            if abs(box[2]-box[0]) > 5: await open_add_comp_dialog(box)
+    # 画框由浏览器处理 (见 handle_draw_box)
+    if mode == 'ADD_COMP': return
 
-    elif e.type == 'mousedown':
+    if e.type == 'mousedown':
         hit = viz.hit_test(x, y)
         if mode == 'VIEW':
             app_state["selected"] = hit
@@ -366,8 +290,15 @@ async def handle_mouse(e: events.MouseEventArguments):
                     viz.add_to_connection(hit["index"], start)
                     ui.notify("已合并"); app_state["connect_start"] = None; refresh_canvas()
 
+def handle_key(e):
+    if e.modifiers.ctrl and (e.key == 'y' or (e.key == 'z' and e.modifiers.shift)): redo()
+    elif e.modifiers.ctrl and e.key == 'z': undo()
+    elif e.key == 'Delete': delete_selection()
+
 def main():
     ui.add_head_html('''<style>body { margin: 0; padding: 0; overflow: hidden; background-color: #e5e7eb; }</style>''')
+    ui.add_head_html(HIGHLIGHT_HEAD_HTML)
+    ui.on("viz_draw_box", handle_draw_box)
     
     with ui.header().classes('bg-slate-800 items-center h-14 shadow-lg'):
         ui.icon('settings_input_component', color='white', size='md').classes('ml-2')
@@ -377,7 +308,9 @@ def main():
         # 撤销
         app_state["ui"]["undo_btn"] = ui.button('撤销', icon='undo', on_click=undo).props('flat color=white').tooltip('Ctrl+Z')
         app_state["ui"]["undo_btn"].disable()
-        ui.keyboard(on_key=lambda e: undo() if (e.modifiers.ctrl and e.key=='z') else (delete_selection() if e.key=='Delete' else None))
+        app_state["ui"]["redo_btn"] = ui.button('重做', icon='redo', on_click=redo).props('flat color=white').tooltip('Ctrl+Y')
+        app_state["ui"]["redo_btn"].disable()
+        ui.keyboard(on_key=handle_key)
         ui.button('保存 JSON', on_click=download_json, icon='save').props('unelevated color=green-600')
 
     with ui.row().classes('w-full h-[calc(100vh-3.5rem)] no-wrap gap-0'):
@@ -405,7 +338,7 @@ def main():
         with ui.column().classes('flex-grow h-full bg-gray-500 relative overflow-auto items-start justify-start'):
             # 恢复 width: 100%, height: auto
             img = ui.interactive_image(
-                events=['mousedown', 'mouseup', 'mousemove'],
+                events=['mousedown'],
                 on_mouse=handle_mouse,
                 cross=True
             ).style('width: 100%; height: auto; transform-origin: top left; transition: transform 0.1s ease-out;')
@@ -0,0 +1,105 @@
+"""
+进程内指标，按 Prometheus 文本格式 (0.0.4) 输出，不依赖 prometheus_client。
+直方图的记录只是加锁后更新几个数字，可以常开；Gauge 在抓取时才调用回调计算。
+"""
+import asyncio
+import bisect
+import functools
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(1 << k for k in range(8, 27, 2))   # 256 B ... 64 MB
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _num(v):
+    if v == float("inf"): return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for m in self.metrics:
+            lines.append(f"# HELP {m.name} {m.doc}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines += m.samples()
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class Gauge:
+    """
+    抓取时调用 fn()：返回一个数，或 {标签值元组: 数} (标签名由 labels 给出)。
+    其它模块自己维护的累计值 (例如 SessionStore.stats) 用 kind="counter" 导出。
+    """
+    def __init__(self, name, doc, fn, labels=(), kind="gauge", registry=REGISTRY):
+        self.name, self.doc, self.fn, self.labels, self.kind = name, doc, fn, tuple(labels), kind
+        registry.register(self)
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict): return [f"{self.name} {_num(value)}"]
+        return [f"{self.name}{_labels(self.labels, key)} {_num(v)}" for key, v in value.items()]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, doc, buckets=LATENCY_BUCKETS, labels=(), registry=REGISTRY):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # 标签值元组 -> [各桶计数 (不累加), 总和, 次数]
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None: series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock: items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        out = []
+        for key, counts, total, n in items:
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                out.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', _num(le))])} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labels, key)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.labels, key)} {n}")
+        return out
+
+def timed(histogram, **labels):
+    """装饰器：把函数 (普通或 async) 的耗时 (秒) 记入 histogram，异常时同样记录"""
+    def wrap(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def inner(*args, **kwargs):
+                start = time.perf_counter()
+                try: return await fn(*args, **kwargs)
+                finally: histogram.observe(time.perf_counter() - start, **labels)
+        else:
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                start = time.perf_counter()
+                try: return fn(*args, **kwargs)
+                finally: histogram.observe(time.perf_counter() - start, **labels)
+        return inner
+    return wrap
@@ -0,0 +1,476 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from viz_core import SystemBlockViz, approx_size
+from image_store import image_digest
+
+def dump_data(viz):
+    """落盘用的紧凑 JSON (不缩进，比 export_json 快，按数据版本缓存)；加载时任何格式都能解析"""
+    return viz.export("compact")
+
+class MemoryBackend:
+    """不落盘的后端：会话只存在于当前进程，过期信息由 SessionStore 自己的墓碑记录"""
+    durable = False
+
+    def put(self, record): pass
+    def update(self, session_id, **fields): pass
+    def load(self, session_id): return None
+    def head(self, session_id): return None
+    def heads(self, session_ids): return {}
+    def live_images(self): return None
+    def purge(self, idle_before, done_before, forget_before): pass
+    def flush(self): pass
+    def close(self): pass
+    def info(self): return {"backend": "memory"}
+
+class SqliteBackend:
+    """
+    SQLite 持久化后端：保存图的 JSON、图片引用、状态和结果。
+    写操作进入队列由后台线程批量提交 (不阻塞事件循环)，读操作在调用线程上按主键直接查询。
+    使用 WAL 模式，同一台机器上的多个 viz_server 进程可以共享同一个数据库文件。
+    """
+    durable = True
+    COLUMNS = ("id", "status", "json", "img_src", "img_w", "img_h", "result", "created", "updated", "rev")
+
+    def __init__(self, path="sessions.db"):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY, status TEXT NOT NULL, json TEXT, img_src TEXT, img_w INTEGER, img_h INTEGER,
+            result TEXT, created REAL, updated REAL, rev INTEGER NOT NULL DEFAULT 0)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_status_updated ON sessions (status, updated)")
+        conn.commit()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+        self._writer.start()
+
+    def _conn(self):
+        # 每个线程一个连接；busy_timeout 让多进程并发写时排队而不是直接报错
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _write_loop(self):
+        conn = self._conn()
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try: items.append(self._queue.get_nowait())
+                except queue.Empty: break
+            try:
+                for item in items:
+                    if item is not None: conn.execute(*item)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Session store write error: {e}")
+                conn.rollback()
+            for _ in items: self._queue.task_done()
+            if None in items: return
+
+    # --- 异步写 ---
+    def put(self, record):
+        cols = ", ".join(self.COLUMNS)
+        self._queue.put((f"INSERT OR REPLACE INTO sessions ({cols}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                         tuple(record.get(c) for c in self.COLUMNS)))
+
+    def update(self, session_id, **fields):
+        assigns = ", ".join(f"{k} = ?" for k in fields)
+        self._queue.put((f"UPDATE sessions SET {assigns} WHERE id = ?", (*fields.values(), session_id)))
+
+    def purge(self, idle_before, done_before, forget_before):
+        """按所有进程写入的最后访问时间回收：未完成的会话标记过期，已完成的先释放图数据、宽限期后再过期"""
+        self._queue.put(("UPDATE sessions SET status = 'expired', json = NULL, img_src = NULL WHERE status = 'pending' AND updated < ?", (idle_before,)))
+        self._queue.put(("UPDATE sessions SET json = NULL, img_src = NULL WHERE status = 'done' AND updated < ? AND json IS NOT NULL", (idle_before,)))
+        self._queue.put(("UPDATE sessions SET status = 'expired', result = NULL WHERE status = 'done' AND updated < ?", (done_before,)))
+        self._queue.put(("DELETE FROM sessions WHERE status = 'expired' AND updated < ?", (forget_before,)))
+
+    # --- 同步读 ---
+    def load(self, session_id):
+        row = self._conn().execute(f"SELECT {', '.join(self.COLUMNS)} FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return dict(zip(self.COLUMNS, row)) if row else None
+
+    def head(self, session_id):
+        """只取状态相关的小字段，供轮询和新旧版本比较"""
+        row = self._conn().execute("SELECT status, result, rev, updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return dict(zip(("status", "result", "rev", "updated"), row)) if row else None
+
+    def heads(self, session_ids):
+        """批量版 head：{session_id: head}，每 500 个 id 一次查询"""
+        out, ids = {}, list(session_ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = self._conn().execute(f"SELECT id, status, result, rev, updated FROM sessions WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            for row in rows: out[row[0]] = dict(zip(("status", "result", "rev", "updated"), row[1:]))
+        return out
+
+    def live_images(self):
+        """所有会话记录仍引用的图片地址"""
+        return {row[0] for row in self._conn().execute("SELECT DISTINCT img_src FROM sessions WHERE img_src IS NOT NULL")}
+
+    def flush(self):
+        """等待已排队的写操作全部提交"""
+        self._queue.join()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def info(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM sessions GROUP BY status").fetchall()
+        return {"backend": "sqlite", "path": self.path, "pending_writes": self._queue.unfinished_tasks, "rows": dict(rows)}
+
+class SessionStore:
+    """
+    有界的会话存储：空闲超过 ttl 的会话被回收，会话数或估算字节数超限时按最近访问顺序 (LRU) 淘汰。
+    已完成的结果在会话回收后仍保留 result_grace 秒供 /api/get_result 取回；
+    被回收的会话 id 记为墓碑，查询时返回 "expired" 而不是 "not found"。
+
+    backend 为持久化后端时内存只是热缓存：淘汰只是落盘后卸载，需要时从后端重新加载；
+    是否过期以后端记录的最后访问时间为准，多个进程共享同一个后端时互不干扰。
+    images 为 ImageStore 时，会话的 img_src 是图片仓库地址，加载/卸载会话时增减图片的引用数。
+    空闲超过 compact_idle 秒的会话换成紧凑表示 (见 SystemBlockViz.compact)，总字节数超限时也先压缩再淘汰。
+    编辑页打开期间用 attach/detach 把会话钉在内存中：不会被淘汰或压缩 (压缩会丢掉撤销历史)，
+    其它接口取到的始终是编辑页正在修改的同一个对象。
+    """
+    PURGE_INTERVAL = 30
+    TOMBSTONE_TTL = 24 * 3600
+
+    def __init__(self, ttl=2 * 3600, max_sessions=100, max_bytes=512 << 20, result_grace=3600, max_tombstones=10000, backend=None, images=None, compact_idle=300):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.result_grace = result_grace
+        self.max_tombstones = max_tombstones
+        self.compact_idle = compact_idle
+        self.backend = backend or MemoryBackend()
+        self.images = images
+        self._sessions = OrderedDict()   # 按最近访问排序，最旧的在前
+        self._results = OrderedDict()    # session_id -> (result, 过期时间)
+        self._tombstones = OrderedDict()
+        self._last_purge = 0
+        self._collector = None           # 清理图片文件的后台线程，见 _collect_images
+        self._waiters = {}               # session_id -> [asyncio.Event, 等待者数]，会话结束时唤醒长轮询/SSE
+        self._editors = {}               # session_id -> 打开的编辑页数
+        self.stats = {"created": 0, "loaded": 0, "evicted_ttl": 0, "evicted_count": 0, "evicted_bytes": 0, "results_expired": 0, "compacted": 0, "finished": 0}
+
+    # --- 字节估算 ---
+    def _size(self, session):
+        # 内联图片与初始 JSON 在创建时估算一次 (仓库中的图片由 ImageStore 单独统计)，撤销历史按当前实际占用累加；
+        # 压缩后的会话按紧凑表示的实际字节数计算
+        viz = session["viz"]
+        data_bytes = viz.compact_bytes if viz.is_compact else session["data_bytes"]
+        return session["bytes"] + data_bytes + viz.history_info()["bytes"]
+
+    def total_bytes(self):
+        return sum(self._size(s) for s in self._sessions.values())
+
+    def sizes(self):
+        """内存中每个会话的估算字节数"""
+        return [self._size(s) for s in self._sessions.values()]
+
+    def counts(self):
+        """按状态统计会话数 {pending/done/expired: n}：持久化后端以数据库为准 (包括其它进程的会话)"""
+        if self.backend.durable: return dict(self.backend.info()["rows"])
+        done = sum(s["done"] for s in self._sessions.values())
+        return {"pending": len(self._sessions) - done, "done": done + len(self._results), "expired": len(self._tombstones)}
+
+    # --- 基本操作 ---
+    def _hold(self, session, delta):
+        digest = image_digest(session["img_src"])
+        if self.images is None or digest is None: return
+        if delta > 0: self.images.incref(digest)
+        else: self.images.decref(digest)
+
+    def _insert(self, session_id, viz, img_src, img_size, done=False, result=None, rev=0, created=None):
+        now = time.time()
+        session = self._sessions[session_id] = {
+            "viz": viz,
+            "img_src": img_src,
+            "img_size": img_size,
+            "result": result,
+            "done": done,
+            "created": created or now,
+            "last_access": now,
+            "bytes": len(img_src or ""),
+            "data_bytes": approx_size(viz.data),
+            # 落盘状态：已保存的数据版本、最后访问时间和修订号
+            "saved_version": viz.version,
+            "saved_access": now,
+            "rev": rev,
+        }
+        self._hold(session, 1)
+        return session
+
+    def create(self, viz, img_src, img_size):
+        session_id = str(uuid.uuid4())
+        session = self._insert(session_id, viz, img_src, img_size)
+        self.backend.put({"id": session_id, "status": "pending", "json": dump_data(viz), "img_src": img_src,
+                          "img_w": img_size[0], "img_h": img_size[1], "created": session["created"],
+                          "updated": session["last_access"], "rev": 0})
+        self.stats["created"] += 1
+        self.sweep(keep=session_id)
+        return session_id
+
+    def create_cold(self, json_str, img_src, img_size):
+        """
+        只写入后端、不在内存中构建 viz 的会话 (批量创建用)，第一次打开编辑页时再加载。
+        非持久化后端没有别处可放，退化为 create，同样受 max_sessions 限制 (调用方应限制单批条目数)。
+        """
+        if not self.backend.durable: return self.create(SystemBlockViz(json_str), img_src, img_size)
+        session_id = str(uuid.uuid4())
+        now = time.time()
+        self.backend.put({"id": session_id, "status": "pending", "json": json_str, "img_src": img_src,
+                          "img_w": img_size[0], "img_h": img_size[1], "created": now, "updated": now, "rev": 0})
+        self.stats["created"] += 1
+        return session_id
+
+    def record(self, session_id):
+        """后端中仍能加载的会话记录，已过期或数据已清除时返回 None；只读后端，可在线程池中调用"""
+        rec = self.backend.load(session_id)
+        if rec is None or rec["status"] == "expired" or rec["json"] is None: return None
+        return rec
+
+    def _load(self, session_id):
+        rec = self.record(session_id)
+        if rec is None: return None
+        viz = SystemBlockViz(rec["json"])
+        self.stats["loaded"] += 1
+        return self._insert(session_id, viz, rec["img_src"], (rec["img_w"], rec["img_h"]),
+                            done=(rec["status"] == "done"), result=rec["result"], rev=rec["rev"], created=rec["created"])
+
+    def get(self, session_id, fresh=False):
+        """
+        取出会话并刷新访问时间；不存在或已回收时返回 None。
+        fresh=True 时先和后端比较修订号，其它进程保存过更新的版本则重新加载。
+        """
+        self.sweep()
+        session = self._sessions.get(session_id)
+        if session is not None and fresh and self.backend.durable:
+            head = self.backend.head(session_id)
+            if head and head["rev"] > session["rev"]:
+                self._hold(self._sessions.pop(session_id), -1)
+                session = None
+        if session is None:
+            session = self._load(session_id)
+            if session is None: return None
+            self.sweep(keep=session_id)
+        session["last_access"] = time.time()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def peek(self, session_id):
+        """内存中的会话，不存在时返回 None；不从后端加载，也不刷新访问时间和 LRU 次序"""
+        return self._sessions.get(session_id)
+
+    def attach(self, session_id):
+        """编辑页打开：会话不再被淘汰，直到对应的 detach"""
+        self._editors[session_id] = self._editors.get(session_id, 0) + 1
+
+    def detach(self, session_id):
+        n = self._editors.pop(session_id, 0) - 1
+        if n > 0: self._editors[session_id] = n
+
+    def touch(self, session_id, session=None):
+        """
+        刷新访问时间；编辑页持有的会话已被卸载、或被其它接口从后端重新加载成另一个对象时，
+        把编辑页的会话放回缓存 (替换重新加载的副本)，之后的编辑继续落盘。
+        """
+        if session is not None and self._sessions.get(session_id) is not session and self.status(session_id) != "expired":
+            old = self._sessions.pop(session_id, None)
+            if old is not None: self._hold(old, -1)
+            self._sessions[session_id] = session
+            self._hold(session, 1)
+        self.get(session_id)
+
+    def finish(self, session_id, result):
+        """保存标注结果；会话已被回收时结果仍进入宽限期缓存"""
+        now = time.time()
+        self.stats["finished"] += 1
+        self._notify(session_id)
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session["result"], session["done"] = result, True
+            session["last_access"] = now
+            self._sessions.move_to_end(session_id)
+            self._save(session_id, session, status="done")
+        else:
+            self._keep_result(session_id, result)
+            self._tombstones.pop(session_id, None)
+            self.backend.update(session_id, status="done", result=result, updated=now)
+
+    def result(self, session_id):
+        """返回 (status, result)：status 为 done / pending / expired / missing"""
+        self.sweep()
+        session = self._sessions.get(session_id)
+        if session is not None and session["done"]: return "done", session["result"]
+        return self._result(session_id, session, self.backend.head(session_id) if self.backend.durable else None)
+
+    def results(self, session_ids):
+        """批量版 result：{session_id: (status, result)}，持久化后端按批查询"""
+        self.sweep()
+        heads = self.backend.heads([sid for sid in session_ids if sid not in self._sessions or not self._sessions[sid]["done"]])
+        out = {}
+        for session_id in session_ids:
+            session = self._sessions.get(session_id)
+            if session is not None and session["done"]: out[session_id] = ("done", session["result"])
+            else: out[session_id] = self._result(session_id, session, heads.get(session_id))
+        return out
+
+    def _result(self, session_id, session, head):
+        if self.backend.durable:
+            # 以后端为准：结果可能是另一个进程保存的
+            if head is not None:
+                if head["status"] == "done": return "done", head["result"]
+                return ("expired" if head["status"] == "expired" else "pending"), None
+        if session is not None: return "pending", None
+        if session_id in self._results: return "done", self._results[session_id][0]
+        if session_id in self._tombstones: return "expired", None
+        return "missing", None
+
+    def _notify(self, session_id):
+        waiter = self._waiters.pop(session_id, None)
+        if waiter is not None: waiter[0].set()
+
+    async def wait_result(self, session_id, timeout, recheck=2.0):
+        """
+        等待会话离开 pending 状态或超时，返回值同 result()。
+        本进程内的 finish()/回收会立即唤醒；持久化后端下其它进程保存的结果每 recheck 秒查询一次后端发现。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            status, result = self.result(session_id)
+            remaining = deadline - time.monotonic()
+            if status != "pending" or remaining <= 0: return status, result
+            waiter = self._waiters.setdefault(session_id, [asyncio.Event(), 0])
+            waiter[1] += 1
+            try: await asyncio.wait_for(waiter[0].wait(), min(remaining, recheck) if self.backend.durable else remaining)
+            except asyncio.TimeoutError: pass
+            finally:
+                # 超时或连接断开后没有其它等待者时移除，不在本进程结束的会话 (过期、其它进程保存) 不会留下条目
+                waiter[1] -= 1
+                if waiter[1] <= 0 and self._waiters.get(session_id) is waiter: del self._waiters[session_id]
+
+    def status(self, session_id):
+        """active / expired / missing，用于编辑页给出明确提示"""
+        if session_id in self._sessions: return "active"
+        if session_id in self._tombstones or session_id in self._results: return "expired"
+        head = self.backend.head(session_id)
+        if head is not None: return "expired" if head["status"] == "expired" else "active"
+        return "missing"
+
+    # --- 落盘 ---
+    def _save(self, session_id, session, status=None):
+        """把内存中的改动写回后端：数据版本变化时写整份 JSON，否则只更新访问时间"""
+        fields = {}
+        if session["viz"].version != session["saved_version"] or status == "done":
+            session["rev"] += 1
+            session["saved_version"] = session["viz"].version
+            fields.update(json=dump_data(session["viz"]), rev=session["rev"])
+        if status is not None: fields.update(status=status, result=session["result"])
+        if fields or session["last_access"] != session["saved_access"]:
+            session["saved_access"] = session["last_access"]
+            self.backend.update(session_id, updated=session["last_access"], **fields)
+
+    def flush(self):
+        """把所有会话的未保存改动排入后端写队列 (由定时器周期调用，编辑时不逐次序列化)"""
+        if not self.backend.durable: return
+        for session_id, session in self._sessions.items(): self._save(session_id, session)
+
+    def close(self):
+        self.flush()
+        if self._collector is not None: self._collector.join()
+        self.backend.close()
+
+    # --- 回收 ---
+    def _keep_result(self, session_id, result):
+        self._results[session_id] = (result, time.time() + self.result_grace)
+        self._results.move_to_end(session_id)
+
+    def _evict(self, session_id, reason):
+        session = self._sessions.pop(session_id)
+        self._hold(session, -1)
+        self.stats[reason] += 1
+        self._notify(session_id)
+        if self.backend.durable:
+            # 持久化后端：只是卸载，真正的过期由 purge 按所有进程的访问时间判断
+            self._save(session_id, session)
+            return
+        if session["done"]: self._keep_result(session_id, session["result"])
+        self._tombstones[session_id] = time.time()
+        while len(self._tombstones) > self.max_tombstones: self._tombstones.popitem(last=False)
+
+    def _compact(self, session):
+        """换成紧凑表示，返回是否新压缩了；未保存的改动不受影响，落盘时直接从紧凑表示序列化"""
+        viz = session["viz"]
+        if viz.is_compact or session.get("compact_failed") == viz.version: return False
+        if not viz.compact():
+            # 数据形状不受支持：同一版本不再重试
+            session["compact_failed"] = viz.version
+            return False
+        self.stats["compacted"] += 1
+        return True
+
+    def sweep(self, keep=None):
+        """回收空闲超时的会话和过期的结果，再按 LRU 把会话数与总字节数压回上限；keep 指定的会话与打开了编辑页的会话不会被淘汰"""
+        now = time.time()
+        pinned = lambda sid: sid == keep or sid in self._editors
+        for session_id in [sid for sid, s in self._sessions.items() if now - s["last_access"] > self.ttl and not pinned(sid)]:
+            self._evict(session_id, "evicted_ttl")
+        while self._results and next(iter(self._results.values()))[1] < now:
+            self._results.popitem(last=False)
+            self.stats["results_expired"] += 1
+        if self.backend.durable and now - self._last_purge > self.PURGE_INTERVAL:
+            self._last_purge = now
+            # 打开着的编辑页即使没有编辑也算活跃：先刷新后端的访问时间 (与 purge 同一写队列，顺序在前)，
+            # 本进程和其它共享数据库的进程都不会把它标记过期
+            for session_id in self._editors:
+                session = self._sessions.get(session_id)
+                if session is None: continue
+                session["last_access"] = session["saved_access"] = now
+                self.backend.update(session_id, updated=now)
+            self.backend.purge(now - self.ttl, now - self.ttl - self.result_grace, now - self.TOMBSTONE_TTL)
+            if self.images is not None and (self._collector is None or not self._collector.is_alive()):
+                self._collector = threading.Thread(target=self._collect_images, name="image-gc", daemon=True)
+                self._collector.start()
+        if self.compact_idle is not None:
+            for session_id, session in self._sessions.items():
+                # 压缩会清空撤销历史，打开了编辑页的会话不压缩
+                if now - session["last_access"] > self.compact_idle and not pinned(session_id): self._compact(session)
+        victims = [sid for sid in self._sessions if not pinned(sid)]
+        while len(self._sessions) > self.max_sessions and victims:
+            self._evict(victims.pop(0), "evicted_count")
+        if self.max_bytes is not None and victims:
+            total = self.total_bytes()
+            # 先按 LRU 顺序压缩，仍然超限再淘汰
+            for session_id in victims:
+                if total <= self.max_bytes: break
+                session = self._sessions[session_id]
+                before = self._size(session)
+                if self._compact(session): total += self._size(session) - before
+            while total > self.max_bytes and victims:
+                session_id = victims.pop(0)
+                total -= self._size(self._sessions[session_id])
+                self._evict(session_id, "evicted_bytes")
+
+    def _collect_images(self):
+        # 在后台线程中执行：全表查询引用的图片与遍历图片目录都可能很慢，不能占用事件循环。
+        # 先等 purge 提交，刚过期的会话引用的图片本轮就能清理
+        self.backend.flush()
+        live = self.backend.live_images()
+        if live is not None: self.images.gc({image_digest(url) for url in live})
+
+    def info(self):
+        info = dict(self.stats, sessions=len(self._sessions), bytes=self.total_bytes(),
+                    compact_sessions=sum(s["viz"].is_compact for s in self._sessions.values()),
+                    results=len(self._results), tombstones=len(self._tombstones), **self.backend.info())
+        if self.images is not None: info.update(self.images.info())
+        return info
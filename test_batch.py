@@ -0,0 +1,28 @@
+"""batch 命令行的 JSONL 模式"""
+import argparse
+import json
+import multiprocessing
+
+import batch
+
+DIAGRAM = {"components": {"R1": {"type": "R", "box": [0, 0, 10, 10], "ports": [{"name": "a", "coord": [0, 0]}]}},
+           "external_ports": {}, "connections": []}
+
+
+def run(tmp_path, text, resume=False):
+    src, dst = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    src.write_text(text, encoding="utf-8")
+    args = argparse.Namespace(input=str(src), output=str(dst), checkpoint=None, resume=resume, chunksize=2)
+    reports = []
+    with multiprocessing.Pool(2) as pool: batch.run_jsonl(args, pool, reports.append)
+    return dst.read_text(encoding="utf-8").split("\n")[:-1], reports
+
+
+def test_blank_and_bad_lines_keep_line_numbers(tmp_path):
+    line = json.dumps(DIAGRAM)
+    out, reports = run(tmp_path, "\n".join([line, "", "{bad", "   ", line]) + "\n")
+    assert len(out) == 5
+    assert [o == "null" for o in out] == [False, True, True, True, False]
+    assert json.loads(out[4]) == json.loads(out[0])
+    # 空行不算处理失败，只有解析失败的行有报告
+    assert [(r["line"], r["ok"]) for r in reports] == [(0, True), (2, False), (4, True)]
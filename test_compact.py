@@ -0,0 +1,49 @@
+"""紧凑表示：压缩/还原不改变数据版本，渲染器在还原后整体重建"""
+import json
+
+from viz_core import SystemBlockViz
+from viz_raster import TileRenderer
+from viz_render import SvgRenderer
+
+DATA = {
+    "components": {
+        "R1": {"type": "R", "box": [0, 0, 40, 20], "ports": [{"name": "a", "coord": [0, 10]}, {"name": "b", "coord": [40, 10]}]},
+        "C1": {"type": "C", "box": [100, 0, 140, 20], "ports": [{"name": "a", "coord": [100, 10]}]},
+    },
+    "external_ports": {"VIN": {"type": "in", "coord": [70, 80]}},
+    "connections": [{"nodes": [{"component": "R1", "port": "b"}, {"component": "C1", "port": "a"},
+                               {"component": "external", "port": "VIN"}], "points": []}],
+}
+
+
+def make_viz():
+    return SystemBlockViz(json.loads(json.dumps(DATA)))
+
+
+def test_version_unchanged_across_compact_cycle():
+    viz = make_viz()
+    version = viz.version
+    assert viz.compact()
+    assert viz.version == version
+    # 只读访问触发还原，版本不变
+    assert viz.hit_test(0, 10) == {"type": "port", "comp": "R1", "port": "a"}
+    assert not viz.is_compact
+    assert viz.version == version
+    assert viz.export("compact") == make_viz().export("compact")
+    # 还原后的编辑照常计入版本
+    viz.update_component_type("R1", "X")
+    assert viz.version > version
+
+
+def test_renderers_resync_after_expand():
+    viz = make_viz()
+    svg, tiles = SvgRenderer(viz), TileRenderer(viz)
+    doc, tile = svg.render(), tiles.tile(0, 0, 0)
+    viz.compact()
+    viz.hit_test(0, 0)
+    assert svg.render() == doc
+    assert tiles.tile(0, 0, 0) == tile
+    # 还原后按新对象登记：增量更新仍然正确
+    viz.update_component_type("C1", "L")
+    assert svg.render() == SvgRenderer(viz).render()
+    assert tiles.tile(0, 0, 0)[1] == TileRenderer(viz).tile(0, 0, 0)[1]
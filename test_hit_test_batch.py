@@ -0,0 +1,161 @@
+"""hit_test_batch 与逐点 hit_test 的一致性测试：随机图、编辑/撤销之后、以及恰好落在容差边界上的点"""
+import random
+
+import pytest
+
+from viz_core import SystemBlockViz
+
+EPS = 1e-9
+
+
+def random_diagram(rng, n_comps=12, n_ports=4, n_conns=8, n_ext=3):
+    comps = {}
+    for i in range(n_comps):
+        x, y = rng.randint(0, 300), rng.randint(0, 300)
+        w, h = rng.randint(4, 120), rng.randint(4, 120)
+        ports = [{"name": f"p{j}", "type": "t", "coord": [rng.randint(x, x + w), rng.randint(y, y + h)]}
+                 for j in range(n_ports)]
+        # 反向的框与重叠的端口都要覆盖到
+        box = [x + w, y + h, x, y] if rng.random() < 0.2 else [x, y, x + w, y + h]
+        comps[f"C{i}"] = {"type": "T", "box": box, "ports": ports}
+    ext = {f"E{i}": {"type": "in", "coord": [rng.randint(0, 400), rng.randint(0, 400)]} for i in range(n_ext)}
+    nodes = [(c, p["name"]) for c, info in comps.items() for p in info["ports"]] + [("external", e) for e in ext]
+    conns = []
+    for _ in range(n_conns):
+        picked = rng.sample(nodes, rng.randint(1, 5))
+        conn = [{"component": c, "port": p} for c, p in picked]
+        if rng.random() < 0.2: conn.append({"component": "ghost", "port": "x"})
+        conns.append({"nodes": conn, "points": []})
+    return {"components": comps, "external_ports": ext, "connections": conns}
+
+
+def random_edit(rng, viz):
+    data = viz.data
+    comps, exts = list(data["components"]), list(data["external_ports"])
+    ports = [(c, p["name"]) for c in comps for p in data["components"][c]["ports"]] + [("external", e) for e in exts]
+    conns = data["connections"]
+    r = rng.random()
+    if r < 0.1:
+        viz.add_component(f"N{rng.randint(0, 30)}", "T", [rng.randint(0, 400) for _ in range(4)])
+    elif r < 0.2 and comps:
+        viz.rename_component(rng.choice(comps), f"N{rng.randint(0, 30)}")
+    elif r < 0.28 and comps:
+        viz.delete_component(rng.choice(comps))
+    elif r < 0.4:
+        viz.add_port(rng.choice(comps + ["external"]), f"q{rng.randint(0, 9)}", "t", (rng.randint(0, 400), rng.randint(0, 400)))
+    elif r < 0.5 and ports:
+        c, p = rng.choice(ports)
+        viz.rename_port(c, p, f"q{rng.randint(0, 9)}")
+    elif r < 0.58 and ports:
+        viz.delete_port(*rng.choice(ports))
+    elif r < 0.75 and len(ports) > 1:
+        a, b = rng.sample(ports, 2)
+        viz.connect_nodes({"comp": a[0], "port": a[1]}, {"comp": b[0], "port": b[1]})
+    elif r < 0.85 and conns and ports:
+        c, p = rng.choice(ports)
+        viz.add_to_connection(rng.randrange(len(conns)), {"comp": c, "port": p})
+    elif conns:
+        i = rng.randrange(len(conns))
+        viz.delete_connection_node(i, dict(rng.choice(conns[i]["nodes"])) if rng.random() < 0.5 else None)
+
+
+def boundary_points(viz):
+    """各类元素容差边界上 (以及边界内外各差一点) 的坐标"""
+    def around(x, y, d):
+        for dx, dy in ((d, 0), (-d, 0), (0, d), (0, -d), (0.6 * d, 0.8 * d), (-0.8 * d, 0.6 * d)):
+            for s in (1 - EPS, 1, 1 + EPS):
+                yield x + dx * s, y + dy * s
+
+    pts = []
+    for info in viz.data["external_ports"].values():
+        pts += around(*info["coord"][:2], viz.EXT_PORT_TOL)
+    for info in viz.data["components"].values():
+        for p in info["ports"]:
+            pts += around(*p["coord"][:2], viz.PORT_TOL)
+        x1, y1, x2, y2 = info["box"][:4]
+        for x in (x1, x2):
+            for y in (y1, y2, (y1 + y2) / 2):
+                pts += [(x, y), (x - EPS, y), (x + EPS, y), (x, y - EPS), (x, y + EPS)]
+    for idx, conn in enumerate(viz.data["connections"]):
+        center = viz.get_connection_centroid(idx)
+        if not center: continue
+        pts += around(center[0], center[1], viz.CENTER_TOL)
+        for node in conn["nodes"]:
+            p = viz.get_port_coord(node["component"], node["port"])
+            if not p: continue
+            dx, dy = center[0] - p[0], center[1] - p[1]
+            length = (dx * dx + dy * dy) ** 0.5
+            if not length: continue
+            # 线段中点的法向偏移，以及两端沿线段方向的延长
+            nx, ny = -dy / length * viz.EDGE_TOL, dx / length * viz.EDGE_TOL
+            mx, my = (p[0] + center[0]) / 2, (p[1] + center[1]) / 2
+            ux, uy = dx / length * viz.EDGE_TOL, dy / length * viz.EDGE_TOL
+            for s in (1 - EPS, 1, 1 + EPS):
+                pts += [(mx + nx * s, my + ny * s), (mx - nx * s, my - ny * s),
+                        (p[0] - ux * s, p[1] - uy * s), (center[0] + ux * s, center[1] + uy * s)]
+    return pts
+
+
+def grid_points(step=3):
+    return [(x, y) for x in range(-10, 420, step) for y in range(-10, 420, step)]
+
+
+def assert_batch_matches(viz, points):
+    batch = viz.hit_test_batch(points)
+    assert len(batch) == len(points)
+    for (x, y), got in zip(points, batch):
+        assert got == viz.hit_test(x, y), (x, y)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_diagrams(seed):
+    viz = SystemBlockViz(random_diagram(random.Random(seed)))
+    assert_batch_matches(viz, grid_points())
+    assert_batch_matches(viz, boundary_points(viz))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_after_edits_and_undo(seed):
+    rng = random.Random(1000 + seed)
+    viz = SystemBlockViz(random_diagram(rng))
+    for _ in range(25):
+        viz.checkpoint()
+        random_edit(rng, viz)
+    assert_batch_matches(viz, grid_points(5))
+    assert_batch_matches(viz, boundary_points(viz))
+    for _ in range(rng.randint(1, 20)):
+        if viz.can_undo(): viz.undo()
+    assert_batch_matches(viz, grid_points(5))
+    assert_batch_matches(viz, boundary_points(viz))
+
+
+def test_exact_tolerance_boundaries():
+    # 容差是严格小于：恰好在容差距离上的点不命中端口/中心/连线，而组件框含边界
+    data = {
+        "components": {
+            "A": {"type": "T", "box": [0, 0, 100, 60], "ports": [{"name": "a", "type": "t", "coord": [20, 30]}]},
+            "B": {"type": "T", "box": [200, 0, 300, 60], "ports": [{"name": "b", "type": "t", "coord": [280, 30]}]},
+        },
+        "external_ports": {"X": {"type": "in", "coord": [150, 200]}},
+        "connections": [{"nodes": [{"component": "A", "port": "a"}, {"component": "B", "port": "b"}], "points": []}],
+    }
+    viz = SystemBlockViz(data)
+    tol = viz.PORT_TOL
+    assert viz.hit_test(20 + tol, 30)["type"] != "port"
+    assert viz.hit_test(20 + tol - 0.5, 30)["type"] == "port"
+    assert viz.hit_test(150 + viz.EXT_PORT_TOL, 200) is None
+    assert viz.hit_test(150, 200 - viz.EXT_PORT_TOL + 0.5)["type"] == "port"
+    assert viz.hit_test(100, 60) == {"type": "component", "name": "A"}
+    assert viz.hit_test(150, 30 + viz.CENTER_TOL) is None
+    assert viz.hit_test(150, 30)["type"] == "conn_center"
+    assert viz.hit_test(100.5, 30 + viz.EDGE_TOL - 0.5)["type"] == "conn_edge"
+    pts = boundary_points(viz) + [(20 + tol, 30), (150 + viz.EXT_PORT_TOL, 200), (100, 60), (150, 30 + viz.CENTER_TOL)]
+    assert_batch_matches(viz, pts)
+
+
+def test_chunked_batches():
+    # max_elems 很小时按多块计算，结果与一次算完相同
+    viz = SystemBlockViz(random_diagram(random.Random(7)))
+    points = grid_points(7) + boundary_points(viz)
+    assert viz.hit_test_batch(points, max_elems=16) == viz.hit_test_batch(points)
+    assert_batch_matches(viz, points)
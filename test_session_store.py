@@ -0,0 +1,59 @@
+"""SessionStore 的回收与落盘行为"""
+import json
+import os
+import threading
+import time
+
+from image_store import ImageStore, image_url
+from session_store import SessionStore, SqliteBackend
+from viz_core import SystemBlockViz
+
+DATA = {"components": {"R1": {"type": "R", "box": [0, 0, 10, 10], "ports": [{"name": "a", "coord": [0, 0]}]}},
+        "external_ports": {}, "connections": []}
+
+
+def make_store(tmp_path, **kwargs):
+    store = SessionStore(backend=SqliteBackend(str(tmp_path / "sessions.db")), **kwargs)
+    store.PURGE_INTERVAL = 0
+    return store
+
+
+def test_attached_editor_outlives_ttl(tmp_path):
+    store = make_store(tmp_path, ttl=0.5)
+    editing = store.create(SystemBlockViz(json.dumps(DATA)), None, (10, 10))
+    idle = store.create(SystemBlockViz(json.dumps(DATA)), None, (10, 10))
+    store.attach(editing)
+    time.sleep(1)
+    store.sweep()
+    store.backend.flush()
+    # 编辑页打开但一直没有编辑：内存与数据库中都仍然有效
+    assert store.peek(editing) is not None
+    assert store.result(editing) == ("pending", None)
+    assert store.backend.head(editing)["status"] == "pending"
+    # 没有编辑页的会话照常过期
+    assert store.result(idle) == ("expired", None)
+    store.detach(editing)
+    time.sleep(1)
+    store.sweep()
+    store.backend.flush()
+    assert store.result(editing) == ("expired", None)
+    store.close()
+
+
+def test_image_gc_runs_off_the_calling_thread(tmp_path):
+    images = ImageStore(str(tmp_path / "images"))
+    store = make_store(tmp_path, images=images)
+    kept = images.put(b"kept", "image/png")
+    store.create(SystemBlockViz(json.dumps(DATA)), image_url(kept), (10, 10))
+    orphan = images.put(b"orphan", "image/png")
+    images.discard(orphan)
+    for digest in (kept, orphan): os.utime(images._path(digest), (0, 0))
+    threads, gc = [], images.gc
+    images.gc = lambda live: (threads.append(threading.current_thread()), gc(live))
+    store.backend.flush()
+    store._last_purge = 0
+    store.sweep()
+    store._collector.join()
+    assert threads and threads[0] is not threading.current_thread()
+    assert os.path.exists(images._path(kept)) and not os.path.exists(images._path(orphan))
+    store.close()
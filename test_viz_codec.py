@@ -0,0 +1,48 @@
+"""各导出格式的往返：解码结果与原数据逐字节相同 (包括键顺序)"""
+import json
+import random
+
+import pytest
+
+import viz_codec
+
+
+def random_data(rng):
+    comps = {}
+    for i in range(rng.randint(0, 8)):
+        ports = []
+        for j in range(rng.randint(0, 4)):
+            port = {"name": f"p{j}", "coord": [rng.randint(-50, 500), rng.choice([rng.randint(0, 500), rng.random() * 500])]}
+            if rng.random() < 0.5: port["type"] = "in"
+            ports.append(dict(rng.sample(list(port.items()), len(port))) if rng.random() < 0.3 else port)
+        info = {"type": rng.choice(["R", "C"]), "box": [rng.randint(0, 400) for _ in range(4)], "ports": ports}
+        if rng.random() < 0.2: info["label"] = "x"
+        comps[f"C{i}"] = dict(rng.sample(list(info.items()), len(info))) if rng.random() < 0.3 else info
+    ext = {f"E{i}": {"type": "in", "coord": [rng.randint(0, 500), rng.randint(0, 500)]} for i in range(rng.randint(0, 3))}
+    names = [(c, p["name"]) for c, info in comps.items() for p in info["ports"]] + [("external", e) for e in ext]
+    conns = []
+    for _ in range(rng.randint(0, 6)):
+        if not names: break
+        nodes = [{"component": c, "port": p} for c, p in rng.sample(names, min(len(names), rng.randint(1, 4)))]
+        if rng.random() < 0.1: nodes = [{"port": n["port"], "component": n["component"]} for n in nodes]
+        conns.append({"nodes": nodes, "points": []})
+    data = {"components": comps, "external_ports": ext, "connections": conns}
+    if rng.random() < 0.2: data["meta"] = {"source": "test"}
+    if rng.random() < 0.2: del data[rng.choice(list(data))]
+    return dict(rng.sample(list(data.items()), len(data))) if rng.random() < 0.4 else data
+
+
+CASES = [
+    {"components": {}, "connections": [], "external_ports": {}},
+    {"components": {"R1": {"ports": [{"coord": [1, 2], "name": "a"}], "box": [0, 0, 4, 4], "type": "R"}},
+     "connections": [{"nodes": [{"port": "a", "component": "R1"}, {"component": "external", "port": "IN"}], "points": []}],
+     "external_ports": {"IN": {"coord": [9, 9], "type": "in"}}},
+    {"meta": 1, "external_ports": {"IN": {"coord": [1.5, 2]}}, "components": {}},
+]
+
+
+@pytest.mark.parametrize("fmt", viz_codec.FORMATS)
+@pytest.mark.parametrize("data", CASES + [random_data(random.Random(seed)) for seed in range(200)])
+def test_round_trip_preserves_key_order(fmt, data):
+    decoded = viz_codec.loads(viz_codec.dumps(data, fmt), fmt)
+    assert json.dumps(decoded) == json.dumps(data)
@@ -0,0 +1,75 @@
+from python_multipart.multipart import MultipartParser, parse_options_header
+from image_store import ImageTooLarge
+
+class UploadError(Exception):
+    def __init__(self, msg, status=400):
+        super().__init__(msg)
+        self.status = status
+
+async def receive_upload(request, images, max_image_bytes, max_field_bytes=16 << 20, max_pixels=None, file_field="image"):
+    """
+    流式解析 multipart/form-data 请求：file_field 的文件内容按块直接写入图片仓库，其它字段作为文本收集。
+    内存占用只与块大小、图片头部探测长度和 max_field_bytes 有关，与图片大小无关。
+    返回 (fields, (digest, 宽, 高))，没有上传图片时第二项为 None。
+    """
+    ctype, params = parse_options_header(request.headers.get("content-type", ""))
+    if ctype != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("需要 multipart/form-data 请求")
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_image_bytes + max_field_bytes:
+        raise UploadError("上传内容过大", 413)
+
+    fields, part = {}, {}
+    state = {"writer": None, "field_bytes": 0}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, field=b"", value=b"", buf=None, writer=None)
+
+    def on_header_field(data, start, end): part["field"] += data[start:end]
+    def on_header_value(data, start, end): part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, disp = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = disp.get(b"name", b"").decode()
+        if part["name"] == file_field and b"filename" in disp:
+            if state["writer"] is not None: raise UploadError("只能上传一张图片")
+            part["writer"] = state["writer"] = images.writer(max_image_bytes, max_pixels)
+        else:
+            part["buf"] = bytearray()
+
+    def on_part_data(data, start, end):
+        if part["writer"] is not None:
+            part["writer"].write(data[start:end])
+            return
+        state["field_bytes"] += end - start
+        if state["field_bytes"] > max_field_bytes: raise UploadError("表单字段过大", 413)
+        part["buf"] += data[start:end]
+
+    def on_part_end():
+        if part["buf"] is not None: fields[part["name"]] = part["buf"].decode("utf-8")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field, "on_header_value": on_header_value,
+        "on_header_end": on_header_end, "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+        image = state["writer"].commit() if state["writer"] is not None else None
+    except ImageTooLarge as e:
+        if state["writer"] is not None: state["writer"].abort()
+        raise UploadError(str(e), 413)
+    except UploadError:
+        if state["writer"] is not None: state["writer"].abort()
+        raise
+    except Exception as e:
+        if state["writer"] is not None: state["writer"].abort()
+        raise UploadError(f"上传解析失败: {e}")
+    return fields, image
@@ -0,0 +1,238 @@
+"""
+标注数据的序列化格式：
+  json     与 export_json 相同，indent=2 的 JSON 文本 (str)
+  compact  不缩进、无多余空格的 JSON 文本 (str)
+  gzip     compact 的 UTF-8 字节经 gzip 压缩 (bytes，mtime 固定为 0，同样的数据得到同样的字节)
+  binary   下面定义的紧凑二进制编码 (bytes)
+
+二进制编码 (版本 1)
+  整数一律用无符号 LEB128 变长编码，记作 uint；
+  num 为坐标等数值：Python int 写成 uint(zigzag(n) << 1)，float 写成 uint(1) 加 8 字节小端 IEEE754 double；
+  str 为字符串表下标 uint；opt 为可选字符串 uint(下标 + 1)，0 表示没有。
+
+  文档   := "CDVB" 0x01 字符串表 组件表 外部端口表 连接表 extra
+  字符串表 := uint(n) { uint(字节数) UTF-8 字节 }*n       (所有名字/类型/extra 文本去重后只存一次)
+  组件表 := uint(n) { str(名字) opt(type) uint(flags) [num*4 (box)] [端口列表] extra }*n
+            flags 第 0 位表示有 box (4 个 num)，第 1 位表示有端口列表；不符合约定的 box/ports 放进 extra
+  端口列表 := uint(n) { str(名字) num num (coord) extra }*n
+  外部端口表 := uint(n) { str(名字) num num (coord) extra }*n
+  连接表 := uint(n) { uint(节点数) { str(component) str(port) }* extra }*n
+  extra  := opt(紧凑 JSON 对象文本)，保存上述字段之外的所有键 (例如连接的 points)，
+            以及形状不符合约定 (例如 coord 不是两个数) 的字段，保证解码结果与原数据相等 (包括键顺序)。
+            对象的键顺序与解码时的默认顺序 (上述字段在前，其余键按 extra 中的顺序在后) 不同时，
+            extra 中的 "__order__" 记录原来的键顺序。
+            文档末尾的 extra 保存顶层的其它键；外部端口表/连接表中有不符合约定的条目时整表放在这里
+            (节点的键不是依次为 component、port 也算不符合约定)，
+            "__missing__" 列出原数据中缺少的 components/external_ports/connections，顶层键顺序不同时同样记 "__order__"。
+"""
+import gzip
+import json
+import struct
+
+FORMATS = ("json", "compact", "gzip", "binary")
+MEDIA_TYPES = {"json": "application/json", "compact": "application/json", "gzip": "application/gzip", "binary": "application/octet-stream"}
+MAGIC = b"CDVB\x01"
+
+def dumps(data, fmt="json"):
+    if fmt == "json": return json.dumps(data, indent=2, ensure_ascii=False)
+    if fmt == "compact": return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    if fmt == "gzip": return gzip.compress(dumps(data, "compact").encode("utf-8"), mtime=0)
+    if fmt == "binary": return encode_binary(data)
+    raise ValueError(f"未知的导出格式: {fmt}")
+
+def loads(payload, fmt="json"):
+    if fmt in ("json", "compact"): return json.loads(payload)
+    if fmt == "gzip": return json.loads(gzip.decompress(payload))
+    if fmt == "binary": return decode_binary(payload)
+    raise ValueError(f"未知的导出格式: {fmt}")
+
+# --- 二进制编码 ---
+def _is_num(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+def _is_point(v):
+    return isinstance(v, list) and len(v) == 2 and _is_num(v[0]) and _is_num(v[1])
+
+class _Writer:
+    def __init__(self):
+        self.out = bytearray()
+        self.strings = {}
+
+    def uint(self, n):
+        out = self.out
+        if n < 0x80:
+            out.append(n)
+            return
+        while n >= 0x80:
+            out.append((n & 0x7f) | 0x80)
+            n >>= 7
+        out.append(n)
+
+    def num(self, v):
+        if isinstance(v, int): self.uint(_zigzag(v) << 1)
+        else:
+            self.uint(1)
+            self.out += struct.pack("<d", v)
+
+    def index(self, s):
+        idx = self.strings.get(s)
+        if idx is None: idx = self.strings[s] = len(self.strings)
+        return idx
+
+    def str(self, s):
+        self.uint(self.index(s))
+
+    def opt(self, s):
+        self.uint(0 if s is None else self.index(s) + 1)
+
+    def extra(self, obj, known):
+        # known 为按解码顺序排列的已编码字段，都在 obj 里；个数相同且顺序一致即没有其它键
+        keys = list(obj)
+        if len(keys) == len(known) and keys == list(known):
+            self.out.append(0)
+            return
+        rest = {k: v for k, v in obj.items() if k not in known}
+        if keys != list(known) + list(rest): rest["__order__"] = keys
+        self.opt(json.dumps(rest, ensure_ascii=False, separators=(",", ":")) if rest else None)
+
+def _zigzag(v):
+    return (v << 1) if v >= 0 else ((-v) << 1) - 1
+
+def encode_binary(data):
+    w = _Writer()
+    comps = data.get("components", {})
+    w.uint(len(comps))
+    for name, info in comps.items():
+        w.str(name)
+        c_type = info.get("type")
+        w.opt(c_type if isinstance(c_type, str) else None)
+        known = ["type"] if isinstance(c_type, str) else []
+        box, ports = info.get("box"), info.get("ports")
+        box_ok = isinstance(box, list) and len(box) == 4 and all(_is_num(v) for v in box)
+        ports_ok = isinstance(ports, list) and all(isinstance(p, dict) and isinstance(p.get("name"), str) and _is_point(p.get("coord")) for p in ports)
+        w.uint(box_ok | (ports_ok << 1))
+        if box_ok:
+            known.append("box")
+            for v in box: w.num(v)
+        if ports_ok:
+            known.append("ports")
+            w.uint(len(ports))
+            for p in ports:
+                w.str(p["name"]); w.num(p["coord"][0]); w.num(p["coord"][1])
+                w.extra(p, ("name", "coord"))
+        w.extra(info, known)
+    ext = {k: v for k, v in data.get("external_ports", {}).items() if isinstance(v, dict) and _is_point(v.get("coord"))}
+    w.uint(len(ext))
+    for name, info in ext.items():
+        w.str(name); w.num(info["coord"][0]); w.num(info["coord"][1])
+        w.extra(info, ("coord",))
+    conns = data.get("connections", [])
+    simple = [c for c in conns if isinstance(c, dict) and isinstance(c.get("nodes"), list)
+              and all(isinstance(n, dict) and list(n) == ["component", "port"] and isinstance(n["component"], str) and isinstance(n["port"], str) for n in c["nodes"])]
+    if len(simple) != len(conns): simple = []
+    w.uint(len(simple))
+    for conn in simple:
+        w.uint(len(conn["nodes"]))
+        for node in conn["nodes"]: w.str(node["component"]); w.str(node["port"])
+        w.extra(conn, ("nodes",))
+    # 形状不符合约定的外部端口/连接整体放进顶层 extra
+    top = {k: v for k, v in data.items() if k not in ("components", "external_ports", "connections")}
+    if len(ext) != len(data.get("external_ports", {})): top["external_ports"] = data["external_ports"]
+    if not simple and conns: top["connections"] = conns
+    for key in ("components", "external_ports", "connections"):
+        if key not in data: top.setdefault("__missing__", []).append(key)
+    keys = list(data)
+    if keys != [k for k in ("components", "external_ports", "connections") if k in data] + [k for k in top if k not in ("external_ports", "connections", "__missing__")]:
+        top["__order__"] = keys
+    w.opt(json.dumps(top, ensure_ascii=False, separators=(",", ":")) if top else None)
+
+    head = _Writer()
+    head.out += MAGIC
+    head.uint(len(w.strings))
+    for s in w.strings:
+        b = s.encode("utf-8")
+        head.uint(len(b))
+        head.out += b
+    return bytes(head.out + w.out)
+
+class _Reader:
+    def __init__(self, buf):
+        self.buf = bytes(buf)
+        self.pos = 0
+        self.strings = []
+
+    def uint(self):
+        buf, pos = self.buf, self.pos
+        b = buf[pos]
+        if b < 0x80:
+            self.pos = pos + 1
+            return b
+        shift, n = 0, 0
+        while True:
+            b = buf[pos]
+            pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 0x80: break
+            shift += 7
+        self.pos = pos
+        return n
+
+    def num(self):
+        n = self.uint()
+        if n == 1:
+            v = struct.unpack_from("<d", self.buf, self.pos)[0]
+            self.pos += 8
+            return v
+        n >>= 1
+        return (n >> 1) ^ -(n & 1)
+
+    def str(self):
+        return self.strings[self.uint()]
+
+    def opt(self):
+        n = self.uint()
+        return self.strings[n - 1] if n else None
+
+    def extra(self, obj):
+        text = self.opt()
+        if text is None: return obj
+        rest = json.loads(text)
+        order = rest.pop("__order__", None)
+        obj.update(rest)
+        return {k: obj[k] for k in order} if order else obj
+
+def decode_binary(buf):
+    if bytes(buf[:len(MAGIC)]) != MAGIC: raise ValueError("不是 CDVB v1 二进制数据")
+    r = _Reader(buf)
+    r.pos = len(MAGIC)
+    for _ in range(r.uint()):
+        size = r.uint()
+        r.strings.append(r.buf[r.pos:r.pos + size].decode("utf-8"))
+        r.pos += size
+    comps = {}
+    for _ in range(r.uint()):
+        name = r.str()
+        info = {}
+        c_type = r.opt()
+        if c_type is not None: info["type"] = c_type
+        flags = r.uint()
+        if flags & 1: info["box"] = [r.num(), r.num(), r.num(), r.num()]
+        if flags & 2: info["ports"] = [r.extra({"name": r.str(), "coord": [r.num(), r.num()]}) for _ in range(r.uint())]
+        comps[name] = r.extra(info)
+    ext = {}
+    for _ in range(r.uint()):
+        name = r.str()
+        ext[name] = r.extra({"coord": [r.num(), r.num()]})
+    conns = []
+    for _ in range(r.uint()):
+        nodes = [{"component": r.str(), "port": r.str()} for _ in range(r.uint())]
+        conns.append(r.extra({"nodes": nodes}))
+    data = {"components": comps, "external_ports": ext, "connections": conns}
+    text = r.opt()
+    if text is not None:
+        top = json.loads(text)
+        for key in top.pop("__missing__", []): data.pop(key, None)
+        order = top.pop("__order__", None)
+        data.update(top)
+        if order: data = {k: data[k] for k in order}
+    return data
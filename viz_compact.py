@@ -0,0 +1,194 @@
+"""
+标注数据的紧凑表示 (结构数组)，用于常驻内存的空闲会话：
+  - 所有名字、类型、键顺序和附加字段文本去重后存成一段 UTF-8 字节 + 偏移数组
+  - 组件框、端口坐标、外部端口坐标存成 NumPy 数值数组
+  - 每个 net 的节点存成 (组件名下标, 端口名下标) 两个整数数组，按偏移数组切分
+unpack() 还原出与原数据相等 (包括字典键顺序、int/float 类型) 的嵌套 dict/list。
+"""
+import json
+import numpy as np
+
+MAX_EXACT_INT = 1 << 53   # float64 能精确表示的整数范围
+
+def _is_num(v):
+    t = type(v)
+    return t is float or (t is int and -MAX_EXACT_INT <= v <= MAX_EXACT_INT)
+
+class _Table:
+    """字符串去重表：add 返回下标，pack 后只剩一段字节和偏移"""
+    def __init__(self):
+        self.index = {}
+
+    def add(self, s):
+        idx = self.index.get(s)
+        if idx is None: idx = self.index[s] = len(self.index)
+        return idx
+
+    def add_json(self, obj):
+        return self.add(json.dumps(obj, ensure_ascii=False, separators=(",", ":")))
+
+    def pack(self):
+        blobs = [s.encode("utf-8") for s in self.index]
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in blobs], out=offsets[1:])
+        return b"".join(blobs), offsets
+
+def _pack_nums(values, width):
+    """数值列表 -> (float64 数组 (n, width), 类型标记)：True 全是 int，False 全是 float，否则为 int 位置的位图"""
+    arr = np.array(values, dtype=np.float64).reshape(-1, width)
+    is_int = np.fromiter((type(v) is int for v in values), dtype=bool, count=len(values))
+    if is_int.all(): return arr, True
+    if not is_int.any(): return arr, False
+    return arr, np.packbits(is_int)
+
+def _unpack_nums(arr, kind):
+    if kind is True: return arr.astype(np.int64).tolist()
+    if kind is False: return arr.tolist()
+    width = arr.shape[1]
+    flat = arr.ravel().tolist()
+    for i in np.flatnonzero(np.unpackbits(kind, count=len(flat))).tolist(): flat[i] = int(flat[i])
+    return [flat[i:i + width] for i in range(0, len(flat), width)]
+
+class CompactDiagram:
+    """
+    pack(data) 在数据形状不受支持 (例如顶层不是 dict) 时返回 None，调用方继续使用原数据。
+    形状不符合约定的字段 (例如 coord 不是两个数) 整体作为附加字段保存，不影响还原结果。
+    """
+    def __init__(self, **arrays):
+        self.__dict__.update(arrays)
+
+    @classmethod
+    def pack(cls, data):
+        if not isinstance(data, dict) or not all(isinstance(k, str) for k in data): return None
+        comps, ext, conns = data.get("components"), data.get("external_ports"), data.get("connections")
+        if not isinstance(comps, dict) or not isinstance(ext, dict) or not isinstance(conns, list): return None
+        if not all(isinstance(k, str) and isinstance(v, dict) for d in (comps, ext) for k, v in d.items()): return None
+        if not all(isinstance(c, dict) for c in conns): return None
+        table = _Table()
+        add = table.add
+
+        layouts = {}   # 键元组 -> 键顺序下标，同样的键顺序只序列化一次
+
+        def layout(obj, fields):
+            """登记键顺序和附加字段 (fields 之外的键)，返回 (键顺序下标, 附加字段下标或 -1)"""
+            keys = tuple(obj)
+            idx = layouts.get(keys)
+            if idx is None:
+                if not all(isinstance(k, str) for k in keys): raise ValueError
+                idx = layouts[keys] = table.add_json(keys)
+            if len(keys) == len(fields): return idx, -1
+            rest = {k: v for k, v in obj.items() if k not in fields}
+            return idx, table.add_json(rest)
+
+        c_name, c_type, c_box, c_layout, c_extra, port_start = [], [], [], [], [], [0]
+        p_name, p_xy, p_layout, p_extra = [], [], [], []
+        try:
+            for name, info in comps.items():
+                fields = set()
+                c_type_v = info.get("type")
+                if isinstance(c_type_v, str): fields.add("type")
+                box = info.get("box")
+                if isinstance(box, list) and len(box) == 4 and all(_is_num(v) for v in box):
+                    fields.add("box")
+                    c_box += box
+                else:
+                    c_box += (0, 0, 0, 0)
+                ports = info.get("ports")
+                if isinstance(ports, list) and all(isinstance(p, dict) and isinstance(p.get("name"), str) and isinstance(p.get("coord"), list)
+                                                   and len(p["coord"]) == 2 and _is_num(p["coord"][0]) and _is_num(p["coord"][1]) for p in ports):
+                    fields.add("ports")
+                    for p in ports:
+                        p_name.append(add(p["name"]))
+                        p_xy += p["coord"]
+                        lay, extra = layout(p, ("name", "coord"))
+                        p_layout.append(lay)
+                        p_extra.append(extra)
+                port_start.append(len(p_name))
+                c_name.append(add(name))
+                c_type.append(add(c_type_v) if "type" in fields else -1)
+                lay, extra = layout(info, fields)
+                c_layout.append(lay)
+                c_extra.append(extra)
+
+            e_name, e_xy, e_layout, e_extra = [], [], [], []
+            for name, info in ext.items():
+                coord = info.get("coord")
+                fields = ("coord",) if isinstance(coord, list) and len(coord) == 2 and _is_num(coord[0]) and _is_num(coord[1]) else ()
+                e_xy += coord if fields else (0, 0)
+                e_name.append(add(name))
+                lay, extra = layout(info, fields)
+                e_layout.append(lay)
+                e_extra.append(extra)
+
+            n_comp, n_port, n_layout, n_extra, node_start = [], [], [], [], [0]
+            for conn in conns:
+                nodes = conn.get("nodes")
+                ok = isinstance(nodes, list) and all(type(n) is dict and len(n) == 2 and list(n) == ["component", "port"]
+                                                     and isinstance(n["component"], str) and isinstance(n["port"], str) for n in nodes)
+                if ok:
+                    for n in nodes:
+                        n_comp.append(add(n["component"]))
+                        n_port.append(add(n["port"]))
+                node_start.append(len(n_comp))
+                lay, extra = layout(conn, ("nodes",) if ok else ())
+                n_layout.append(lay)
+                n_extra.append(extra)
+            top = layout(data, ("components", "external_ports", "connections"))
+        except (TypeError, ValueError):
+            # 非字符串键或不能转成 JSON 的值：保持原数据
+            return None
+
+        i32 = lambda v: np.array(v, dtype=np.int32)
+        box, box_kind = _pack_nums(c_box, 4)
+        port_xy, port_kind = _pack_nums(p_xy, 2)
+        ext_xy, ext_kind = _pack_nums(e_xy, 2)
+        blob, offsets = table.pack()
+        return cls(blob=blob, offsets=offsets, top=top,
+                   comp_name=i32(c_name), comp_type=i32(c_type), comp_layout=i32(c_layout), comp_extra=i32(c_extra),
+                   box=box, box_kind=box_kind, port_start=i32(port_start),
+                   port_name=i32(p_name), port_xy=port_xy, port_kind=port_kind, port_layout=i32(p_layout), port_extra=i32(p_extra),
+                   ext_name=i32(e_name), ext_xy=ext_xy, ext_kind=ext_kind, ext_layout=i32(e_layout), ext_extra=i32(e_extra),
+                   node_start=i32(node_start), node_comp=i32(n_comp), node_port=i32(n_port),
+                   conn_layout=i32(n_layout), conn_extra=i32(n_extra))
+
+    @property
+    def nbytes(self):
+        """紧凑表示占用的字节数 (数组与字符串表，不含 Python 对象头)"""
+        return len(self.blob) + sum(v.nbytes for v in self.__dict__.values() if isinstance(v, np.ndarray))
+
+    def unpack(self):
+        blob, offs = self.blob, self.offsets.tolist()
+        strings = [blob[offs[i]:offs[i + 1]].decode("utf-8") for i in range(len(offs) - 1)]
+        layouts = {}
+
+        def build(layout_idx, extra_idx, known):
+            # 键顺序文本大量重复，只解析一次；附加字段每个对象单独解析，避免不同对象共享可变值
+            keys = layouts.get(layout_idx)
+            if keys is None: keys = layouts[layout_idx] = json.loads(strings[layout_idx])
+            if extra_idx < 0: return {k: known[k] for k in keys}
+            extra = json.loads(strings[extra_idx])
+            return {k: (extra[k] if k in extra else known[k]) for k in keys}
+
+        ports = []
+        port_xy = _unpack_nums(self.port_xy, self.port_kind)
+        for name, xy, lay, extra in zip(self.port_name.tolist(), port_xy, self.port_layout.tolist(), self.port_extra.tolist()):
+            ports.append(build(lay, extra, {"name": strings[name], "coord": xy}))
+
+        comps = {}
+        boxes = _unpack_nums(self.box, self.box_kind)
+        starts = self.port_start.tolist()
+        for i, (name, c_type, lay, extra) in enumerate(zip(self.comp_name.tolist(), self.comp_type.tolist(), self.comp_layout.tolist(), self.comp_extra.tolist())):
+            known = {"type": strings[c_type] if c_type >= 0 else None, "box": boxes[i], "ports": ports[starts[i]:starts[i + 1]]}
+            comps[strings[name]] = build(lay, extra, known)
+
+        ext = {}
+        for name, xy, lay, extra in zip(self.ext_name.tolist(), _unpack_nums(self.ext_xy, self.ext_kind), self.ext_layout.tolist(), self.ext_extra.tolist()):
+            ext[strings[name]] = build(lay, extra, {"coord": xy})
+
+        conns = []
+        starts, node_comp, node_port = self.node_start.tolist(), self.node_comp.tolist(), self.node_port.tolist()
+        for i, (lay, extra) in enumerate(zip(self.conn_layout.tolist(), self.conn_extra.tolist())):
+            nodes = [{"component": strings[c], "port": strings[p]} for c, p in zip(node_comp[starts[i]:starts[i + 1]], node_port[starts[i]:starts[i + 1]])]
+            conns.append(build(lay, extra, {"nodes": nodes}))
+
+        return build(*self.top, {"components": comps, "external_ports": ext, "connections": conns})
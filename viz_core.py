@@ -1,19 +1,482 @@
 import json
 import math
 import copy
+import hashlib
+import itertools
+from collections import deque
+import numpy as np
+import viz_codec
+from viz_compact import CompactDiagram
+
+class SpatialGrid:
+    """均匀网格空间索引：条目按 (扩展容差后的) 覆盖范围登记到格子里，查询只看点所在的一个格子"""
+    def __init__(self, cell=32):
+        self.cell = cell
+        self.cells = {}
+        self.entries = {}
+
+    def _cell_range(self, lo, hi):
+        return range(math.floor(lo / self.cell), math.floor(hi / self.cell) + 1)
+
+    def insert_cells(self, key, cells):
+        if key in self.entries: self.remove(key)
+        grid = self.cells
+        for c in cells:
+            bucket = grid.get(c)
+            if bucket is None: grid[c] = {key}
+            else: bucket.add(key)
+        self.entries[key] = cells
+
+    def insert_box(self, key, x1, y1, x2, y2):
+        rows = self._cell_range(y1, y2)
+        self.insert_cells(key, [(cx, cy) for cx in self._cell_range(x1, x2) for cy in rows])
+
+    def insert_segment(self, key, x1, y1, x2, y2, pad):
+        """按列扫描线段，只登记与线段距离可能 <= pad 的格子"""
+        if x1 > x2: x1, y1, x2, y2 = x2, y2, x1, y1
+        c = self.cell
+        slope = (y2 - y1) / (x2 - x1) if x2 > x1 else None
+        cells = []
+        for cx in self._cell_range(x1 - pad, x2 + pad):
+            if slope is None:
+                ya, yb = y1, y2
+            else:
+                ya = y1 + (max(x1, cx * c - pad) - x1) * slope
+                yb = y1 + (min(x2, (cx + 1) * c + pad) - x1) * slope
+            if ya > yb: ya, yb = yb, ya
+            cells += [(cx, cy) for cy in self._cell_range(ya - pad, yb + pad)]
+        self.insert_cells(key, cells)
+
+    def remove(self, key):
+        for c in self.entries.pop(key, ()):
+            bucket = self.cells[c]
+            bucket.discard(key)
+            if not bucket: del self.cells[c]
+
+    def query(self, x, y):
+        return self.cells.get((math.floor(x / self.cell), math.floor(y / self.cell)), ())
+
+    def __len__(self):
+        return len(self.entries)
+
+def approx_size(obj):
+    """粗略估算对象占用的字节数 (容器递归累加，不区分共享引用)"""
+    if isinstance(obj, dict): return 64 + sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)): return 56 + sum(approx_size(v) for v in obj)
+    if isinstance(obj, str): return 49 + len(obj)
+    return 32
+
+def _dict_pos(d, key):
+    """key 在字典中的位置；在末尾时不用遍历"""
+    return len(d) - 1 if next(reversed(d)) == key else list(d).index(key)
+
+def _dict_insert(d, key, value, pos=None):
+    """在 pos 处插入 (pos 为 None 或在末尾时直接追加)，保持字典对象不变"""
+    if pos is None or pos >= len(d):
+        d[key] = value
+        return
+    items = list(d.items())
+    items.insert(pos, (key, value))
+    d.clear()
+    d.update(items)
+
+class EditHistory:
+    """操作日志式的撤销/重做历史：每个分组是一串逆操作，总占用超过预算时丢弃最旧的分组"""
+    def __init__(self, budget):
+        self.budget = budget
+        self.undo_groups = deque()
+        self.redo_groups = []
+        self.bytes = 0
+        self._open = False
+
+    def clear(self):
+        self.undo_groups.clear()
+        self.redo_groups.clear()
+        self.bytes = 0
+        self._open = False
+
+    def checkpoint(self):
+        self._open = False
+
+    def record(self, inverse):
+        cost = approx_size(inverse)
+        if not self._open or not self.undo_groups:
+            self.undo_groups.append([[], 0])
+            self._open = True
+        group = self.undo_groups[-1]
+        group[0].append(inverse)
+        group[1] += cost
+        self.bytes += cost
+        # 新的编辑使重做分支失效
+        while self.redo_groups: self.bytes -= self.redo_groups.pop()[1]
+        self._trim()
+
+    def _trim(self):
+        while self.bytes > self.budget and len(self.undo_groups) > 1:
+            self.bytes -= self.undo_groups.popleft()[1]
+
+    def _push(self, stack, ops):
+        cost = sum(approx_size(op) for op in ops)
+        stack.append([ops, cost])
+        self.bytes += cost
+        self._open = False
+        self._trim()
+
+    def push_undo(self, ops): self._push(self.undo_groups, ops)
+    def push_redo(self, ops): self._push(self.redo_groups, ops)
+
+    def _pop(self, stack):
+        self._open = False
+        if not stack: return None
+        ops, cost = stack.pop()
+        self.bytes -= cost
+        return ops
+
+    def pop_undo(self): return self._pop(self.undo_groups)
+    def pop_redo(self): return self._pop(self.redo_groups)
+
+    def info(self):
+        return {"undo": len(self.undo_groups), "redo": len(self.redo_groups), "bytes": self.bytes, "budget": self.budget}
 
 class SystemBlockViz:
-    def __init__(self, json_data):
+    # 命中容差 (像素)
+    EXT_PORT_TOL = 10
+    PORT_TOL = 8
+    CENTER_TOL = 8
+    EDGE_TOL = 5
+
+    # 撤销历史默认占用上限 (字节，粗略估算)
+    HISTORY_BUDGET = 8 * 1024 * 1024
+
+    def __init__(self, json_data, history_budget=None):
         self.data = json_data if isinstance(json_data, dict) else json.loads(json_data)
+        self._history = EditHistory(self.HISTORY_BUDGET if history_budget is None else history_budget)
         self.ensure_structure()
         # --- 核心新增：初始化时自动清洗无效连接 ---
-        self.validate_connections()
+        # 端口索引不依赖连接，先建好供清洗直接查找，之后重建索引时复用
+        port_index = self._build_port_index()
+        self.validate_connections(port_index)
+        self.centroid_stats = {"hits": 0, "misses": 0}
+        self._changes, self._changes_base, self._tracking = [], 0, True
+        self._exports = {}   # 格式 -> (数据版本, 序列化结果)
+        self._renders = {}   # 渲染参数 -> (数据版本, 渲染结果)，见 render
+        self.index_generation = 0
+        self._rebuild_index(port_index)
+
+    @classmethod
+    def normalize(cls, json_data, with_report=False):
+        """
+        只做结构补全和连接清洗、不建索引，返回清洗后的数据 (与构造时的处理相同)，供批量导入等无界面场景使用。
+        with_report=True 时返回 (数据, 清洗报告)，报告格式见 validate_connections。
+        """
+        viz = cls.__new__(cls)
+        viz.data = json_data if isinstance(json_data, dict) else json.loads(json_data)
+        viz.ensure_structure()
+        report = viz.validate_connections()
+        return (viz.data, report) if with_report else viz.data
+
+    # --- 紧凑表示 ---
+    # 空闲会话可以把数据换成 CompactDiagram，并丢掉索引、撤销历史和导出缓存；
+    # 之后第一次访问任何被丢掉的属性 (包括 data) 时由 __getattr__ 自动还原，调用方无需感知
+    _COMPACT_DROPPED = frozenset(("data", "_port_index", "_seq", "_grid_ports", "_grid_boxes", "_grid_centers", "_grid_edges",
+                                  "_port_items", "_box_items", "_conn_items", "_centroid_cache", "_comp_order", "_conn_pos", "_node_nets", "_comp_ports"))
+
+    def compact(self):
+        """换成紧凑表示，返回是否成功 (数据形状不受支持时保持原样)"""
+        if self.is_compact: return True
+        packed = CompactDiagram.pack(self.data)
+        if packed is None: return False
+        for name in self._COMPACT_DROPPED: self.__dict__.pop(name, None)
+        self._history.clear()
+        self._exports.clear()
+        self._renders.clear()
+        # 版本号保持不变：数据内容没有变化，未还原前不需要重绘或重新保存
+        self._changes_base, self._changes = self.version, []
+        self._compact = packed
+        return True
+
+    @property
+    def is_compact(self):
+        return self.__dict__.get("_compact") is not None
+
+    @property
+    def compact_bytes(self):
+        return self._compact.nbytes if self.is_compact else None
+
+    def __getattr__(self, name):
+        packed = self.__dict__.get("_compact")
+        if packed is None or name not in self._COMPACT_DROPPED: raise AttributeError(name)
+        self._compact = None
+        self.data = packed.unpack()
+        # 数据内容没变，版本号不变 (不会触发重新保存)；数据对象都是新建的，
+        # 按 id 登记的缓存 (例如渲染片段) 通过 index_generation 的变化得知需要整体重建
+        self._rebuild_index(touch=False)
+        return getattr(self, name)
 
     def clone_data(self):
         return copy.deepcopy(self.data)
 
     def restore_data(self, old_data):
+        # 整体替换数据后，操作日志里引用的旧对象已失效
         self.data = old_data
+        self._history.clear()
+        self._rebuild_index()
+
+    # --- 端口坐标索引 ---
+    def _build_port_index(self):
+        """根据 self.data 构建 (组件, 端口) -> 坐标 的索引，坐标直接引用数据中的 list"""
+        index = {}
+        for name, info in self.data["external_ports"].items():
+            index[("external", name)] = info["coord"]
+        for comp_name, comp_info in self.data["components"].items():
+            if comp_name == "external": continue
+            for p in comp_info["ports"]:
+                # 端口重名时与线性查找保持一致：取第一个
+                index.setdefault((comp_name, p["name"]), p["coord"])
+        return index
+
+    def _rebuild_index(self, port_index=None, touch=True):
+        """重建全部索引；index_generation 加一，touch=True 时同时记一次整体变更 (版本号加一)"""
+        self.index_generation += 1
+        self._port_index = self._build_port_index() if port_index is None else port_index
+        self._node_nets = self._build_node_nets()
+        self._comp_ports = self._build_comp_ports(self._node_nets)
+        self._tracking = False
+        self._build_spatial_index()
+        self._tracking = True
+        if touch: self._touch("all", None)
+
+    # --- 变更日志 ---
+    # 每次数据变化追加一条 (类别, 键)，version 即累计变更数；渲染等缓存据此增量失效
+    CHANGE_LOG_LIMIT = 10000
+
+    def _touch(self, kind, key):
+        if not self._tracking: return
+        self._changes.append((kind, key))
+        if len(self._changes) > self.CHANGE_LOG_LIMIT:
+            drop = len(self._changes) // 2
+            del self._changes[:drop]
+            self._changes_base += drop
+
+    @property
+    def version(self):
+        return self._changes_base + len(self._changes)
+
+    def changes_since(self, version):
+        """返回 version 之后的变更 [(类别, 键)]；日志已截断时返回 None，调用方应整体重建"""
+        start = version - self._changes_base
+        if start < 0: return None
+        return self._changes[start:]
+
+    def _scan_port_coord(self, comp_name, port_name):
+        if comp_name == "external":
+            if port_name in self.data["external_ports"]:
+                return self.data["external_ports"][port_name]["coord"]
+        elif comp_name in self.data["components"]:
+            for p in self.data["components"][comp_name]["ports"]:
+                if p["name"] == port_name: return p["coord"]
+        return None
+
+    def _reindex_port(self, comp_name, port_name):
+        coord = self._scan_port_coord(comp_name, port_name)
+        if coord is None: self._port_index.pop((comp_name, port_name), None)
+        else: self._port_index[(comp_name, port_name)] = coord
+
+    # --- 节点 -> net 索引 ---
+    # 相当于路径完全压缩的并查集：每个节点 (组件, 端口) 直接指向所在的连接对象，合并 net 时把被并入一方的节点改指向保留的一方。
+    # 值为列表：原始数据中同一节点可能出现在多条连接 (或同一连接中多次) 里，每出现一次登记一次。
+    # _comp_ports 为反向的第二层：组件 -> 在连接中出现过的端口名集合，按组件找 net 时不必扫描全部节点
+    def _build_node_nets(self):
+        index = {}
+        for conn in self.data["connections"]:
+            for n in conn["nodes"]: index.setdefault((n["component"], n["port"]), []).append(conn)
+        return index
+
+    @staticmethod
+    def _build_comp_ports(node_nets):
+        comp_ports = {}
+        for comp_name, port_name in node_nets: comp_ports.setdefault(comp_name, set()).add(port_name)
+        return comp_ports
+
+    def _net_add(self, conn, nodes):
+        index = self._node_nets
+        for n in nodes:
+            conns = index.get((n["component"], n["port"]))
+            if conns is None:
+                index[(n["component"], n["port"])] = [conn]
+                self._comp_ports.setdefault(n["component"], set()).add(n["port"])
+            else: conns.append(conn)
+
+    def _net_remove(self, conn, nodes):
+        index = self._node_nets
+        for n in nodes:
+            key = (n["component"], n["port"])
+            conns = index[key]
+            for i, c in enumerate(conns):
+                if c is conn:
+                    del conns[i]
+                    break
+            if not conns:
+                del index[key]
+                ports = self._comp_ports[key[0]]
+                ports.discard(key[1])
+                if not ports: del self._comp_ports[key[0]]
+
+    def _nets_of(self, comp_name, port_name):
+        """包含该节点的连接对象列表 (通常只有一个)"""
+        return self._node_nets.get((comp_name, port_name), ())
+
+    def _conns_touching(self, comp_name, port_name=None):
+        """引用了该组件 (指定 port_name 时为该端口) 的连接对象，不重复；耗时只与引用数有关"""
+        ports = (port_name,) if port_name is not None else self._comp_ports.get(comp_name, ())
+        found = {}
+        for p in ports:
+            for conn in self._nets_of(comp_name, p): found[id(conn)] = conn
+        return list(found.values())
+
+    def _conn_indices(self, conns):
+        """连接对象 -> 升序下标"""
+        if len(conns) == 1: return [self._conn_index(conns[0])]
+        pos = self._conn_positions()
+        return sorted(pos[id(c)] for c in conns)
+
+    def _in_net(self, conn, comp_name, port_name):
+        return any(c is conn for c in self._nets_of(comp_name, port_name))
+
+    # --- 命中检测空间索引 ---
+    # 端口/组件框按数据对象的 id 登记，连接按连接对象的 id 登记；
+    # order 序号记录插入顺序，用于在多个候选中复现线性扫描的优先级
+    def _build_spatial_index(self):
+        self._seq = itertools.count()
+        self._grid_ports = SpatialGrid(32)
+        self._grid_boxes = SpatialGrid(64)
+        self._grid_centers = SpatialGrid(32)
+        self._grid_edges = SpatialGrid(64)
+        self._port_items = {}
+        self._box_items = {}
+        self._conn_items = {}
+        self._centroid_cache = {}
+        self._comp_order = {}
+        self._conn_pos = None
+        for name, info in self.data["external_ports"].items():
+            self._index_external_port(name, info)
+        for comp_name, comp_info in self.data["components"].items():
+            self._index_component(comp_name, comp_info)
+        for conn in self.data["connections"]:
+            self._index_conn(conn)
+
+    def _index_external_port(self, name, info, order=None):
+        x, y = info["coord"][0], info["coord"][1]
+        tol = self.EXT_PORT_TOL
+        self._port_items[id(info)] = (order or (0, next(self._seq)), "external", name, info["coord"], tol)
+        self._touch("port", id(info))
+        self._grid_ports.insert_box(id(info), x - tol, y - tol, x + tol, y + tol)
+
+    def _index_comp_port(self, comp_name, p, order=None):
+        x, y = p["coord"][0], p["coord"][1]
+        tol = self.PORT_TOL
+        self._port_items[id(p)] = (order or (1, self._comp_order[comp_name], next(self._seq)), comp_name, p["name"], p["coord"], tol)
+        self._touch("port", id(p))
+        self._grid_ports.insert_box(id(p), x - tol, y - tol, x + tol, y + tol)
+
+    def _unindex_port(self, obj):
+        self._touch("port", id(obj))
+        self._port_items.pop(id(obj), None)
+        self._grid_ports.remove(id(obj))
+
+    def _index_component(self, comp_name, comp_info, orders=None):
+        """orders 为撤销删除时恢复的 (组件序号, [各端口序号])，使命中测试与绘制的先后次序与删除前完全相同"""
+        self._touch("comp", comp_name)
+        self._comp_order[comp_name] = orders[0] if orders else next(self._seq)
+        box = comp_info["box"]
+        bx1, by1, bx2, by2 = min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3])
+        area = abs((box[2] - box[0]) * (box[3] - box[1]))
+        self._box_items[id(comp_info)] = ((area, self._comp_order[comp_name]), comp_name, (bx1, by1, bx2, by2))
+        self._grid_boxes.insert_box(id(comp_info), bx1, by1, bx2, by2)
+        for i, p in enumerate(comp_info["ports"]):
+            self._index_comp_port(comp_name, p, orders[1][i] if orders else None)
+
+    def _reindex_comp_ports(self, comp_name):
+        # 端口插回列表中间时，按列表顺序重新分配该组件所有端口的序号
+        for p in self.data["components"][comp_name]["ports"]:
+            self._unindex_port(p)
+            self._index_comp_port(comp_name, p)
+
+    def _unindex_component(self, comp_name, comp_info):
+        self._touch("comp", comp_name)
+        self._comp_order.pop(comp_name, None)
+        self._box_items.pop(id(comp_info), None)
+        self._grid_boxes.remove(id(comp_info))
+        for p in comp_info["ports"]:
+            self._unindex_port(p)
+
+    def _index_conn(self, conn):
+        """(重新) 登记一条连接的中心点和各分支线段"""
+        self._unindex_conn(conn)
+        center = self._cached_centroid(conn)
+        edges = {}
+        if center:
+            self._grid_centers.insert_box(id(conn), center[0] - self.CENTER_TOL, center[1] - self.CENTER_TOL,
+                                          center[0] + self.CENTER_TOL, center[1] + self.CENTER_TOL)
+            for i, node in enumerate(conn["nodes"]):
+                p_coord = self.get_port_coord(node["component"], node["port"])
+                if p_coord:
+                    key = (id(conn), i)
+                    edges[key] = (node, p_coord)
+                    self._grid_edges.insert_segment(key, p_coord[0], p_coord[1], center[0], center[1], self.EDGE_TOL)
+        self._conn_items[id(conn)] = (conn, center, edges)
+
+    def _unindex_conn(self, conn):
+        # 节点列表变化 (增删节点、端口被删除) 都会走到这里，同时作废该连接的中心缓存
+        self._touch("conn", id(conn))
+        self._centroid_cache.pop(id(conn), None)
+        item = self._conn_items.pop(id(conn), None)
+        if not item: return
+        self._grid_centers.remove(id(conn))
+        for key in item[2]: self._grid_edges.remove(key)
+
+    def _conn_positions(self):
+        # 连接的增删会使下标整体平移，这里按需重建 id -> 下标 映射
+        if self._conn_pos is None:
+            self._conn_pos = {id(conn): i for i, conn in enumerate(self.data["connections"])}
+        return self._conn_pos
+
+    def check_index(self):
+        """校验端口索引与空间索引都与 self.data 完全一致，不一致时抛出 AssertionError"""
+        expected = self._build_port_index()
+        missing = expected.keys() - self._port_index.keys()
+        extra = self._port_index.keys() - expected.keys()
+        assert not missing and not extra, f"端口索引不一致: 缺失 {sorted(missing)}, 多余 {sorted(extra)}"
+        for key, coord in expected.items():
+            assert self._port_index[key] is coord, f"端口索引坐标过期: {key}"
+
+        ports = [(id(info), "external", name, info["coord"]) for name, info in self.data["external_ports"].items()]
+        ports += [(id(p), c, p["name"], p["coord"]) for c, ci in self.data["components"].items() for p in ci["ports"]]
+        assert len(ports) == len(self._port_items) == len(self._grid_ports), "端口空间索引条目数不一致"
+        assert sorted(ports, key=lambda t: self._port_items[t[0]][0]) == ports, "端口空间索引顺序不一致"
+        for key, comp, name, coord in ports:
+            assert self._port_items[key][1:4] == (comp, name, coord), f"端口空间索引过期: {comp}.{name}"
+
+        comps = self.data["components"]
+        assert len(comps) == len(self._box_items) == len(self._grid_boxes) == len(self._comp_order), "组件空间索引条目数不一致"
+        for name, info in comps.items():
+            assert self._box_items[id(info)][1] == name, f"组件空间索引过期: {name}"
+
+        conns = self.data["connections"]
+        assert len(conns) == len(self._conn_items), "连接空间索引条目数不一致"
+        assert self._conn_pos is None or self._conn_pos == {id(c): i for i, c in enumerate(conns)}, "连接下标映射过期"
+        for conn in conns:
+            assert self._conn_items[id(conn)][1] == self._compute_centroid(conn), "连接中心索引过期"
+            if id(conn) in self._centroid_cache:
+                assert self._centroid_cache[id(conn)] == self._compute_centroid(conn), "连接中心缓存过期"
+        assert self._centroid_cache.keys() <= {id(c) for c in conns}, "连接中心缓存存在多余条目"
+
+        expected = self._build_node_nets()
+        assert expected.keys() == self._node_nets.keys(), "节点 -> net 索引的键不一致"
+        for key, nets in expected.items():
+            assert sorted(map(id, nets)) == sorted(map(id, self._node_nets[key])), f"节点 -> net 索引过期: {key}"
+        assert self._comp_ports == self._build_comp_ports(expected), "组件 -> 端口反向索引过期"
+        return True
 
     def ensure_structure(self):
         if "components" not in self.data: self.data["components"] = {}
@@ -21,43 +484,70 @@ class SystemBlockViz:
         if "connections" not in self.data: self.data["connections"] = []
 
     # --- 数据清洗与验证 ---
-    def validate_connections(self):
+    # 清洗报告逐条列出的被剔除项上限，超出的只计数
+    REPORT_LIMIT = 200
+
+    def validate_connections(self, port_keys=None):
         """
-        遍历所有连接，移除引用了不存在组件或端口的节点。
-        如果清洗后某条连接的节点数 < 2，则移除整条连接。
+        单遍清洗所有连接：移除引用了不存在组件或端口的节点，清洗后节点数 < 2 的连接整条移除。
+        port_keys 为所有有效 (组件, 端口) 的集合 (或以其为键的 dict，例如端口索引)，不传时现建一次，
+        每个节点只做一次哈希查找，总耗时与节点数、端口数之和成线性。
+        返回清洗报告 (同时保存为 self.validation)：
+          {"nodes_dropped", "connections_dropped", "connections_kept", "reasons": {原因: 个数},
+           "dropped_nodes": [{"connection", "component", "port", "reason"}], "dropped_connections": [{"connection", "nodes", "reason"}],
+           "truncated": 明细是否超过 REPORT_LIMIT 条}
+        connection 为清洗前的连接下标；节点原因为 unknown_component / unknown_port / unknown_external_port / malformed_node，
+        连接原因为 too_few_nodes (nodes 为清洗后剩余的节点数) / malformed_connection。
         """
+        comps = self.data["components"]
+        if port_keys is None:
+            port_keys = {(name, p["name"]) for name, info in comps.items() if name != "external" for p in info.get("ports", [])}
+            port_keys.update(("external", name) for name in self.data["external_ports"])
+        reasons = {}
+        dropped_nodes, dropped_conns = [], []
+        limit = self.REPORT_LIMIT
+        n_dropped = 0
         valid_connections = []
-        
-        for conn in self.data["connections"]:
+
+        def drop(i, node):
+            # 只在出错时调用：区分原因并记录明细
+            if not isinstance(node, dict) or not isinstance(node.get("component"), str) or not isinstance(node.get("port"), str): reason = "malformed_node"
+            elif node["component"] == "external": reason = "unknown_external_port"
+            elif node["component"] in comps: reason = "unknown_port"
+            else: reason = "unknown_component"
+            reasons[reason] = reasons.get(reason, 0) + 1
+            if len(dropped_nodes) < limit:
+                c_name, p_name = (node.get("component"), node.get("port")) if isinstance(node, dict) else (None, None)
+                dropped_nodes.append({"connection": i, "component": c_name, "port": p_name, "reason": reason})
+
+        for i, conn in enumerate(self.data["connections"]):
+            nodes = conn.get("nodes", []) if isinstance(conn, dict) else None
+            if not isinstance(nodes, list):
+                reasons["malformed_connection"] = reasons.get("malformed_connection", 0) + 1
+                if len(dropped_conns) < limit: dropped_conns.append({"connection": i, "nodes": 0, "reason": "malformed_connection"})
+                continue
             valid_nodes = []
-            for node in conn.get("nodes", []):
-                c_name = node["component"]
-                p_name = node["port"]
-                is_valid = False
-                
-                # 检查节点有效性
-                if c_name == "external":
-                    # 检查外部端口是否存在
-                    if p_name in self.data["external_ports"]:
-                        is_valid = True
-                elif c_name in self.data["components"]:
-                    # 检查组件是否存在，且端口是否在组件的端口列表中
-                    comp_ports = self.data["components"][c_name].get("ports", [])
-                    # 遍历组件的所有端口寻找匹配
-                    if any(p["name"] == p_name for p in comp_ports):
-                        is_valid = True
-                
-                if is_valid:
-                    valid_nodes.append(node)
-                # else: print(f"自动剔除无效节点: {c_name} -> {p_name}")
-            
+            for node in nodes:
+                try: ok = (node["component"], node["port"]) in port_keys
+                except (TypeError, KeyError): ok = False
+                if ok: valid_nodes.append(node)
+                else: drop(i, node)
+            n_dropped += len(nodes) - len(valid_nodes)
+
             # 只有当有效节点数 >= 2 时，保留该连接
             if len(valid_nodes) >= 2:
-                conn["nodes"] = valid_nodes
+                if len(valid_nodes) != len(nodes): conn["nodes"] = valid_nodes
                 valid_connections.append(conn)
-            # else: print("自动剔除无效连接 (节点不足)")
+            else:
+                reasons["too_few_nodes"] = reasons.get("too_few_nodes", 0) + 1
+                if len(dropped_conns) < limit: dropped_conns.append({"connection": i, "nodes": len(valid_nodes), "reason": "too_few_nodes"})
 
+        n_conns = len(self.data["connections"]) - len(valid_connections)
         self.data["connections"] = valid_connections
+        self.validation = {"nodes_dropped": n_dropped, "connections_dropped": n_conns, "connections_kept": len(valid_connections),
+                           "reasons": reasons, "dropped_nodes": dropped_nodes, "dropped_connections": dropped_conns,
+                           "truncated": n_dropped > len(dropped_nodes) or n_conns > len(dropped_conns)}
+        return self.validation
 
     # --- 辅助计算 ---
     def get_component_list_sorted(self):
@@ -68,9 +558,27 @@ class SystemBlockViz:
             comps.append({"name": name, "info": info, "area": area})
         return sorted(comps, key=lambda x: x["area"])
 
+    def connections_of(self, comp_name, port_name=None):
+        """返回引用了该组件 (指定 port_name 时为该端口) 的连接下标 (升序)"""
+        return self._conn_indices(self._conns_touching(comp_name, port_name))
+
     def get_connection_centroid(self, conn_idx):
         if conn_idx >= len(self.data["connections"]): return None
-        conn = self.data["connections"][conn_idx]
+        return self._cached_centroid(self.data["connections"][conn_idx])
+
+    def _cached_centroid(self, conn):
+        key = id(conn)
+        if key in self._centroid_cache:
+            self.centroid_stats["hits"] += 1
+            return self._centroid_cache[key]
+        self.centroid_stats["misses"] += 1
+        center = self._centroid_cache[key] = self._compute_centroid(conn)
+        return center
+
+    def centroid_cache_info(self):
+        return dict(self.centroid_stats, size=len(self._centroid_cache))
+
+    def _compute_centroid(self, conn):
         if not conn["nodes"]: return None
         sum_x, sum_y, count = 0, 0, 0
         for node in conn["nodes"]:
@@ -81,14 +589,7 @@ class SystemBlockViz:
         return [sum_x / count, sum_y / count]
 
     def get_port_coord(self, comp_name, port_name):
-        if comp_name == "external":
-            if port_name in self.data["external_ports"]:
-                return self.data["external_ports"][port_name]["coord"]
-        else:
-            if comp_name in self.data["components"]:
-                for p in self.data["components"][comp_name]["ports"]:
-                    if p["name"] == port_name: return p["coord"]
-        return None
+        return self._port_index.get((comp_name, port_name))
 
     def _dist(self, x1, y1, x2, y2):
         return math.sqrt((x1-x2)**2 + (y1-y2)**2)
@@ -104,39 +605,272 @@ class SystemBlockViz:
 
     # --- 命中检测 ---
     def hit_test(self, x, y):
+        # 优先级与容差同线性扫描：端口 > 连接中心 > 连线分支 > 面积最小的组件
         # 1. 端口 (优先)
-        for name, info in self.data["external_ports"].items():
-            if self._dist(x, y, info["coord"][0], info["coord"][1]) < 10: 
-                return {"type": "port", "comp": "external", "port": name}
-        for comp_name, comp_info in self.data["components"].items():
-            for p in comp_info["ports"]:
-                if self._dist(x, y, p["coord"][0], p["coord"][1]) < 8:
-                     return {"type": "port", "comp": comp_name, "port": p["name"]}
+        best = None
+        for key in self._grid_ports.query(x, y):
+            order, comp, name, coord, tol = self._port_items[key]
+            if (best is None or order < best[0]) and self._dist(x, y, coord[0], coord[1]) < tol:
+                best = (order, comp, name)
+        if best: return {"type": "port", "comp": best[1], "port": best[2]}
 
         # 2. 连接中心
-        for idx, conn in enumerate(self.data["connections"]):
-            center = self.get_connection_centroid(idx)
-            if center and self._dist(x, y, center[0], center[1]) < 8:
-                return {"type": "conn_center", "index": idx}
-        
+        best = None
+        for key in self._grid_centers.query(x, y):
+            center = self._conn_items[key][1]
+            if self._dist(x, y, center[0], center[1]) < self.CENTER_TOL:
+                idx = self._conn_positions()[key]
+                if best is None or idx < best: best = idx
+        if best is not None: return {"type": "conn_center", "index": best}
+
         # 3. 连线分支
+        best = None
+        for key in self._grid_edges.query(x, y):
+            _, center, edges = self._conn_items[key[0]]
+            node, p_coord = edges[key]
+            if self._dist_point_to_segment(x, y, p_coord[0], p_coord[1], center[0], center[1]) < self.EDGE_TOL:
+                order = (self._conn_positions()[key[0]], key[1])
+                if best is None or order < best[0]: best = (order, node)
+        if best: return {"type": "conn_edge", "index": best[0][0], "node": best[1]}
+
+        # 4. 组件
+        best = None
+        for key in self._grid_boxes.query(x, y):
+            order, name, (bx1, by1, bx2, by2) = self._box_items[key]
+            if bx1 <= x <= bx2 and by1 <= y <= by2 and (best is None or order < best[0]):
+                best = (order, name)
+        if best: return {"type": "component", "name": best[1]}
+        return None
+
+    # --- 批量命中检测 ---
+    def hit_test_batch(self, points, max_elems=1 << 22):
+        """
+        批量命中检测：points 为 (N, 2) 的坐标数组，返回长度为 N 的列表，每一项与 hit_test(x, y) 完全一致。
+        每一层的候选按线性扫描的顺序排列，用 NumPy 广播计算 点 x 候选 的命中矩阵，取每行第一个命中；
+        max_elems 限制单次广播矩阵的元素数。
+        """
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        results = [None] * len(pts)
+        pending = np.arange(len(pts))
+        for hit_fn, make_result in self._batch_layers():
+            if not len(pending): break
+            left = []
+            rows = max(1, max_elems // max(1, hit_fn.size))
+            for start in range(0, len(pending), rows):
+                idx = pending[start:start + rows]
+                mask = hit_fn(pts[idx, 0][:, None], pts[idx, 1][:, None])
+                found = mask.any(axis=1)
+                first = mask.argmax(axis=1)
+                for i, j in zip(idx[found].tolist(), first[found].tolist()):
+                    results[i] = make_result(j)
+                left.append(idx[~found])
+            pending = np.concatenate(left) if left else pending
+        return results
+
+    def _batch_layers(self):
+        """按 hit_test 的优先级生成 (命中函数, 结果构造函数)，候选顺序与线性扫描一致"""
+        # 1. 端口
+        ports = [("external", name, info["coord"], self.EXT_PORT_TOL) for name, info in self.data["external_ports"].items()]
+        ports += [(c, p["name"], p["coord"], self.PORT_TOL) for c, ci in self.data["components"].items() for p in ci["ports"]]
+        if ports:
+            xy = np.array([p[2][:2] for p in ports], dtype=np.float64)
+            tol = np.array([p[3] for p in ports], dtype=np.float64)
+            def hit_ports(px, py):
+                return np.sqrt((px - xy[:, 0]) ** 2 + (py - xy[:, 1]) ** 2) < tol
+            hit_ports.size = len(ports)
+            yield hit_ports, lambda j: {"type": "port", "comp": ports[j][0], "port": ports[j][1]}
+
+        # 2. 连接中心 / 3. 连线分支
+        centers, edges = [], []
         for idx, conn in enumerate(self.data["connections"]):
             center = self.get_connection_centroid(idx)
             if not center: continue
+            centers.append((idx, center))
             for node in conn["nodes"]:
                 p_coord = self.get_port_coord(node["component"], node["port"])
-                if p_coord:
-                    if self._dist_point_to_segment(x, y, p_coord[0], p_coord[1], center[0], center[1]) < 5:
-                        return {"type": "conn_edge", "index": idx, "node": node}
-        
-        # 4. 组件
-        sorted_comps = self.get_component_list_sorted()
-        for item in sorted_comps:
-            box = item["info"]["box"]
-            bx1, by1, bx2, by2 = min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3])
-            if bx1 <= x <= bx2 and by1 <= y <= by2:
-                return {"type": "component", "name": item["name"]}
-        return None
+                if p_coord: edges.append((idx, node, p_coord, center))
+        if centers:
+            cxy = np.array([c[1] for c in centers], dtype=np.float64)
+            def hit_centers(px, py):
+                return np.sqrt((px - cxy[:, 0]) ** 2 + (py - cxy[:, 1]) ** 2) < self.CENTER_TOL
+            hit_centers.size = len(centers)
+            yield hit_centers, lambda j: {"type": "conn_center", "index": centers[j][0]}
+        if edges:
+            seg = np.array([[e[2][0], e[2][1], e[3][0], e[3][1]] for e in edges], dtype=np.float64)
+            x1, y1, x2, y2 = seg[:, 0], seg[:, 1], seg[:, 2], seg[:, 3]
+            l2 = (x1 - x2) ** 2 + (y1 - y2) ** 2
+            degenerate = l2 == 0
+            safe_l2 = np.where(degenerate, 1.0, l2)
+            def hit_edges(px, py):
+                # 与 _dist_point_to_segment 相同的运算顺序，保证浮点结果逐位一致
+                t = ((px - x1) * (x2 - x1) + (py - y1) * (y2 - y1)) / safe_l2
+                t = np.clip(t, 0, 1)
+                proj_x = np.where(degenerate, x1, x1 + t * (x2 - x1))
+                proj_y = np.where(degenerate, y1, y1 + t * (y2 - y1))
+                return np.sqrt((px - proj_x) ** 2 + (py - proj_y) ** 2) < self.EDGE_TOL
+            hit_edges.size = len(edges)
+            yield hit_edges, lambda j: {"type": "conn_edge", "index": edges[j][0], "node": edges[j][1]}
+
+        # 4. 组件 (面积从小到大)
+        comps = self.get_component_list_sorted()
+        if comps:
+            boxes = np.array([item["info"]["box"][:4] for item in comps], dtype=np.float64)
+            bx1, bx2 = np.minimum(boxes[:, 0], boxes[:, 2]), np.maximum(boxes[:, 0], boxes[:, 2])
+            by1, by2 = np.minimum(boxes[:, 1], boxes[:, 3]), np.maximum(boxes[:, 1], boxes[:, 3])
+            def hit_boxes(px, py):
+                return (bx1 <= px) & (px <= bx2) & (by1 <= py) & (py <= by2)
+            hit_boxes.size = len(comps)
+            yield hit_boxes, lambda j: {"type": "component", "name": comps[j]["name"]}
+
+    # --- 编辑原语 ---
+    # 所有对 self.data 的修改都经过下面的 _op_* 原语：原语负责同步各类索引，并返回自身的逆操作
+    # (方法名, *参数)。_apply 把逆操作记入历史，撤销/重做时按相反顺序重放即可，开销只与编辑规模有关。
+    def _apply(self, op, *args):
+        self._history.record(getattr(self, op)(*args))
+
+    def _run(self, op):
+        return getattr(self, op[0])(*op[1:])
+
+    def _op_insert_component(self, name, info, pos=None, orders=None):
+        _dict_insert(self.data["components"], name, info, pos)
+        if name != "external":
+            for p in info["ports"]: self._port_index.setdefault((name, p["name"]), p["coord"])
+        self._index_component(name, info, orders)
+        return ("_op_remove_component", name)
+
+    def _op_remove_component(self, name):
+        # 逆操作记下原来的位置与序号，撤销后字典顺序与命中/绘制次序都与删除前相同
+        comps = self.data["components"]
+        pos = _dict_pos(comps, name)
+        orders = (self._comp_order[name], [self._port_items[id(p)][0] for p in comps[name]["ports"]])
+        info = comps.pop(name)
+        for p in info["ports"]: self._port_index.pop((name, p["name"]), None)
+        self._unindex_component(name, info)
+        return ("_op_insert_component", name, info, pos, orders)
+
+    def _op_set_type(self, name, c_type, present=True):
+        info = self.data["components"][name]
+        inverse = ("_op_set_type", name, info.get("type"), "type" in info)
+        self._touch("comp", name)
+        if present: info["type"] = c_type
+        else: info.pop("type", None)
+        return inverse
+
+    def _op_insert_external(self, name, info, pos=None, order=None):
+        _dict_insert(self.data["external_ports"], name, info, pos)
+        self._port_index[("external", name)] = info["coord"]
+        self._index_external_port(name, info, order)
+        return ("_op_remove_external", name)
+
+    def _op_remove_external(self, name):
+        ext = self.data["external_ports"]
+        pos = _dict_pos(ext, name)
+        info = ext.pop(name)
+        order = self._port_items[id(info)][0]
+        self._port_index.pop(("external", name), None)
+        self._unindex_port(info)
+        return ("_op_insert_external", name, info, pos, order)
+
+    def _op_insert_port(self, comp_name, pos, port):
+        ports = self.data["components"][comp_name]["ports"]
+        ports.insert(pos, port)
+        if pos == len(ports) - 1: self._index_comp_port(comp_name, port)
+        else: self._reindex_comp_ports(comp_name)
+        self._reindex_port(comp_name, port["name"])
+        return ("_op_remove_port", comp_name, pos)
+
+    def _op_remove_port(self, comp_name, pos):
+        port = self.data["components"][comp_name]["ports"].pop(pos)
+        self._unindex_port(port)
+        self._reindex_port(comp_name, port["name"])
+        return ("_op_insert_port", comp_name, pos, port)
+
+    def _op_rename_port(self, comp_name, port, new_name):
+        old_name = port["name"]
+        port["name"] = new_name
+        order, _, _, coord, tol = self._port_items[id(port)]
+        self._port_items[id(port)] = (order, comp_name, new_name, coord, tol)
+        self._touch("port", id(port))
+        self._reindex_port(comp_name, old_name)
+        self._reindex_port(comp_name, new_name)
+        return ("_op_rename_port", comp_name, port, old_name)
+
+    def _op_insert_conn(self, idx, conn):
+        conns = self.data["connections"]
+        conns.insert(idx, conn)
+        if idx == len(conns) - 1 and self._conn_pos is not None: self._conn_pos[id(conn)] = idx
+        else: self._conn_pos = None
+        self._net_add(conn, conn["nodes"])
+        self._index_conn(conn)
+        return ("_op_remove_conn", idx)
+
+    def _op_remove_conn(self, idx):
+        conns = self.data["connections"]
+        conn = conns.pop(idx)
+        self._net_remove(conn, conn["nodes"])
+        self._unindex_conn(conn)
+        # 删除末尾的连接不影响其它连接的下标
+        if idx == len(conns) and self._conn_pos is not None: self._conn_pos.pop(id(conn), None)
+        else: self._conn_pos = None
+        return ("_op_insert_conn", idx, conn)
+
+    def _op_set_nodes(self, conn, nodes):
+        old_nodes = conn["nodes"]
+        self._net_remove(conn, old_nodes)
+        conn["nodes"] = nodes
+        self._net_add(conn, nodes)
+        self._index_conn(conn)
+        return ("_op_set_nodes", conn, old_nodes)
+
+    def _op_extend_nodes(self, conn, nodes):
+        old_len = len(conn["nodes"])
+        conn["nodes"].extend(nodes)
+        self._net_add(conn, nodes)
+        self._index_conn(conn)
+        return ("_op_truncate_nodes", conn, old_len)
+
+    def _op_truncate_nodes(self, conn, length):
+        tail = conn["nodes"][length:]
+        del conn["nodes"][length:]
+        self._net_remove(conn, tail)
+        self._index_conn(conn)
+        return ("_op_extend_nodes", conn, tail)
+
+    def _op_set_node(self, node, key, value):
+        # 只改名字不改坐标 (重命名组件/端口)，连线几何不变
+        old = node[key]
+        conn = next(c for c in self._nets_of(node["component"], node["port"]) if any(n is node for n in c["nodes"]))
+        self._net_remove(conn, [node])
+        node[key] = value
+        self._net_add(conn, [node])
+        self._touch("node", id(node))
+        return ("_op_set_node", node, key, old)
+
+    # --- 撤销/重做 ---
+    def checkpoint(self):
+        """开始一个新的撤销分组，之后的编辑在一次 undo 中整体撤销"""
+        self._history.checkpoint()
+
+    def undo(self):
+        group = self._history.pop_undo()
+        if group is None: return False
+        self._history.push_redo([self._run(op) for op in reversed(group)])
+        return True
+
+    def redo(self):
+        group = self._history.pop_redo()
+        if group is None: return False
+        self._history.push_undo([self._run(op) for op in reversed(group)])
+        return True
+
+    def can_undo(self):
+        return bool(self._history.undo_groups)
+
+    def can_redo(self):
+        return bool(self._history.redo_groups)
+
+    def history_info(self):
+        return self._history.info()
 
     # --- CRUD ---
     def add_component(self, name, c_type, box):
@@ -147,116 +881,194 @@ class SystemBlockViz:
         real_box = [min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)]
         # ------------------------
         
-        self.data["components"][name] = {
+        self._apply("_op_insert_component", name, {
             "type": c_type,
             "box": real_box,
             "ports": []
-        }
+        })
         return True, ""
     
     def rename_component(self, old_name, new_name):
         if old_name == new_name: return True, ""
         if new_name in self.data["components"] or new_name in self.data["external_ports"]: return False, "新名字已存在"
-        comp_data = self.data["components"].pop(old_name)
-        self.data["components"][new_name] = comp_data
-        for conn in self.data["connections"]:
+        comp_data = self.data["components"][old_name]
+        # 组件移到字典末尾，与原先 pop + 重新插入的顺序一致
+        self._apply("_op_remove_component", old_name)
+        self._apply("_op_insert_component", new_name, comp_data)
+        for conn in self._conns_touching(old_name):
             for node in conn["nodes"]:
-                if node["component"] == old_name: node["component"] = new_name
+                if node["component"] == old_name: self._apply("_op_set_node", node, "component", new_name)
         return True, ""
 
     def update_component_type(self, name, new_type):
         if name in self.data["components"]:
-            self.data["components"][name]["type"] = new_type
+            self._apply("_op_set_type", name, new_type)
 
     def delete_component(self, name):
         if name in self.data["components"]:
-            del self.data["components"][name]
+            # 先清理连线再删组件，撤销时组件先恢复，连线才能重新算出坐标
             self._cleanup_connections(name, None)
+            self._apply("_op_remove_component", name)
 
     def add_port(self, comp_name, port_name, port_type, coord):
         if comp_name == "external":
             if port_name in self.data["external_ports"]: return False, "重名"
-            self.data["external_ports"][port_name] = {"type": port_type, "coord": [int(coord[0]), int(coord[1])]}
+            self._apply("_op_insert_external", port_name, {"type": port_type, "coord": [int(coord[0]), int(coord[1])]})
         else:
             ports = self.data["components"][comp_name]["ports"]
             for p in ports:
                 if p["name"] == port_name: return False, "重名"
-            ports.append({"name": port_name, "coord": [int(coord[0]), int(coord[1])]})
+            self._apply("_op_insert_port", comp_name, len(ports), {"name": port_name, "coord": [int(coord[0]), int(coord[1])]})
         return True, ""
     
     def rename_port(self, comp_name, old_port_name, new_port_name):
         if old_port_name == new_port_name: return True, ""
         if comp_name == "external":
             if new_port_name in self.data["external_ports"]: return False, "重名"
-            self.data["external_ports"][new_port_name] = self.data["external_ports"].pop(old_port_name)
+            info = self.data["external_ports"][old_port_name]
+            self._apply("_op_remove_external", old_port_name)
+            self._apply("_op_insert_external", new_port_name, info)
         else:
             comp = self.data["components"][comp_name]
             for p in comp["ports"]:
                 if p["name"] == new_port_name: return False, "重名"
             for p in comp["ports"]:
                 if p["name"] == old_port_name:
-                    p["name"] = new_port_name; break
-        for conn in self.data["connections"]:
+                    self._apply("_op_rename_port", comp_name, p, new_port_name); break
+        for conn in self._conns_touching(comp_name, old_port_name):
             for node in conn["nodes"]:
                 if node["component"] == comp_name and node["port"] == old_port_name:
-                    node["port"] = new_port_name
+                    self._apply("_op_set_node", node, "port", new_port_name)
         return True, ""
 
     def delete_port(self, comp_name, port_name):
         if comp_name == "external":
             if port_name in self.data["external_ports"]:
-                del self.data["external_ports"][port_name]
                 self._cleanup_connections("external", port_name)
+                self._apply("_op_remove_external", port_name)
         else:
             comp = self.data["components"].get(comp_name)
             if comp:
-                comp["ports"] = [p for p in comp["ports"] if p["name"] != port_name]
                 self._cleanup_connections(comp_name, port_name)
+                # 从后往前删，撤销时按相反顺序插回原位置
+                for pos in reversed(range(len(comp["ports"]))):
+                    if comp["ports"][pos]["name"] == port_name: self._apply("_op_remove_port", comp_name, pos)
 
     def connect_nodes(self, node_a, node_b):
-        idx_a = self._find_conn_index(node_a)
-        idx_b = self._find_conn_index(node_b)
         target_a = {"component": node_a['comp'], "port": node_a['port']}
         target_b = {"component": node_b['comp'], "port": node_b['port']}
-        if idx_a is not None and idx_b is not None:
-            if idx_a == idx_b: return
-            self.data["connections"][idx_a]["nodes"].extend(self.data["connections"][idx_b]["nodes"])
-            del self.data["connections"][idx_b]
-        elif idx_a is not None: self.data["connections"][idx_a]["nodes"].append(target_b)
-        elif idx_b is not None: self.data["connections"][idx_b]["nodes"].append(target_a)
-        else: self.data["connections"].append({"nodes": [target_a, target_b], "points": []})
+        if target_a == target_b: return
+        conn_a, conn_b = self._find_conn(node_a), self._find_conn(node_b)
+        if conn_a is not None and conn_b is not None:
+            if conn_a is conn_b: return
+            # 合并两个 net：只搬入 a 中还没有的节点 (同一节点也只搬一次)
+            moved, seen = [], set()
+            for n in conn_b["nodes"]:
+                key = (n["component"], n["port"])
+                if key in seen or self._in_net(conn_a, *key): continue
+                seen.add(key)
+                moved.append(n)
+            self._apply("_op_extend_nodes", conn_a, moved)
+            self._apply("_op_remove_conn", self._conn_index(conn_b))
+        elif conn_a is not None: self._apply("_op_extend_nodes", conn_a, [target_b])
+        elif conn_b is not None: self._apply("_op_extend_nodes", conn_b, [target_a])
+        else: self._apply("_op_insert_conn", len(self.data["connections"]), {"nodes": [target_a, target_b], "points": []})
 
     def add_to_connection(self, conn_idx, node_struct):
         target = {"component": node_struct['comp'], "port": node_struct['port']}
-        for n in self.data["connections"][conn_idx]["nodes"]:
-            if n["component"] == target["component"] and n["port"] == target["port"]: return
-        self.data["connections"][conn_idx]["nodes"].append(target)
+        conn = self.data["connections"][conn_idx]
+        if self._in_net(conn, target["component"], target["port"]): return
+        self._apply("_op_extend_nodes", conn, [target])
 
     def delete_connection_node(self, conn_idx, node_struct=None):
         if node_struct is None:
-            del self.data["connections"][conn_idx]
+            self._apply("_op_remove_conn", conn_idx)
             return
         conn = self.data["connections"][conn_idx]
-        conn["nodes"] = [n for n in conn["nodes"] if not (n["component"] == node_struct['component'] and n["port"] == node_struct['port'])]
-        if len(conn["nodes"]) < 2: del self.data["connections"][conn_idx]
+        new_nodes = [n for n in conn["nodes"] if not (n["component"] == node_struct['component'] and n["port"] == node_struct['port'])]
+        if len(new_nodes) < 2: self._apply("_op_remove_conn", conn_idx)
+        else: self._apply("_op_set_nodes", conn, new_nodes)
 
-    def _find_conn_index(self, node_struct):
-        for i, conn in enumerate(self.data["connections"]):
-            for n in conn["nodes"]:
-                if n["component"] == node_struct['comp'] and n["port"] == node_struct['port']: return i
-        return None
+    def _find_conn(self, node_struct):
+        # 节点出现在多条连接中时与线性扫描一致：取下标最小的一条
+        nets = self._nets_of(node_struct['comp'], node_struct['port'])
+        if not nets: return None
+        if len(nets) == 1: return nets[0]
+        return min(nets, key=self._conn_index)
+
+    def _conn_index(self, conn):
+        # 下标映射有效时直接查；否则在 C 层扫描 id 列表，不为一次查询重建整个映射
+        if self._conn_pos is not None: return self._conn_pos[id(conn)]
+        return list(map(id, self.data["connections"])).index(id(conn))
 
     def _cleanup_connections(self, comp_name, port_name=None):
+        # 只处理引用了该组件/端口的连接 (按下标升序，与逐条扫描的操作顺序一致)
+        conns = self.data["connections"]
         to_remove = []
-        for i, conn in enumerate(self.data["connections"]):
+        for i in self.connections_of(comp_name, port_name or None):
+            conn = conns[i]
             new_nodes = []
             for n in conn["nodes"]:
                 hit_comp = (n["component"] == comp_name)
                 hit_port = (n["port"] == port_name) if port_name else True
                 if not (hit_comp and hit_port): new_nodes.append(n)
-            conn["nodes"] = new_nodes
-            if len(conn["nodes"]) < 2: to_remove.append(i)
-        for i in sorted(to_remove, reverse=True): del self.data["connections"][i]
+            if len(new_nodes) < 2: to_remove.append(i)
+            elif len(new_nodes) != len(conn["nodes"]): self._apply("_op_set_nodes", conn, new_nodes)
+        for i in reversed(to_remove): self._apply("_op_remove_conn", i)
+
+    def export(self, fmt="json"):
+        """按 viz_codec 中的格式 (json / compact / gzip / binary) 序列化，结果按数据版本缓存，数据未变时直接返回"""
+        hit = self._exports.get(fmt)
+        if hit is not None and hit[0] == self.version: return hit[1]
+        # 紧凑表示下临时还原一份数据来序列化，不还原索引
+        payload = viz_codec.dumps(self._compact.unpack() if self.is_compact else self.data, fmt)
+        self._exports[fmt] = (self.version, payload)
+        return payload
 
     def export_json(self):
-        return json.dumps(self.data, indent=2, ensure_ascii=False)
\ No newline at end of file
+        return self.export("json")
+
+    def content_hash(self):
+        """数据内容的 sha256 (按紧凑 JSON 计算)，按数据版本缓存；内容相同的数据重新加载后哈希不变"""
+        hit = self._exports.get("sha256")
+        if hit is not None and hit[0] == self.version: return hit[1]
+        digest = hashlib.sha256(self.export("compact").encode("utf-8")).hexdigest()
+        self._exports["sha256"] = (self.version, digest)
+        return digest
+
+    # --- 无界面渲染 ---
+    RENDER_FORMATS = ("svg", "png")
+    RENDER_CACHE_SIZE = 16
+
+    def extent(self):
+        """所有组件框与端口的外接范围 (宽, 高)，从原点算起，四周留出端口半径与组件名的余量"""
+        xs, ys = [1], [1]
+        for _, _, (x1, y1, x2, y2) in self._box_items.values():
+            xs.append(x2)
+            ys.append(y2)
+        for item in self._port_items.values():
+            xs.append(item[3][0] + 10)
+            ys.append(item[3][1] + 10)
+        return math.ceil(max(xs)) + 2, math.ceil(max(ys)) + 2
+
+    def render(self, fmt="svg", size=None, max_size=None, image=None, image_key=None):
+        """
+        无界面渲染，绘制规则与编辑页未选中任何对象时相同 (svg 见 viz_render.render_svg，png 见 viz_raster.render_png)。
+        size 为图片坐标下的画布大小 (通常是底图尺寸)，默认取 extent()；max_size 限制输出的最长边 (像素)。
+        fmt=svg 时 image 为底图地址；fmt=png 时 image 为底图的图片字节，image_key 为其内容哈希 (不传时现算)。
+        结果按 (数据版本, 参数, 底图内容哈希) 缓存，数据改动后旧结果全部作废。
+        """
+        # viz_raster 导入了本模块，在这里按需导入以免循环导入
+        from viz_render import render_svg
+        from viz_raster import render_png
+        if fmt not in self.RENDER_FORMATS: raise ValueError(f"未知的渲染格式: {fmt}")
+        if fmt == "png" and image is not None and image_key is None: image_key = hashlib.sha256(image).hexdigest()
+        key = (fmt, tuple(size) if size else None, max_size, image if fmt == "svg" else image_key)
+        hit = self._renders.get(key)
+        if hit is not None and hit[0] == self.version: return hit[1]
+        canvas = tuple(size) if size else self.extent()
+        payload = render_svg(self, canvas, max_size, image) if fmt == "svg" else render_png(self, canvas, max_size, image)
+        self._renders = {k: v for k, v in self._renders.items() if v[0] == self.version}
+        if len(self._renders) >= self.RENDER_CACHE_SIZE: self._renders.pop(next(iter(self._renders)))
+        self._renders[key] = (self.version, payload)
+        return payload
\ No newline at end of file
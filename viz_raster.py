@@ -0,0 +1,230 @@
+"""
+栅格瓦片渲染：元素很多时用 PIL 把组件框、连线、端口画成 PNG 瓦片，浏览器只需加载可见范围内的几十张图片，
+代替成千上万个 SVG 节点。选中高亮涉及的元素很少，仍由 SvgRenderer 以矢量叠加在瓦片上。
+瓦片按 (缩放级别 z, 列 tx, 行 ty) 划分，级别 z 的比例为 2**z (屏幕像素 / 图片像素)，每张 TILE x TILE 像素。
+每张瓦片有一个戳记：最近一次与它相交的改动发生时的数据版本。编辑只改变被改动元素 (改动前后) 外接框覆盖的瓦片的戳记，
+其它瓦片的地址不变，服务端缓存与浏览器缓存都继续命中。
+"""
+import io
+import math
+from collections import OrderedDict
+from PIL import Image, ImageDraw, ImageFont
+from viz_core import SpatialGrid
+
+TILE = 256
+
+class TileRenderer:
+    MIN_ELEMENTS = 10000    # 元素数达到此值时编辑页改用瓦片
+    MIN_ZOOM, MAX_ZOOM = -6, 2
+    LABEL_MIN_SCALE = 0.5   # 与 SvgRenderer 相同：缩小到此比例以下不画组件名
+    PORT_MIN_SCALE = 0.2    # 缩小到此比例以下不画端口
+    DIRTY_LIMIT = 512       # 记录的改动区域超过此数时整体作废
+
+    def __init__(self, viz, cache_size=512, size=None):
+        self.viz = viz
+        self.cache_size = cache_size
+        self.size = size              # 画布 (底图) 大小，瓦片范围取它与所有元素外接范围的并
+        self._tiles = OrderedDict()   # (z, tx, ty) -> (戳记, PNG 字节)
+        self._fonts = {}
+        self._version = None
+        self._generation = None
+        self.stats = {"hits": 0, "misses": 0}
+
+    # --- 元素外接框与改动区域 ---
+    def _bounds(self, kind, key):
+        """元素当前的绘制范围 (含线宽与组件名)，元素已不存在或不绘制时为 None"""
+        viz = self.viz
+        if kind == "comp":
+            info = viz.data["components"].get(key)
+            if info is None: return None
+            box = info["box"]
+            x1, y1, x2, y2 = min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3])
+            return x1 - 2, y1 - 23, max(x2, x1 + 10 * len(key)) + 2, y2 + 2
+        if kind == "conn":
+            item = viz._conn_items.get(key)
+            if item is None or not item[1]: return None
+            xs, ys = [item[1][0]], [item[1][1]]
+            for _, p_c in item[2].values():
+                xs.append(p_c[0])
+                ys.append(p_c[1])
+            return min(xs) - 6, min(ys) - 6, max(xs) + 6, max(ys) + 6
+        item = self.viz._port_items.get(key)
+        if item is None: return None
+        (cx, cy), r = item[3], (10 if item[1] == "external" else 5) + 1
+        return cx - r, cy - r, cx + r, cy + r
+
+    def _index(self, kind, key):
+        """更新一个元素的外接框，返回改动前后的范围 (用于作废瓦片)"""
+        old = self._boxes.pop((kind, key), None)
+        if old is not None: self._grid.remove((kind, key))
+        new = self._bounds(kind, key)
+        if new is not None:
+            self._boxes[(kind, key)] = new
+            self._grid.insert_box((kind, key), *new)
+        return [b for b in (old, new) if b is not None]
+
+    def _sync(self):
+        viz = self.viz
+        if self._version == viz.version and self._generation == viz.index_generation: return
+        # 索引重建过 (例如紧凑表示还原) 时数据对象都换了，按 id 登记的外接框整体重建
+        changes = viz.changes_since(self._version) if self._version is not None and self._generation == viz.index_generation else None
+        if changes is None or any(kind == "all" for kind, _ in changes):
+            self._boxes, self._grid = {}, SpatialGrid(TILE)
+            self._base, self._dirty = viz.version, []
+            self._tiles.clear()
+            for name in viz.data["components"]: self._index("comp", name)
+            for key in viz._conn_items: self._index("conn", key)
+            for key in viz._port_items: self._index("port", key)
+        else:
+            # 重命名节点 ("node") 不改变任何图形
+            for kind, key in dict.fromkeys(changes):
+                if kind in ("comp", "conn", "port"):
+                    self._dirty += [(viz.version, b) for b in self._index(kind, key)]
+            if len(self._dirty) > self.DIRTY_LIMIT: self._base, self._dirty = viz.version, []
+        w, h = viz.extent()
+        self._canvas = max(w, self.size[0]) if self.size else w, max(h, self.size[1]) if self.size else h
+        self._version, self._generation = viz.version, viz.index_generation
+
+    # --- 瓦片 ---
+    def level(self, scale):
+        """缩放比例对应的瓦片级别：取最接近的 2 的幂，浏览器再把瓦片缩放到实际大小"""
+        return min(self.MAX_ZOOM, max(self.MIN_ZOOM, round(math.log2(max(scale, 1e-6)))))
+
+    def _extent(self, z, tx, ty):
+        size = TILE / 2 ** z
+        return tx * size, ty * size, (tx + 1) * size, (ty + 1) * size
+
+    def tiles(self, z):
+        """级别 z 下有内容的瓦片列数与行数，范围外的瓦片不绘制"""
+        self._sync()
+        size = TILE / 2 ** z
+        return math.ceil(self._canvas[0] / size), math.ceil(self._canvas[1] / size)
+
+    def valid(self, z, tx, ty):
+        if not self.MIN_ZOOM <= z <= self.MAX_ZOOM: return False
+        cols, rows = self.tiles(z)
+        return 0 <= tx < cols and 0 <= ty < rows
+
+    def stamp(self, z, tx, ty):
+        self._sync()
+        x0, y0, x1, y1 = self._extent(z, tx, ty)
+        stamp = self._base
+        for version, (bx1, by1, bx2, by2) in self._dirty:
+            if version > stamp and bx1 <= x1 and bx2 >= x0 and by1 <= y1 and by2 >= y0: stamp = version
+        return stamp
+
+    def markup(self, url, region, scale):
+        """覆盖区域 (图片坐标) 的 <image> 元素，url 为瓦片地址前缀 (后接 /z/tx/ty)，返回 (文档, 级别)"""
+        z = self.level(scale)
+        size = TILE / 2 ** z
+        cols, rows = self.tiles(z)
+        parts = []
+        for ty in range(max(0, math.floor(region[1] / size)), min(rows, math.ceil(region[3] / size))):
+            for tx in range(max(0, math.floor(region[0] / size)), min(cols, math.ceil(region[2] / size))):
+                parts.append(f'<image href="{url}/{z}/{tx}/{ty}?v={self.stamp(z, tx, ty)}" x="{tx * size:g}" y="{ty * size:g}" '
+                             f'width="{size:g}" height="{size:g}" preserveAspectRatio="none" />')
+        return "".join(parts), z
+
+    def tile(self, z, tx, ty):
+        """返回 (戳记, PNG 字节)，戳记未变时直接取缓存"""
+        stamp = self.stamp(z, tx, ty)
+        key = (z, tx, ty)
+        hit = self._tiles.get(key)
+        if hit is not None and hit[0] == stamp:
+            self._tiles.move_to_end(key)
+            self.stats["hits"] += 1
+            return hit
+        self.stats["misses"] += 1
+        hit = self._tiles[key] = (stamp, self._draw(z, tx, ty))
+        while len(self._tiles) > self.cache_size: self._tiles.popitem(last=False)
+        return hit
+
+    def _query(self, x0, y0, x1, y1):
+        # 低缩放级别的瓦片覆盖的格子比元素还多时直接逐个比较外接框
+        cells = (math.floor(x1 / TILE) - math.floor(x0 / TILE) + 1) * (math.floor(y1 / TILE) - math.floor(y0 / TILE) + 1)
+        if cells > len(self._boxes):
+            return [k for k, (bx1, by1, bx2, by2) in self._boxes.items() if bx1 <= x1 and bx2 >= x0 and by1 <= y1 and by2 >= y0]
+        found = set()
+        for cx in range(math.floor(x0 / TILE), math.floor(x1 / TILE) + 1):
+            for cy in range(math.floor(y0 / TILE), math.floor(y1 / TILE) + 1):
+                found.update(self._grid.cells.get((cx, cy), ()))
+        return [k for k in found if self._boxes[k][0] <= x1 and self._boxes[k][2] >= x0 and self._boxes[k][1] <= y1 and self._boxes[k][3] >= y0]
+
+    def _draw(self, z, tx, ty):
+        x0, y0, x1, y1 = self._extent(z, tx, ty)
+        keys = self._query(x0, y0, x1, y1)
+        if not keys: return blank_tile()
+        img = Image.new("RGBA", (TILE, TILE), (0, 0, 0, 0))
+        paint(self.viz, img, x0, y0, 2 ** z, keys)
+        buf = io.BytesIO()
+        img.save(buf, "PNG", compress_level=3)
+        return buf.getvalue()
+
+_FONTS = {}
+
+def _font(size):
+    font = _FONTS.get(size)
+    if font is None: font = _FONTS[size] = ImageFont.load_default(size=size)
+    return font
+
+def paint(viz, img, x0, y0, s, keys=None):
+    """
+    按 SvgRenderer 的绘制规则与顺序把元素画到 img 上：组件 (面积从大到小)、连接 (按下标)、端口 (先外部后组件)。
+    (x0, y0) 为 img 左上角的图片坐标，s 为比例 (img 像素 / 图片像素)；keys 为要画的 (类别, 键)，None 为全部。
+    """
+    if keys is None:
+        keys = [("comp", n) for n in viz.data["components"]] + [("conn", k) for k in viz._conn_items] + [("port", k) for k in viz._port_items]
+    comps = sorted((k for kind, k in keys if kind == "comp"), key=lambda n: (-viz._box_items[id(viz.data["components"][n])][0][0], -viz._comp_order[n]))
+    pos = viz._conn_positions()
+    conns = sorted((k for kind, k in keys if kind == "conn"), key=pos.__getitem__)
+    ports = sorted((k for kind, k in keys if kind == "port"), key=lambda k: viz._port_items[k][0]) if s >= TileRenderer.PORT_MIN_SCALE else []
+
+    draw = ImageDraw.Draw(img)
+    X = lambda v: (v - x0) * s
+    Y = lambda v: (v - y0) * s
+    lw = max(1, round(2 * s))
+    font = _font(max(1, round(16 * s))) if s >= TileRenderer.LABEL_MIN_SCALE else None
+    for name in comps:
+        _, _, (bx1, by1, bx2, by2) = viz._box_items[id(viz.data["components"][name])]
+        draw.rectangle([X(bx1), Y(by1), X(bx2), Y(by2)], fill=(0, 0, 255, 13), outline=(0, 0, 255, 255), width=lw)
+        if font: draw.text((X(bx1), Y(by1 - 5)), name, fill=(0, 0, 255, 255), font=font, anchor="ls")
+    green = (0, 204, 0, 255)
+    for key in conns:
+        _, (cx, cy), edges = viz._conn_items[key]
+        for _, p_c in edges.values(): draw.line([X(p_c[0]), Y(p_c[1]), X(cx), Y(cy)], fill=green, width=lw)
+        r = 4 * s
+        draw.ellipse([X(cx) - r, Y(cy) - r, X(cx) + r, Y(cy) + r], fill=green, outline=(255, 255, 255, 255))
+    for key in ports:
+        _, comp, _, (cx, cy), _ = viz._port_items[key]
+        r = (10 if comp == "external" else 5) * s
+        fill = (255, 165, 0, 255) if comp == "external" else (128, 0, 128, 255)
+        draw.ellipse([X(cx) - r, Y(cy) - r, X(cx) + r, Y(cy) + r], fill=fill, outline=(255, 255, 255, 255))
+
+def render_png(viz, size, max_size=None, image=None):
+    """
+    整张标注图的 PNG：size 为图片坐标下的画布大小，max_size 限制输出的最长边 (等比缩小，不放大)；
+    image 为底图的图片字节，缩放到同样大小后垫在元素下面，没有底图时背景透明。
+    """
+    w, h = size
+    s = min(1.0, max_size / max(w, h, 1)) if max_size else 1.0
+    out = (max(1, round(w * s)), max(1, round(h * s)))
+    layer = Image.new("RGBA", out, (0, 0, 0, 0))
+    paint(viz, layer, 0, 0, s)
+    if image is not None:
+        bg = Image.open(io.BytesIO(image))
+        # JPEG 可以在解码时直接按 1/2、1/4、1/8 缩小
+        bg.draft("RGB", out)
+        layer = Image.alpha_composite(bg.convert("RGBA").resize(out, Image.BILINEAR, reducing_gap=2.0), layer).convert("RGB")
+    buf = io.BytesIO()
+    layer.save(buf, "PNG", compress_level=3)
+    return buf.getvalue()
+
+_BLANK = None
+
+def blank_tile():
+    global _BLANK
+    if _BLANK is None:
+        buf = io.BytesIO()
+        Image.new("RGBA", (TILE, TILE), (0, 0, 0, 0)).save(buf, "PNG")
+        _BLANK = buf.getvalue()
+    return _BLANK
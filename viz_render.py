@@ -0,0 +1,525 @@
+import html
+import math
+from collections import OrderedDict
+import numpy as np
+
+# 元素的样式：颜色由语义 class 决定，编辑页放在页头，独立的 SVG 文档 (render_svg) 内嵌
+VIZ_CSS = '''
+svg.viz .comp rect { fill: rgba(0,0,255,0.05); stroke: blue; stroke-width: 2px; }
+svg.viz .comp text { fill: blue; font-size: 16px; font-weight: bold; }
+svg.viz .net circle { fill: #00cc00; stroke: white; stroke-width: 1px; }
+svg.viz .net line { stroke: #00cc00; stroke-width: 2px; }
+svg.viz .port { fill: purple; stroke: white; stroke-width: 1px; }
+svg.viz .port.ext { fill: orange; }
+svg.viz.dim .comp rect { fill: rgba(0,0,255,0.02); stroke: rgba(0,0,255,0.3); }
+svg.viz.dim .comp text { display: none; }
+svg.viz.dim .net circle { fill: rgba(0,200,0,0.2); }
+svg.viz.dim .net line { stroke: rgba(0,200,0,0.2); }
+svg.viz.dim .port { fill: #cccccc; }
+svg.viz .comp.hi rect { fill: none; stroke: red; stroke-width: 4px; }
+svg.viz .comp.hi text { display: inline; fill: red; }
+svg.viz .net.hi circle { fill: red; r: 6px; }
+svg.viz .net.hi line, svg.viz .net line.hi { stroke: red; stroke-width: 4px; }
+svg.viz .port.hi { fill: yellow; stroke: black; stroke-width: 2px; }
+svg.viz .dens { stroke: none; }
+svg.viz .dens.comp { fill: blue; }
+svg.viz .dens.net { fill: #00cc00; }
+svg.viz .dens.port { fill: purple; }
+svg.viz.dim .dens { opacity: 0.3; }
+'''
+
+# 浏览器端高亮：静态文档带稳定 id 和语义 class，选中变化时只切换 svg.viz 上的 dim 与元素上的 hi
+HIGHLIGHT_HEAD_HTML = "\n<style>" + VIZ_CSS + "</style>\n" + '''<script>
+function vizApplyHighlight(host) {
+  const svg = host.querySelector("svg.viz"), state = host._vizState;
+  if (!svg || !state) return;
+  svg.classList.toggle("dim", state.dim);
+  for (const el of svg._vizHi || []) el.classList.remove("hi");
+  svg._vizHi = state.hi.map((id) => svg.getElementById(id)).filter((el) => el);
+  for (const el of svg._vizHi) el.classList.add("hi");
+}
+// 把画布在滚动容器中的可见范围 (图片坐标) 与缩放比例 (屏幕像素 / 图片像素) 报给服务端，每帧最多一次
+window.vizWatchViewport = (hostId, imgW, imgH) => {
+  const host = document.getElementById(hostId);
+  if (!host || host._vizViewport) return;
+  let scroller = host.parentElement;
+  while (scroller && !/(auto|scroll)/.test(getComputedStyle(scroller).overflow)) scroller = scroller.parentElement;
+  let pending = false;
+  const report = () => {
+    pending = false;
+    const r = host.getBoundingClientRect();
+    const v = scroller ? scroller.getBoundingClientRect() : { left: 0, top: 0, right: window.innerWidth, bottom: window.innerHeight };
+    if (!r.width || !r.height) return;
+    const sx = imgW / r.width, sy = imgH / r.height;
+    emitEvent("viz_viewport", {
+      id: hostId, scale: r.width / imgW,
+      x0: (Math.max(r.left, v.left) - r.left) * sx, y0: (Math.max(r.top, v.top) - r.top) * sy,
+      x1: (Math.min(r.right, v.right) - r.left) * sx, y1: (Math.min(r.bottom, v.bottom) - r.top) * sy,
+    });
+  };
+  const schedule = () => { if (!pending) { pending = true; requestAnimationFrame(report); } };
+  host._vizViewport = schedule;
+  (scroller || window).addEventListener("scroll", schedule, { passive: true });
+  // 缩放通过 transform 实现，不触发 ResizeObserver，另外监听 style 变化
+  new ResizeObserver(schedule).observe(host);
+  if (scroller) new ResizeObserver(schedule).observe(scroller);
+  new MutationObserver(schedule).observe(host, { attributes: true, attributeFilter: ["style"] });
+  schedule();
+};
+// 画框模式：拖拽时的虚线框完全在浏览器中绘制 (每帧最多更新一次)，松开后只把最终的框 (图片坐标) 报给服务端
+window.vizDrawMode = (hostId, on) => {
+  const host = document.getElementById(hostId);
+  if (!host) return;
+  host._vizDraw = on;
+  if (host._vizDrawInit) return;
+  host._vizDrawInit = true;
+  const NS = "http://www.w3.org/2000/svg";
+  let drag = null, pending = false;
+  const toImage = (e) => {
+    const r = host.getBoundingClientRect(), vb = drag.vb;
+    return [(e.clientX - r.left) * vb.width / r.width, (e.clientY - r.top) * vb.height / r.height];
+  };
+  const box = () => [Math.min(drag.start[0], drag.curr[0]), Math.min(drag.start[1], drag.curr[1]),
+                     Math.max(drag.start[0], drag.curr[0]), Math.max(drag.start[1], drag.curr[1])];
+  const draw = () => {
+    pending = false;
+    if (!drag) return;
+    const [x1, y1, x2, y2] = box();
+    drag.rect.setAttribute("x", x1); drag.rect.setAttribute("y", y1);
+    drag.rect.setAttribute("width", x2 - x1); drag.rect.setAttribute("height", y2 - y1);
+  };
+  host.addEventListener("pointerdown", (e) => {
+    const svg = host.querySelector("svg.viz");
+    if (!host._vizDraw || e.button !== 0 || !svg || !svg.viewBox.baseVal.width) return;
+    const vb = svg.viewBox.baseVal;
+    // 预览放在单独的 svg 中，画布内容被服务端替换时不受影响
+    const layer = document.createElementNS(NS, "svg");
+    layer.setAttribute("viewBox", `0 0 ${vb.width} ${vb.height}`);
+    layer.setAttribute("style", "position: absolute; left: 0; top: 0; width: 100%; height: 100%; pointer-events: none;");
+    const rect = document.createElementNS(NS, "rect");
+    rect.setAttribute("style", "fill: none; stroke: red; stroke-width: 3px; stroke-dasharray: 5,5;");
+    layer.appendChild(rect);
+    host.appendChild(layer);
+    drag = { vb, layer, rect };
+    drag.start = drag.curr = toImage(e);
+    // 阻止随后的兼容鼠标事件，拖拽期间不向服务端发送任何事件
+    e.preventDefault();
+    host.setPointerCapture(e.pointerId);
+    draw();
+  });
+  host.addEventListener("pointermove", (e) => {
+    if (!drag) return;
+    drag.curr = toImage(e);
+    if (!pending) { pending = true; requestAnimationFrame(draw); }
+  });
+  const finish = (e, send) => {
+    if (!drag) return;
+    if (send) drag.curr = toImage(e);
+    const b = box();
+    drag.layer.remove();
+    drag = null;
+    if (send) emitEvent("viz_draw_box", { id: hostId, box: b });
+  };
+  host.addEventListener("pointerup", (e) => finish(e, true));
+  host.addEventListener("pointercancel", (e) => finish(e, false));
+};
+window.vizHighlight = (hostId, state) => {
+  const host = document.getElementById(hostId);
+  if (!host) return;
+  host._vizState = state;
+  vizApplyHighlight(host);
+  // 画布内容被整体替换后重新套用当前高亮
+  if (!host._vizObserver) {
+    host._vizObserver = new MutationObserver(() => vizApplyHighlight(host));
+    host._vizObserver.observe(host, { childList: true, subtree: true });
+  }
+};
+</script>
+'''
+
+def view_region(rect, margin=0.5, tile=256):
+    """可见范围四周各扩展 margin 倍宽高并对齐到 tile 的整数倍，作为实际渲染的区域；小幅滚动仍落在区域内时不必重绘"""
+    x0, y0, x1, y1 = rect
+    mx, my = (x1 - x0) * margin, (y1 - y0) * margin
+    return (math.floor((x0 - mx) / tile) * tile, math.floor((y0 - my) / tile) * tile,
+            math.ceil((x1 + mx) / tile) * tile, math.ceil((y1 + my) / tile) * tile)
+
+def region_contains(region, rect):
+    return region[0] <= rect[0] and region[1] <= rect[1] and region[2] >= rect[2] and region[3] >= rect[3]
+
+def selection_key(sel):
+    """把 hit_test 的结果转成可哈希的键，用于文档缓存"""
+    if not sel: return None
+    if sel["type"] == "component": return ("component", sel["name"])
+    if sel["type"] == "port": return ("port", sel["comp"], sel["port"])
+    if sel["type"] == "conn_center": return ("conn_center", sel["index"])
+    if sel["type"] == "conn_edge": return ("conn_edge", sel["index"], sel["node"]["component"], sel["node"]["port"])
+    return None
+
+class SvgRenderer:
+    """
+    增量 SVG 渲染器：为每个组件/连接/端口缓存 normal、dim、high 三种状态的片段，
+    数据变化时按 viz 的变更日志只重新生成改动过的元素；选中变化只替换高亮元素的片段。
+    最近用过的完整文档按 (数据版本, 选中对象, 连线起点) 放在 LRU 中，来回切换选中不再重新拼接。
+    编辑器使用 markup() + highlight()：静态文档只随数据版本下发一次，选中只推送需要切换 class 的元素 id。
+    元素数达到 CULL_MIN_ELEMENTS 时 markup(view) 只输出与可见区域相交的元素，缩小到一定程度后按 detail() 的级别
+    省略组件名、把端口合并成按格子计数的密度块；再小时不画端口，连接与过小的组件合并成密度块。
+    """
+    CULL_MIN_ELEMENTS = 3000
+    LABEL_MIN_SCALE = 0.5   # 缩放比例低于此值：不画组件名，端口合并为密度块
+    NET_MIN_SCALE = 0.2     # 低于此值：不画端口，连接与屏幕上小于 SMALL_COMP_PX 的组件合并为密度块
+    SMALL_COMP_PX = 8
+    DENSITY_PX = 16         # 密度块在屏幕上的边长 (像素)，按 2 的幂取整到图片坐标
+
+    def __init__(self, viz, doc_cache_size=8):
+        self.viz = viz
+        self.doc_cache_size = doc_cache_size
+        self._frags = {}
+        self._docs = OrderedDict()
+        self._version = None
+        self._generation = None
+        self._ids = {}
+        self.stats = {"fragments": 0, "doc_hits": 0, "doc_misses": 0}
+
+    # --- 片段生成 ---
+    def _comp_frag(self, name, state):
+        box = self.viz.data["components"][name]["box"]
+        bx, by = int(min(box[0], box[2])), int(min(box[1], box[3]))
+        bw, bh = int(abs(box[2]-box[0])), int(abs(box[3]-box[1]))
+        stroke, sw, op = ("blue", 2, 0.05)
+        if state == "high": stroke, sw, op = ("red", 4, 0)
+        elif state == "dim": stroke, op = ("rgba(0,0,255,0.3)", 0.02)
+        frag = f'<rect x="{bx}" y="{by}" width="{bw}" height="{bh}" fill="rgba(0,0,255,{op})" stroke="{stroke}" stroke-width="{sw}" />'
+        if state != "dim":
+            frag += f'<text x="{bx}" y="{by-5}" fill="{stroke}" font-size="16" font-weight="bold">{html.escape(name)}</text>'
+        return frag
+
+    def _conn_frag(self, conn, state, edge=None):
+        viz = self.viz
+        center = viz._cached_centroid(conn)
+        if not center: return ""
+        net_high = (state == "high")
+        c_c = "red" if net_high else ("#00cc00" if state == "normal" else "rgba(0,200,0,0.2)")
+        parts = [f'<circle cx="{center[0]}" cy="{center[1]}" r="{6 if net_high else 4}" fill="{c_c}" stroke="white" stroke-width="1" />']
+        for node in conn["nodes"]:
+            p_c = viz.get_port_coord(node["component"], node["port"])
+            if p_c:
+                e_high = net_high or (edge is not None and (node["component"], node["port"]) == edge)
+                l_c = "red" if e_high else c_c
+                l_w = 4 if e_high else 2
+                parts.append(f'<line x1="{p_c[0]}" y1="{p_c[1]}" x2="{center[0]}" y2="{center[1]}" stroke="{l_c}" stroke-width="{l_w}" />')
+        return "".join(parts)
+
+    def _port_frag(self, port, state):
+        comp, name, coord, is_ext = port
+        cx, cy = coord
+        r = 10 if is_ext else 5
+        p_high = (state == "high")
+        fill = "yellow" if p_high else ("orange" if is_ext else "purple")
+        stroke = "black" if p_high else "white"
+        if state == "dim": fill = "#cccccc"
+        return f'<circle cx="{cx}" cy="{cy}" r="{r}" fill="{fill}" stroke="{stroke}" stroke-width="{2 if p_high else 1}" />'
+
+    def _eid(self, kind, key):
+        """元素在浏览器端的稳定 id，元素存在期间保持不变"""
+        eid = self._ids.get((kind, key))
+        if eid is None: eid = self._ids[(kind, key)] = f"v{kind[0]}{len(self._ids)}"
+        return eid
+
+    def _mark(self, kind, key, label=True):
+        """带 id 与语义 class 的片段，颜色由 HIGHLIGHT_HEAD_HTML 中的样式决定；连线的每条边放在所属 net 的 <g> 中"""
+        eid = self._eid(kind, key)
+        if kind == "comp":
+            box = self.viz.data["components"][key]["box"]
+            bx, by = int(min(box[0], box[2])), int(min(box[1], box[3]))
+            bw, bh = int(abs(box[2]-box[0])), int(abs(box[3]-box[1]))
+            text = f'<text x="{bx}" y="{by-5}">{html.escape(key)}</text>' if label else ""
+            return f'<g id="{eid}" class="comp"><rect x="{bx}" y="{by}" width="{bw}" height="{bh}" />{text}</g>'
+        if kind == "conn":
+            conn = self._conn_objs[key]
+            center = self.viz._cached_centroid(conn)
+            if not center: return ""
+            parts = [f'<g id="{eid}" class="net"><circle cx="{center[0]}" cy="{center[1]}" r="4" />']
+            for i, node in enumerate(conn["nodes"]):
+                p_c = self.viz.get_port_coord(node["component"], node["port"])
+                if p_c: parts.append(f'<line id="{eid}e{i}" x1="{p_c[0]}" y1="{p_c[1]}" x2="{center[0]}" y2="{center[1]}" />')
+            parts.append('</g>')
+            return "".join(parts)
+        _, _, (cx, cy), is_ext = self._port_objs[key]
+        return f'<circle id="{eid}" class="{"port ext" if is_ext else "port"}" cx="{cx}" cy="{cy}" r="{10 if is_ext else 5}" />'
+
+    def _frag(self, kind, key, state):
+        cached = self._frags.setdefault((kind, key), {})
+        if state not in cached:
+            self.stats["fragments"] += 1
+            if state == "mark": cached[state] = self._mark(kind, key)
+            elif state == "lite": cached[state] = self._mark(kind, key, label=False)
+            elif kind == "comp": cached[state] = self._comp_frag(key, state)
+            elif kind == "conn": cached[state] = self._conn_frag(self._conn_objs[key], state)
+            else: cached[state] = self._port_frag(self._port_objs[key], state)
+        return cached[state]
+
+    # --- 与数据同步 ---
+    def _sync(self):
+        viz = self.viz
+        if self._version == viz.version and self._generation == viz.index_generation: return
+        # 索引重建过 (例如紧凑表示还原) 时数据对象都换了，按 id 登记的内容整体重建
+        changes = viz.changes_since(self._version) if self._version is not None and self._generation == viz.index_generation else None
+        if changes is None or any(kind == "all" for kind, _ in changes):
+            self._frags.clear()
+            self._layers = {kind: self._build_layer(kind) for kind in ("comp", "conn", "port")}
+        else:
+            dirty = {"comp": set(), "conn": set(), "port": set()}
+            for kind, key in changes:
+                if kind in dirty: dirty[kind].add(key)
+            for kind, keys in dirty.items():
+                if not keys: continue
+                for key in keys: self._frags.pop((kind, key), None)
+                if all(self._in_place(kind, key) for key in keys): self._patch_layer(kind, keys)
+                else: self._layers[kind] = self._build_layer(kind)
+        self._docs.clear()
+        self._version, self._generation = viz.version, viz.index_generation
+
+    def _build_layer(self, kind):
+        # 绘制顺序：组件按面积从大到小，连接按下标，端口先外部后组件
+        viz = self.viz
+        if kind == "comp":
+            self._comp_seq = dict(viz._comp_order)
+            keys = [item["name"] for item in reversed(viz.get_component_list_sorted())]
+        elif kind == "conn":
+            self._conn_objs = {id(c): c for c in viz.data["connections"]}
+            keys = list(self._conn_objs)
+        else:
+            self._port_objs = {id(info): ("external", name, info["coord"], True) for name, info in viz.data["external_ports"].items()}
+            for cname, cinfo in viz.data["components"].items():
+                for p in cinfo["ports"]: self._port_objs[id(p)] = (cname, p["name"], p["coord"], False)
+            self._port_seq = {key: viz._port_items[key][0] for key in self._port_objs}
+            self._port_keys = {}
+            for key, port in self._port_objs.items(): self._port_keys.setdefault(port[:2], []).append(key)
+            keys = list(self._port_objs)
+        # bounds 为各元素外接框 (n, 4) 的数组，第一次按视口裁剪时才计算
+        return {"kind": kind, "keys": keys, "pos": {k: i for i, k in enumerate(keys)}, "lists": {}, "joined": {}, "bounds": None}
+
+    def _in_place(self, kind, key):
+        """元素仍在原来的绘制位置 (只有内容变化) 时可以原地替换片段，否则需要重建整层"""
+        viz = self.viz
+        layer = self._layers[kind]
+        if key not in layer["pos"]: return False
+        if kind == "comp":
+            return viz._comp_order.get(key) == self._comp_seq[key]
+        if kind == "conn":
+            conns = viz.data["connections"]
+            i = layer["pos"][key]
+            return len(conns) == len(layer["keys"]) and conns[i] is self._conn_objs[key]
+        item = viz._port_items.get(key)
+        return item is not None and item[0] == self._port_seq[key]
+
+    def _patch_layer(self, kind, keys):
+        layer = self._layers[kind]
+        if kind == "port":
+            for key in keys:
+                old = self._port_objs[key]
+                _, comp, name, coord, tol = self.viz._port_items[key]
+                self._port_objs[key] = (comp, name, coord, old[3])
+                self._port_keys[old[:2]].remove(key)
+                if not self._port_keys[old[:2]]: del self._port_keys[old[:2]]
+                self._port_keys.setdefault((comp, name), []).append(key)
+        for state, frags in layer["lists"].items():
+            for key in keys: frags[layer["pos"][key]] = self._frag(kind, key, state)
+        layer["joined"].clear()
+        if layer["bounds"] is not None:
+            for key in keys: layer["bounds"][layer["pos"][key]] = self._bounds(kind, key)
+
+    def _bounds(self, kind, key):
+        """元素的外接框 (x1, y1, x2, y2)；不绘制的连接 (没有中心) 为 NaN，任何区域都不会选中它"""
+        viz = self.viz
+        if kind == "comp":
+            box = viz.data["components"][key]["box"]
+            return min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3])
+        if kind == "conn":
+            conn = self._conn_objs[key]
+            center = viz._cached_centroid(conn)
+            if not center: return (math.nan,) * 4
+            xs, ys = [center[0]], [center[1]]
+            for node in conn["nodes"]:
+                p_c = viz.get_port_coord(node["component"], node["port"])
+                if p_c:
+                    xs.append(p_c[0])
+                    ys.append(p_c[1])
+            return min(xs), min(ys), max(xs), max(ys)
+        _, _, (cx, cy), is_ext = self._port_objs[key]
+        r = 10 if is_ext else 5
+        return cx - r, cy - r, cx + r, cy + r
+
+    def _visible(self, kind, region):
+        """与区域相交的元素在层中的下标 (升序，即绘制顺序)"""
+        layer = self._layers[kind]
+        if layer["bounds"] is None:
+            layer["bounds"] = np.array([self._bounds(kind, key) for key in layer["keys"]], dtype=np.float64).reshape(-1, 4)
+        b = layer["bounds"]
+        x0, y0, x1, y1 = region
+        return np.flatnonzero((b[:, 0] <= x1) & (b[:, 2] >= x0) & (b[:, 1] <= y1) & (b[:, 3] >= y0))
+
+    def _compose(self, layer, state, overrides):
+        """拼接一层：整体使用 state 状态的片段，overrides 中的元素替换为指定片段"""
+        if state not in layer["lists"]:
+            layer["lists"][state] = [self._frag(layer["kind"], k, state) for k in layer["keys"]]
+        if not overrides:
+            if state not in layer["joined"]: layer["joined"][state] = "".join(layer["lists"][state])
+            return layer["joined"][state]
+        frags = list(layer["lists"][state])
+        for key, frag in overrides.items():
+            if key in layer["pos"]: frags[layer["pos"][key]] = frag
+        return "".join(frags)
+
+    # --- 渲染 ---
+    def render(self, selected=None, connect_start=None):
+        """返回 <svg> 内部的内容，绘制规则与原先的 refresh_canvas 相同"""
+        self._sync()
+        doc_key = (self._version, selection_key(selected), selection_key(connect_start))
+        if doc_key in self._docs:
+            self._docs.move_to_end(doc_key)
+            self.stats["doc_hits"] += 1
+            return self._docs[doc_key]
+        self.stats["doc_misses"] += 1
+
+        state = "dim" if selected is not None else "normal"
+        comp_high, conn_high, port_high = self._overrides(selected, connect_start)
+        doc = (self._compose(self._layers["comp"], state, comp_high) + self._compose(self._layers["conn"], state, conn_high)
+               + self._compose(self._layers["port"], state, port_high))
+        self._docs[doc_key] = doc
+        while len(self._docs) > self.doc_cache_size: self._docs.popitem(last=False)
+        return doc
+
+    def overlay(self, selected=None, connect_start=None):
+        """只含高亮元素 (high 状态片段) 的文档，叠加在栅格瓦片上使用，大小只与选中对象有关"""
+        self._sync()
+        return "".join("".join(high.values()) for high in self._overrides(selected, connect_start))
+
+    def _overrides(self, selected, connect_start):
+        """选中对象与连线起点对应的高亮片段：({组件: 片段}, {连接: 片段}, {端口: 片段})"""
+        viz, sel = self.viz, selected
+        dim = (sel is not None)
+
+        comp_high = {}
+        if dim and sel["type"] == "component":
+            comp_high[sel["name"]] = self._frag("comp", sel["name"], "high")
+
+        conn_high = {}
+        if dim:
+            conns = viz.data["connections"]
+            if sel["type"] == "conn_center": idxs = [sel["index"]]
+            elif sel["type"] == "component": idxs = viz.connections_of(sel["name"])
+            elif sel["type"] == "port": idxs = viz.connections_of(sel["comp"], sel["port"])
+            else: idxs = []
+            for i in idxs:
+                if i < len(conns): conn_high[id(conns[i])] = self._frag("conn", id(conns[i]), "high")
+            if sel["type"] == "conn_edge" and sel["index"] < len(conns):
+                conn = conns[sel["index"]]
+                conn_high[id(conn)] = self._conn_frag(conn, "dim", edge=(sel["node"]["component"], sel["node"]["port"]))
+
+        port_high = {}
+        for p in (sel if dim and sel["type"] == "port" else None, connect_start):
+            if not p: continue
+            for key in self._port_keys.get((p["comp"], p["port"]), []):
+                port_high[key] = self._frag("port", key, "high")
+        return comp_high, conn_high, port_high
+
+    def markup(self, view=None):
+        """
+        带稳定 id 与语义 class 的静态文档 (<svg class="viz"> 内部的内容)，只随数据版本变化。
+        view 为 (区域, 缩放比例) 时只输出与区域 (图片坐标 x0, y0, x1, y1) 相交的元素，并按缩放比例简化 (见 detail)。
+        """
+        self._sync()
+        if view is None:
+            doc_key = (self._version, "markup")
+            if doc_key not in self._docs:
+                self._docs[doc_key] = "".join(self._compose(self._layers[kind], "mark", None) for kind in ("comp", "conn", "port"))
+            return self._docs[doc_key]
+        region, scale = tuple(view[0]), view[1]
+        level, cell = self.detail(scale)
+        doc_key = (self._version, "markup", region, level, cell)
+        if doc_key in self._docs:
+            self._docs.move_to_end(doc_key)
+            return self._docs[doc_key]
+        parts = []
+        for kind in ("comp", "conn", "port") if level < 2 else ("comp", "conn"):
+            layer = self._layers[kind]
+            idx = self._visible(kind, region)
+            dense = np.zeros(len(idx), dtype=bool)
+            if kind == "port" or (kind == "conn" and level >= 2): dense[:] = level > 0
+            elif kind == "comp" and level >= 2:
+                b = layer["bounds"][idx]
+                dense = np.maximum(b[:, 2] - b[:, 0], b[:, 3] - b[:, 1]) * scale < self.SMALL_COMP_PX
+            state = "mark" if level == 0 else "lite"
+            keys = layer["keys"]
+            parts += [self._frag(kind, keys[i], state) for i in idx[~dense].tolist()]
+            if dense.any(): parts.append(self._density(kind, layer["bounds"][idx[dense]], cell))
+        doc = self._docs[doc_key] = "".join(parts)
+        while len(self._docs) > self.doc_cache_size: self._docs.popitem(last=False)
+        return doc
+
+    def element_count(self):
+        self._sync()
+        return sum(len(self._layers[kind]["keys"]) for kind in ("comp", "conn", "port"))
+
+    def culls(self):
+        """元素足够多、值得按视口裁剪时为 True；小图始终整图下发，滚动缩放不需要重绘"""
+        return self.element_count() >= self.CULL_MIN_ELEMENTS
+
+    def detail(self, scale):
+        """
+        缩放比例 (屏幕像素 / 图片像素) 对应的 (细节级别, 密度块边长)：
+        0 完整绘制；1 不画组件名、端口合并为密度块；2 不画端口，连接与过小的组件合并为密度块。
+        级别或边长不变时同一区域的文档可以复用。
+        """
+        if scale >= self.LABEL_MIN_SCALE: return 0, 0
+        level = 1 if scale >= self.NET_MIN_SCALE else 2
+        return level, 2 ** math.ceil(math.log2(self.DENSITY_PX / max(scale, 1e-6)))
+
+    def _density(self, kind, bounds, cell):
+        """把元素按中心点落入的格子计数，每个非空格子画一个方块，不透明度随数量增长"""
+        cx = np.floor((bounds[:, 0] + bounds[:, 2]) / 2 / cell).astype(np.int64)
+        cy = np.floor((bounds[:, 1] + bounds[:, 3]) / 2 / cell).astype(np.int64)
+        cells, counts = np.unique(np.stack([cx, cy], axis=1), axis=0, return_counts=True)
+        css = "net" if kind == "conn" else kind
+        return "".join(f'<rect class="dens {css}" x="{x * cell}" y="{y * cell}" width="{cell}" height="{cell}" '
+                       f'fill-opacity="{min(0.9, 0.25 + 0.15 * math.log2(n)):.2f}" />'
+                       for (x, y), n in zip(cells.tolist(), counts.tolist()))
+
+    def highlight(self, selected=None, connect_start=None):
+        """浏览器端切换 class 所需的高亮状态：是否整体变暗 + 需要加 hi 的元素 id，大小只与选中对象有关"""
+        self._sync()
+        viz, sel = self.viz, selected
+        hi = []
+        if sel:
+            conns = viz.data["connections"]
+            if sel["type"] == "component":
+                if sel["name"] in self._layers["comp"]["pos"]: hi.append(self._eid("comp", sel["name"]))
+                idxs = viz.connections_of(sel["name"])
+            elif sel["type"] == "port": idxs = viz.connections_of(sel["comp"], sel["port"])
+            elif sel["type"] == "conn_center": idxs = [sel["index"]]
+            else: idxs = []
+            hi += [self._eid("conn", id(conns[i])) for i in idxs if i < len(conns)]
+            if sel["type"] == "conn_edge" and sel["index"] < len(conns):
+                conn = conns[sel["index"]]
+                edge, net = (sel["node"]["component"], sel["node"]["port"]), self._eid("conn", id(conn))
+                hi += [f"{net}e{i}" for i, node in enumerate(conn["nodes"]) if (node["component"], node["port"]) == edge]
+        for p in (sel if sel and sel["type"] == "port" else None, connect_start):
+            if not p: continue
+            hi += [self._eid("port", key) for key in self._port_keys.get((p["comp"], p["port"]), [])]
+        return {"dim": sel is not None, "hi": hi}
+
+def render_svg(viz, size, max_size=None, image_href=None):
+    """
+    独立的 SVG 文档 (样式内嵌)，与编辑页未选中任何对象时的画面相同：size 为图片坐标下的画布大小，
+    max_size 限制输出 width/height 的最长边 (等比缩小，不放大)，image_href 为底图地址。
+    元素很多时与编辑页一样按输出比例简化 (见 SvgRenderer.detail)。
+    """
+    w, h = size
+    s = min(1.0, max_size / max(w, h, 1)) if max_size else 1.0
+    renderer = SvgRenderer(viz)
+    body = renderer.markup(((0, 0, w, h), s)) if renderer.culls() else renderer.markup()
+    bg = f'<image href="{html.escape(image_href)}" width="{w}" height="{h}" preserveAspectRatio="none" />' if image_href else ""
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" class="viz" width="{round(w * s)}" height="{round(h * s)}" viewBox="0 0 {w} {h}">'
+            f'<style>{VIZ_CSS}</style>{bg}{body}</svg>')
@@ -1,30 +1,93 @@
 from nicegui import ui, app, events
-from fastapi import Request
-import uuid
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+import os
 import json
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from collections import OrderedDict
 import base64
 import io
 import time
 from PIL import Image 
 from viz_core import SystemBlockViz
+import viz_codec
+from viz_render import SvgRenderer, HIGHLIGHT_HEAD_HTML, view_region, region_contains
+from viz_raster import TileRenderer
+from session_store import SessionStore, SqliteBackend
+from image_store import ImageStore, IMAGE_ROUTE, image_url, image_digest
+from upload import receive_upload, UploadError
+from batch import prepare_session
+from metrics import REGISTRY, Gauge, Histogram, SIZE_BUCKETS, timed
 
 # ==========================================
-# 1. 全局内存数据库
+# 1. 会话存储 (空闲超时 + LRU 淘汰 + 内存上限)
 # ==========================================
-SESSIONS = {}
+# 默认持久化到 SQLite；同一台机器上可用不同 VIZ_PORT 启动多个进程共享同一个数据库
+# (编辑页的 websocket 需要粘性会话)。VIZ_SESSION_DB 设为空字符串时只保存在内存中。
+SESSION_DB = os.environ.get("VIZ_SESSION_DB", "sessions.db")
+# 图片按内容哈希去重，只存一份；持久化时写入 VIZ_IMAGE_DIR 供其它进程读取
+IMAGES = ImageStore(os.environ.get("VIZ_IMAGE_DIR", "images") if SESSION_DB else None)
+SESSIONS = SessionStore(backend=SqliteBackend(SESSION_DB) if SESSION_DB else None, images=IMAGES)
+# 没有请求时也定期回收空闲会话；编辑中的改动定期异步落盘
+app.timer(60, SESSIONS.sweep)
+app.timer(2, SESSIONS.flush)
+app.on_shutdown(SESSIONS.close)
+# 上传限制：超过字节数或像素数的图片在读到相应位置时立即拒绝
+MAX_UPLOAD_BYTES = int(os.environ.get("VIZ_MAX_UPLOAD_BYTES", 50 << 20))
+MAX_IMAGE_PIXELS = int(os.environ.get("VIZ_MAX_IMAGE_PIXELS", 100_000_000))
+# 长轮询单次最长等待时间与 SSE 心跳间隔 (秒)
+MAX_WAIT = 60
+SSE_KEEPALIVE = 15
+# 批量接口：单次请求的条目上限；解码与校验在进程池中并行 (第一次批量请求时创建)
+MAX_BATCH = int(os.environ.get("VIZ_MAX_BATCH", 10000))
+# 无界面预览 (/api/render) 输出最长边的上限 (像素)
+MAX_RENDER_SIZE = 4096
+BATCH_WORKERS = int(os.environ.get("VIZ_BATCH_WORKERS", 0)) or os.cpu_count()
+BATCH_POOL = None
+
+@app.on_shutdown
+def shutdown_batch_pool():
+    if BATCH_POOL is not None: BATCH_POOL.shutdown(cancel_futures=True)
+
+# 指标：GET /api/metrics 以 Prometheus 文本格式输出。请求与事件耗时在发生时记录，会话统计在抓取时计算
+REQUEST_SECONDS = Histogram("viz_request_seconds", "API request latency", labels=("endpoint",))
+HANDLER_SECONDS = Histogram("viz_handler_seconds", "Edit page event handler latency", labels=("handler",))
+PAYLOAD_BYTES = Histogram("viz_payload_bytes", "Bytes sent to the browser per redraw (svg document / highlight update)", SIZE_BUCKETS, labels=("kind",))
+Gauge("viz_sessions", "Sessions by status (durable backend: all processes)", lambda: {(k,): v for k, v in SESSIONS.counts().items()}, labels=("status",))
+Gauge("viz_sessions_loaded", "Sessions resident in this process", lambda: len(SESSIONS.sizes()))
+Gauge("viz_sessions_compact", "Resident sessions stored in compact form", lambda: SESSIONS.info()["compact_sessions"])
+Gauge("viz_sessions_created_total", "Sessions created by this process", lambda: SESSIONS.stats["created"], kind="counter")
+Gauge("viz_sessions_completed_total", "Sessions saved as done by this process", lambda: SESSIONS.stats["finished"], kind="counter")
+Gauge("viz_sessions_evicted_total", "Sessions unloaded from memory", lambda: {(reason,): SESSIONS.stats[f"evicted_{reason}"] for reason in ("ttl", "count", "bytes")},
+      labels=("reason",), kind="counter")
+Gauge("viz_sessions_compacted_total", "Sessions converted to compact form", lambda: SESSIONS.stats["compacted"], kind="counter")
+
+def session_memory():
+    sizes = SESSIONS.sizes()
+    return {("total",): sum(sizes), ("max",): max(sizes, default=0), ("avg",): sum(sizes) / len(sizes) if sizes else 0}
+Gauge("viz_session_memory_bytes", "Estimated memory of resident sessions", session_memory, labels=("stat",))
+Gauge("viz_image_cache_bytes", "Bytes of images held in memory", lambda: SESSIONS.images.info()["image_bytes"] if SESSIONS.images else 0)
 
 # ==========================================
 # 2. API 接口
 # ==========================================
 
 @app.post("/api/init_session")
+@timed(REQUEST_SECONDS, endpoint="init_session")
 async def init_session(request: Request):
     data = await request.json()
     img_b64 = data.get("image_b64")
     json_str = data.get("json_str")
     
-    session_id = str(uuid.uuid4())
-    
+    try:
+        viz_obj = SystemBlockViz(json_str)
+    except Exception as e:
+        return {"status": "error", "msg": f"JSON Parse Error: {str(e)}"}
+
+    img_src = img_b64
     try:
         if "," in img_b64:
             header, encoded = img_b64.split(",", 1)
@@ -33,33 +96,268 @@ async def init_session(request: Request):
         img_data = base64.b64decode(encoded)
         img_obj = Image.open(io.BytesIO(img_data))
         width, height = img_obj.size
+        # 解码后的图片按内容哈希存一份，页面通过可缓存的地址加载
+        img_src = image_url(IMAGES.put(img_data, Image.MIME.get(img_obj.format, "image/png")))
     except Exception as e:
         print(f"Image parse error: {e}")
         width, height = 1000, 1000 
 
+    session_id = SESSIONS.create(viz_obj, img_src, (width, height))
+    # validation 为构造时的清洗报告 (被剔除的节点/连接及原因)，供上游统计检测错误
+    return {"session_id": session_id, "url": f"/edit/{session_id}", "validation": viz_obj.validation}
+
+@app.post("/api/init_session_upload")
+@timed(REQUEST_SECONDS, endpoint="init_session_upload")
+async def init_session_upload(request: Request):
+    """multipart 上传：image 为图片文件 (按块写入图片仓库，只读文件头获取尺寸)，json_str 为普通字段"""
     try:
-        viz_obj = SystemBlockViz(json_str)
+        fields, image = await receive_upload(request, IMAGES, MAX_UPLOAD_BYTES, max_pixels=MAX_IMAGE_PIXELS)
+    except UploadError as e:
+        return JSONResponse({"status": "error", "msg": str(e)}, status_code=e.status)
+    if image is None:
+        return JSONResponse({"status": "error", "msg": "Missing image"}, status_code=400)
+
+    try:
+        viz_obj = SystemBlockViz(fields.get("json_str"))
     except Exception as e:
+        # 上传只写入了图片、没有取得引用：只在没有其它会话使用时丢弃
+        IMAGES.discard(image[0])
         return {"status": "error", "msg": f"JSON Parse Error: {str(e)}"}
 
-    SESSIONS[session_id] = {
-        "viz": viz_obj,
-        "img_src": img_b64,
-        "img_size": (width, height),
-        "result": None,
-        "done": False
-    }
-    return {"session_id": session_id, "url": f"/edit/{session_id}"}
+    digest, width, height = image
+    session_id = SESSIONS.create(viz_obj, image_url(digest), (width, height))
+    return {"session_id": session_id, "url": f"/edit/{session_id}", "validation": viz_obj.validation}
+
+@app.post("/api/init_sessions")
+@timed(REQUEST_SECONDS, endpoint="init_sessions")
+async def init_sessions(request: Request):
+    """
+    批量创建会话：body 为 {"items": [{"image_b64": ..., "json_str": ...}, ...]}，
+    按顺序逐项返回 {"session_id", "url", "validation"} 或 {"status": "error", "msg"}。
+    不落盘的会话存储没有地方存放冷会话，单批条目数不能超过内存中的会话上限，否则本批会话会互相挤掉。
+    """
+    global BATCH_POOL
+    try: body = await request.json()
+    except ValueError: body = None
+    items = body.get("items") if isinstance(body, dict) else None
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return JSONResponse({"status": "error", "msg": 'Body must be {"items": [{"image_b64": ..., "json_str": ...}, ...]}'}, status_code=400)
+    if len(items) > MAX_BATCH:
+        return JSONResponse({"status": "error", "msg": f"Too many items (max {MAX_BATCH})"}, status_code=413)
+    if not SESSIONS.backend.durable and len(items) > SESSIONS.max_sessions:
+        return JSONResponse({"status": "error", "msg": f"Too many items for the in-memory session store (max {SESSIONS.max_sessions}); "
+                                                       "set VIZ_SESSION_DB to create larger batches"}, status_code=413)
+    if BATCH_POOL is None:
+        # 服务进程里已有事件循环、落盘线程和线程池，fork 可能复制到被其它线程持有的锁而死锁；
+        # 改由 forkserver 创建子进程，只预先导入 batch，不重新执行本模块
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["batch"])
+        BATCH_POOL = ProcessPoolExecutor(BATCH_WORKERS, mp_context=ctx)
+    work = partial(prepare_session, image_root=IMAGES.root, max_image_bytes=MAX_UPLOAD_BYTES, max_pixels=MAX_IMAGE_PIXELS)
+    chunksize = max(1, len(items) // (4 * BATCH_WORKERS))
+    # 进程池的 map 会阻塞，放到线程里等待，事件循环继续处理其它请求
+    prepared = await asyncio.get_running_loop().run_in_executor(None, lambda: list(BATCH_POOL.map(work, items, chunksize=chunksize)))
+
+    results = []
+    for res in prepared:
+        if not res["ok"]:
+            results.append({"status": "error", "msg": res["msg"]})
+            continue
+        digest = IMAGES.put(res["data"], res["mime"]) if res["data"] is not None else res["digest"]
+        session_id = SESSIONS.create_cold(res["json"], image_url(digest), res["size"])
+        results.append({"session_id": session_id, "url": f"/edit/{session_id}", "validation": res["validation"]})
+    return {"results": results}
+
+@app.post("/api/get_results")
+@timed(REQUEST_SECONDS, endpoint="get_results")
+async def get_results(request: Request):
+    """批量查询：body 为 {"session_ids": [...]}，返回 {"results": {session_id: get_result 的返回}}"""
+    session_ids = (await request.json()).get("session_ids") or []
+    if len(session_ids) > MAX_BATCH:
+        return JSONResponse({"status": "error", "msg": f"Too many ids (max {MAX_BATCH})"}, status_code=413)
+    return {"results": {sid: result_payload(*res) for sid, res in SESSIONS.results(session_ids).items()}}
+
+def result_payload(status, result):
+    if status == "done":
+        return {"status": "done", "json": result}
+    elif status == "pending":
+        return {"status": "pending"}
+    elif status == "expired":
+        return {"status": "expired", "msg": "Session expired"}
+    else:
+        return {"status": "error", "msg": "Session not found"}
+
+# 已完成结果的序列化缓存：session_id -> (结果文本, {格式: 序列化结果})，结果不变时重复查询不再重新编码
+RESULT_CACHE = OrderedDict()
+RESULT_CACHE_SIZE = 256
+
+def encoded_result(session_id, result, fmt):
+    """把保存的结果 (export_json 文本) 转成 fmt 格式；"object" 为整个 get_result 响应体，json 字段直接内嵌对象"""
+    cached = RESULT_CACHE.get(session_id)
+    if cached is None or cached[0] != result:
+        cached = RESULT_CACHE[session_id] = (result, {})
+        if len(RESULT_CACHE) > RESULT_CACHE_SIZE: RESULT_CACHE.popitem(last=False)
+    RESULT_CACHE.move_to_end(session_id)
+    payloads = cached[1]
+    if fmt not in payloads:
+        if fmt == "json": payloads[fmt] = result
+        elif fmt == "object": payloads[fmt] = b'{"status":"done","json":' + encoded_result(session_id, result, "compact").encode("utf-8") + b"}"
+        else: payloads[fmt] = viz_codec.dumps(json.loads(result), fmt)
+    return payloads[fmt]
 
 @app.get("/api/get_result")
-def get_result(session_id: str):
-    if session_id not in SESSIONS:
-        return {"status": "error", "msg": "Session not found"}
-    session = SESSIONS[session_id]
-    if session["done"]:
-        return {"status": "done", "json": session["result"]}
+async def get_result(session_id: str, wait: float = 0, format: str = "json"):
+    """
+    wait > 0 时为长轮询：会话保存或过期时立即返回，最多等待 wait 秒 (上限 MAX_WAIT)。
+    format=object 时 json 字段是标注对象本身而不是 JSON 文本，客户端不用再解析一次。
+    """
+    # 长轮询的耗时主要是等待，单独记一个 endpoint
+    start = time.perf_counter()
+    if wait > 0: status, result = await SESSIONS.wait_result(session_id, min(wait, MAX_WAIT))
+    else: status, result = SESSIONS.result(session_id)
+    if status == "done" and format == "object":
+        response = Response(encoded_result(session_id, result, "object"), media_type="application/json")
     else:
-        return {"status": "pending"}
+        response = result_payload(status, result)
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="get_result_wait" if wait > 0 else "get_result")
+    return response
+
+@app.get("/api/export/{session_id}")
+@timed(REQUEST_SECONDS, endpoint="export")
+async def export_session(session_id: str, request: Request, format: str = "compact"):
+    """
+    按 format (json / compact / gzip / binary，见 viz_codec) 导出标注：已保存的会话导出保存的结果，否则导出当前编辑状态。
+    compact 在客户端接受 gzip 时直接返回缓存的压缩字节。
+    在事件循环中执行：会话存储、结果缓存与编辑页的修改都只在事件循环中访问，不会读到改了一半的数据。
+    """
+    if format not in viz_codec.FORMATS:
+        return JSONResponse({"status": "error", "msg": f"Unknown format: {format}"}, status_code=400)
+    gzip_ok = format == "compact" and "gzip" in request.headers.get("accept-encoding", "")
+    fmt = "gzip" if gzip_ok else format
+    status, result = SESSIONS.result(session_id)
+    if status == "done": payload = encoded_result(session_id, result, fmt)
+    else:
+        session = SESSIONS.get(session_id) if status == "pending" else None
+        if session is None: return JSONResponse(result_payload(status, result), status_code=404)
+        payload = session["viz"].export(fmt)
+    headers = {"Content-Encoding": "gzip", "Vary": "Accept-Encoding"} if gzip_ok else {}
+    return Response(payload, media_type=viz_codec.MEDIA_TYPES[format], headers=headers)
+
+@app.get("/api/result_stream/{session_id}")
+async def result_stream(session_id: str, request: Request):
+    """Server-Sent Events：会话结束时推送一条 result 事件后关闭，等待期间定期发送注释行保持连接"""
+    async def events():
+        while True:
+            status, result = await SESSIONS.wait_result(session_id, SSE_KEEPALIVE)
+            if status != "pending":
+                yield f"event: result\ndata: {json.dumps(result_payload(status, result), ensure_ascii=False)}\n\n"
+                return
+            if await request.is_disconnected(): return
+            yield ": keepalive\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get(IMAGE_ROUTE + "/{digest}")
+def get_image(digest: str, request: Request):
+    # 地址即内容哈希，内容永不改变：浏览器可长期缓存，重新验证时直接返回 304
+    etag = f'"{digest}"'
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    image = IMAGES.get(digest)
+    if image is None:
+        return Response(status_code=404)
+    data, mime = image
+    return Response(data, media_type=mime, headers={"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"})
+
+TILE_ROUTE = "/api/tile"
+
+def tile_renderer(session):
+    """会话的瓦片渲染器，跟随会话一起回收；会话重新加载 (viz 换了对象) 后重建"""
+    tiles = session.get("tiles")
+    if tiles is None or tiles.viz is not session["viz"]: tiles = session["tiles"] = TileRenderer(session["viz"], size=session["img_size"])
+    return tiles
+
+@app.get(TILE_ROUTE + "/{session_id}/{z}/{tx}/{ty}")
+@timed(REQUEST_SECONDS, endpoint="tile")
+async def get_tile(session_id: str, z: int, tx: int, ty: int, v: int = -1):
+    """
+    编辑页的栅格瓦片 (见 viz_raster)。v 为页面拿到的瓦片戳记，与当前戳记一致时内容不会再变，可以长期缓存。
+    在事件循环中执行，与编辑页的修改串行，不会读到改了一半的数据。
+    """
+    session = SESSIONS.get(session_id)
+    # 画布范围外的瓦片一律 404，不绘制也不占用缓存
+    if session is None or not tile_renderer(session).valid(z, tx, ty):
+        return Response(status_code=404)
+    stamp, png = tile_renderer(session).tile(z, tx, ty)
+    PAYLOAD_BYTES.observe(len(png), kind="tile")
+    cache = "public, max-age=31536000, immutable" if stamp == v else "no-cache"
+    return Response(png, media_type="image/png", headers={"Cache-Control": cache})
+
+# 无界面预览用的 viz 副本：(会话 id, 版本键) -> viz。副本不进入会话存储，不会挤掉编辑中的会话，
+# 也不刷新它们的访问时间；数据没变时复用副本，副本自带的渲染缓存也随之复用
+RENDER_VIZ = OrderedDict()
+RENDER_VIZ_SIZE = 32
+
+def build_render_viz(data):
+    viz = SystemBlockViz(data)
+    viz.content_hash()
+    return viz
+
+def render_preview(viz, fmt, img_src, img_size, max_size):
+    """在线程池中执行：副本只被预览读取，不会与编辑页的修改并发"""
+    digest = image_digest(img_src)
+    if fmt == "svg": return viz.render("svg", img_size, max_size, img_src if digest else None)
+    image = IMAGES.get(digest) if digest else None
+    return viz.render("png", img_size, max_size, image[0] if image else None, digest)
+
+@app.get("/api/render/{session_id}")
+@timed(REQUEST_SECONDS, endpoint="render")
+async def render_session(session_id: str, request: Request, format: str = "png", max_size: int = 512):
+    """
+    无界面预览 (质检、数据集画廊的缩略图)：format=png 为叠加在原图上的位图，svg 为引用原图地址的矢量文档；
+    max_size 限制最长边。绘制规则与编辑页相同，结果由 SystemBlockViz.render 按数据版本缓存；
+    ETag 由数据内容哈希、原图内容哈希和参数组成，浏览器重新验证时内容未变直接返回 304。
+    内存中的会话取其紧凑 JSON 作快照，冷会话直接读后端记录，都在线程池中构建副本并绘制，不占用事件循环。
+    """
+    if format not in SystemBlockViz.RENDER_FORMATS:
+        return JSONResponse({"status": "error", "msg": f"Unknown format: {format}"}, status_code=400)
+    loop = asyncio.get_running_loop()
+    session = SESSIONS.peek(session_id)
+    if session is not None:
+        img_src, img_size = session["img_src"], session["img_size"]
+        key, data = (session_id, session["viz"].content_hash()), session["viz"].export("compact")
+    else:
+        rec = await loop.run_in_executor(None, SESSIONS.record, session_id)
+        if rec is None:
+            status, result = SESSIONS.result(session_id)
+            return JSONResponse(result_payload("expired" if status == "done" else status, None), status_code=404)
+        img_src, img_size = rec["img_src"], (rec["img_w"], rec["img_h"])
+        key, data = (session_id, f"rev{rec['rev']}"), rec["json"]
+    viz = RENDER_VIZ.get(key)
+    if viz is None:
+        viz = await loop.run_in_executor(None, build_render_viz, data)
+        for k in [k for k in RENDER_VIZ if k[0] == session_id]: del RENDER_VIZ[k]
+        RENDER_VIZ[key] = viz
+        if len(RENDER_VIZ) > RENDER_VIZ_SIZE: RENDER_VIZ.popitem(last=False)
+    RENDER_VIZ.move_to_end(key)
+    digest = image_digest(img_src)
+    max_size = min(max(max_size, 16), MAX_RENDER_SIZE)
+    etag = f'"{viz.content_hash()[:20]}-{(digest or "none")[:20]}-{format}-{max_size}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    payload = await loop.run_in_executor(None, render_preview, viz, format, img_src, img_size, max_size)
+    PAYLOAD_BYTES.observe(len(payload), kind="render")
+    return Response(payload, media_type="image/svg+xml" if format == "svg" else "image/png", headers=headers)
+
+@app.get("/api/session_stats")
+async def session_stats():
+    # 与 metrics 相同，遍历会话存储，在事件循环中执行
+    return SESSIONS.info()
+
+@app.get("/api/metrics")
+async def metrics():
+    # Gauge 回调会遍历会话与图片缓存，在事件循环中执行以免与修改它们的代码并发
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # ==========================================
 # 3. 标注页面逻辑
@@ -67,48 +365,68 @@ def get_result(session_id: str):
 
 @ui.page('/edit/{session_id}')
 def edit_page(session_id: str):
-    if session_id not in SESSIONS:
-        ui.label("Session expired").classes("text-red-500 text-2xl m-10")
+    session_data = SESSIONS.get(session_id, fresh=True)
+    if session_data is None:
+        msg = "Session expired" if SESSIONS.status(session_id) == "expired" else "Session not found"
+        ui.label(msg).classes("text-red-500 text-2xl m-10")
         return
+    # 页面打开期间会话钉在内存中，其它接口 (导出、瓦片、预览) 取到的就是这里正在编辑的对象
+    SESSIONS.attach(session_id)
+    ui.context.client.on_delete(lambda: SESSIONS.detach(session_id))
 
-    session_data = SESSIONS[session_id]
     viz_instance = session_data["viz"]
     img_src = session_data["img_src"]
     img_w, img_h = session_data["img_size"]
     
+    renderer = SvgRenderer(viz_instance)
     state = {
         "viz": viz_instance,
+        "renderer": renderer,
+        # 元素很多时画布改用栅格瓦片，选中高亮仍为矢量叠加
+        "tiles": tile_renderer(session_data) if renderer.element_count() >= TileRenderer.MIN_ELEMENTS else None,
         "mode": "VIEW",
         "selected": None,
-        "temp_draw": None,
         "connect_start": None,
-        "history": [],
         "zoom": 1.0,
+        "viewport": None,      # 浏览器报告的 (可见范围, 缩放比例)，图片坐标
+        "shown_view": None,    # 当前下发文档覆盖的 (区域, 细节级别)，整图下发时为 None
         "cached_base_svg": "",
-        "last_draw_time": 0,
+        "sent_highlight": None,
         "ui": {
             "img": None, "info_panel": None, "mode_btns": {}, 
-            "undo_btn": None, "status": None
+            "undo_btn": None, "redo_btn": None, "status": None
         }
     }
 
     # --- 辅助功能 ---
+    @timed(HANDLER_SECONDS, handler="save_history")
     def save_history():
-        state["history"].append(state["viz"].clone_data())
-        if len(state["history"]) > 20: state["history"].pop(0)
-        if state["ui"]["undo_btn"]: state["ui"]["undo_btn"].enable()
+        # 只标记撤销分组的边界，具体的逆操作由 viz 在编辑时记录
+        state["viz"].checkpoint()
+        SESSIONS.touch(session_id, session_data)
+
+    def update_history_btns():
+        viz = state["viz"]
+        for key, ok in (("undo_btn", viz.can_undo()), ("redo_btn", viz.can_redo())):
+            btn = state["ui"][key]
+            if not btn: continue
+            if ok: btn.enable()
+            else: btn.disable()
 
     def undo():
-        if not state["history"]: return
-        prev_data = state["history"].pop()
-        state["viz"].restore_data(prev_data)
+        if not state["viz"].undo(): return
         state["selected"] = None
-        if not state["history"] and state["ui"]["undo_btn"]: 
-            state["ui"]["undo_btn"].disable()
         update_info_panel(None)
         refresh_canvas(update_base=True)
         ui.notify("已撤销")
 
+    def redo():
+        if not state["viz"].redo(): return
+        state["selected"] = None
+        update_info_panel(None)
+        refresh_canvas(update_base=True)
+        ui.notify("已重做")
+
     def set_zoom(val):
         state["zoom"] = val
         if state["ui"]["img"]:
@@ -122,7 +440,8 @@ def edit_page(session_id: str):
         state["mode"] = mode
         state["selected"] = None
         state["connect_start"] = None
-        state["temp_draw"] = None
+        # 画框预览在浏览器中绘制，只需切换开关
+        if state["ui"]["img"]: state["ui"]["img"].client.run_javascript(f'vizDrawMode({json.dumps(state["ui"]["img"].html_id)}, {json.dumps(mode == "ADD_COMP")})')
         for k, btn in state["ui"]["mode_btns"].items():
             if k == mode: btn.props('color=primary')
             else: btn.props('color=white text-color=black') 
@@ -164,6 +483,7 @@ def edit_page(session_id: str):
         if not sel: return
         save_history()
         state["viz"].update_component_type(sel["name"], new_val)
+        update_history_btns()
 
     def on_port_rename(new_val):
         sel = state["selected"]
@@ -204,6 +524,7 @@ def edit_page(session_id: str):
             ui.button('删除', on_click=delete_selection, color='red', icon='delete').classes('w-full')
 
     # --- 绘图逻辑 ---
+    @timed(HANDLER_SECONDS, handler="refresh_canvas")
     def refresh_canvas(update_base=False):
         img_comp = state["ui"]["img"]
         if not img_comp: return
@@ -211,75 +532,54 @@ def edit_page(session_id: str):
         w, h = img_w, img_h
         
         if update_base or not state["cached_base_svg"]:
-            viz = state["viz"]
-            sel = state["selected"]
-            dim = (sel is not None)
-            svg_parts = []
-
-            # 组件
-            for comp in reversed(viz.get_component_list_sorted()):
-                name = comp["name"]
-                box = comp["info"]["box"]
-                # --- 修改点：强制转 int，避免浮点数 ---
-                bx, by = int(min(box[0], box[2])), int(min(box[1], box[3]))
-                bw, bh = int(abs(box[2]-box[0])), int(abs(box[3]-box[1]))
-                # ----------------------------------
-                stroke, sw, op = ("blue", 2, 0.05)
-                if dim: 
-                    if sel["type"] == "component" and sel["name"] == name: stroke, sw, op = ("red", 4, 0)
-                    else: stroke, op = ("rgba(0,0,255,0.3)", 0.02)
-                svg_parts.append(f'<rect x="{bx}" y="{by}" width="{bw}" height="{bh}" fill="rgba(0,0,255,{op})" stroke="{stroke}" stroke-width="{sw}" />')
-                if not dim or (sel["type"]=="component" and sel["name"]==name):
-                    svg_parts.append(f'<text x="{bx}" y="{by-5}" fill="{stroke}" font-size="16" font-weight="bold">{name}</text>')
-            
-            
+            # 静态文档只随数据版本变化，内容不变时不会重新下发；选中高亮只推送 class 切换
+            # 大图只下发可见区域 (含边距) 内的元素，并按缩放比例简化
+            renderer, view = state["renderer"], None
+            if state["tiles"]:
+                # 还没收到视口时按宽度适配整图估计
+                rect, scale = state["viewport"] or ((0, 0, w, h), min(1.0, 1024 / max(w, 1)))
+                region = view_region(rect)
+                tiles, z = state["tiles"].markup(f"{TILE_ROUTE}/{session_id}", region, scale)
+                state["shown_view"] = (region, z)
+                overlay = state["renderer"].overlay(state["selected"], state["connect_start"])
+                state["cached_base_svg"] = (f'<g opacity="0.35">{tiles}</g>' if state["selected"] else tiles) + overlay
+                update_history_btns()
+            else:
+                if state["viewport"] and renderer.culls():
+                    rect, scale = state["viewport"]
+                    view = (view_region(rect), scale)
+                    state["shown_view"] = (view[0], renderer.detail(scale))
+                else: state["shown_view"] = None
+                state["cached_base_svg"] = renderer.markup(view)
+                push_highlight()
+                update_history_btns()
+
+        content = f'<svg class="viz" viewBox="0 0 {w} {h}">{state["cached_base_svg"]}</svg>'
+        # 内容不变时 NiceGUI 不会重新下发
+        if content != img_comp.content: PAYLOAD_BYTES.observe(len(content), kind="svg")
+        img_comp.content = content
+
+    def on_viewport(e):
+        args = e.args
+        if args.get("id") != state["ui"]["img"].html_id: return
+        rect, scale = (args["x0"], args["y0"], args["x1"], args["y1"]), args["scale"]
+        if scale <= 0 or rect[2] <= rect[0] or rect[3] <= rect[1]: return
+        state["viewport"] = (rect, scale)
+        if not state["tiles"] and not state["renderer"].culls(): return
+        # 可见范围仍在已下发的区域内且细节级别 (瓦片级别) 不变时不用重绘
+        detail = state["tiles"].level(scale) if state["tiles"] else state["renderer"].detail(scale)
+        shown = state["shown_view"]
+        if shown and region_contains(shown[0], rect) and shown[1] == detail: return
+        refresh_canvas(update_base=True)
 
-            # 连线
-            for idx, conn in enumerate(viz.data["connections"]):
-                center = viz.get_connection_centroid(idx)
-                if not center: continue
-                net_high = (sel and sel["type"]=="conn_center" and sel["index"]==idx) or \
-                           (sel and sel["type"]=="component" and any(n["component"]==sel["name"] for n in conn["nodes"])) or \
-                           (sel and sel["type"]=="port" and any(n["component"]==sel["comp"] and n["port"]==sel["port"] for n in conn["nodes"]))
-                c_c = "red" if net_high else ("#00cc00" if not dim else "rgba(0,200,0,0.2)")
-                svg_parts.append(f'<circle cx="{center[0]}" cy="{center[1]}" r="{6 if net_high else 4}" fill="{c_c}" stroke="white" stroke-width="1" />')
-                for node in conn["nodes"]:
-                    p_c = viz.get_port_coord(node["component"], node["port"])
-                    if p_c:
-                        e_high = net_high or (sel and sel["type"]=="conn_edge" and sel["index"]==idx and sel["node"]==node)
-                        l_c = "red" if e_high else c_c
-                        l_w = 4 if e_high else 2
-                        svg_parts.append(f'<line x1="{p_c[0]}" y1="{p_c[1]}" x2="{center[0]}" y2="{center[1]}" stroke="{l_c}" stroke-width="{l_w}" />')
-
-            # 端口
-            all_ports = []
-            for pname, pinfo in viz.data["external_ports"].items(): 
-                all_ports.append({"comp": "external", "name": pname, "coord": pinfo["coord"], "type": "ext"})
-            for cname, cinfo in viz.data["components"].items():
-                for p in cinfo["ports"]: 
-                    all_ports.append({"comp": cname, "name": p["name"], "coord": p["coord"], "type": "int"})
-            
-            for p in all_ports:
-                cx, cy = p["coord"]
-                is_ext = (p["type"] == "ext")
-                r = 10 if is_ext else 5
-                p_high = (sel and sel["type"] == "port" and sel["comp"] == p["comp"] and sel["port"] == p["name"]) or \
-                         (state["connect_start"] and state["connect_start"]["comp"] == p["comp"] and state["connect_start"]["port"] == p["name"])
-                fill = "yellow" if p_high else ("orange" if is_ext else "purple")
-                stroke = "black" if p_high else "white"
-                if dim and not p_high: fill = "#cccccc"
-                svg_parts.append(f'<circle cx="{cx}" cy="{cy}" r="{r}" fill="{fill}" stroke="{stroke}" stroke-width="{2 if p_high else 1}" />')
-
-            state["cached_base_svg"] = "".join(svg_parts)
-
-        final_svg = state["cached_base_svg"]
-        if state["temp_draw"]:
-            s, c = state["temp_draw"]['start'], state["temp_draw"]['curr']
-            x, y = min(s[0], c[0]), min(s[1], c[1])
-            w_box, h_box = abs(s[0]-c[0]), abs(s[1]-c[1])
-            final_svg += f'<rect x="{x}" y="{y}" width="{w_box}" height="{h_box}" fill="none" stroke="red" stroke-width="3" stroke-dasharray="5,5" />'
-
-        img_comp.content = f'<svg viewBox="0 0 {w} {h}">{final_svg}</svg>'
+    def push_highlight():
+        img_comp = state["ui"]["img"]
+        hl = state["renderer"].highlight(state["selected"], state["connect_start"])
+        if hl == state["sent_highlight"]: return
+        state["sent_highlight"] = hl
+        js = f'vizHighlight({json.dumps(img_comp.html_id)}, {json.dumps(hl)})'
+        PAYLOAD_BYTES.observe(len(js), kind="highlight")
+        img_comp.client.run_javascript(js)
 
     # --- 交互 ---
     async def open_add_comp_dialog(box):
@@ -331,28 +631,16 @@ def edit_page(session_id: str):
                 ui.button('确定', on_click=on_confirm)
         dialog.open()
 
+    @timed(HANDLER_SECONDS, handler="handle_mouse")
     async def handle_mouse(e: events.MouseEventArguments):
         viz = state["viz"]
         mode = state["mode"]
         x, y = e.image_x, e.image_y
 
-        if mode == 'ADD_COMP':
-            if e.type == 'mousedown':
-                state["temp_draw"] = {'start': (x, y), 'curr': (x, y)}
-            elif e.type == 'mousemove' and state["temp_draw"]:
-                now = time.time()
-                if now - state["last_draw_time"] < 0.03: return
-                state["last_draw_time"] = now
-                state["temp_draw"]['curr'] = (x, y)
-                refresh_canvas(update_base=False) 
-            elif e.type == 'mouseup' and state["temp_draw"]:
-                s, end = state["temp_draw"]['start'], (x, y)
-                box = [min(s[0], end[0]), min(s[1], end[1]), max(s[0], end[0]), max(s[1], end[1])]
-                state["temp_draw"] = None
-                refresh_canvas(update_base=False)
-                if abs(box[2]-box[0]) > 5: await open_add_comp_dialog(box)
-
-        elif e.type == 'mousedown':
+        # 画框由浏览器处理 (见 on_draw_box)
+        if mode == 'ADD_COMP': return
+
+        if e.type == 'mousedown':
             hit = viz.hit_test(x, y)
             if mode == 'VIEW':
                 state["selected"] = hit
@@ -388,9 +676,14 @@ def edit_page(session_id: str):
                         state["connect_start"] = None
                         refresh_canvas(update_base=True)
 
+    async def on_draw_box(e):
+        args = e.args
+        if args.get("id") != state["ui"]["img"].html_id or state["mode"] != 'ADD_COMP': return
+        box = args["box"]
+        if abs(box[2]-box[0]) > 5: await open_add_comp_dialog(box)
+
     def save_to_gradio():
-        SESSIONS[session_id]["result"] = state["viz"].export_json()
-        SESSIONS[session_id]["done"] = True
+        SESSIONS.finish(session_id, state["viz"].export_json())
         ui.notify("保存成功！数据已传回 Gradio。", type='positive')
         with ui.dialog() as d, ui.card():
             ui.label("标注完成").classes("text-xl font-bold text-green-600")
@@ -400,6 +693,7 @@ def edit_page(session_id: str):
 
     # --- 布局 ---
     ui.add_head_html('''<style>body { margin: 0; padding: 0; overflow: hidden; background-color: #e5e7eb; }</style>''')
+    ui.add_head_html(HIGHLIGHT_HEAD_HTML)
     
     with ui.header().classes('bg-slate-800 items-center h-14 shadow-lg'):
         ui.icon('settings_input_component', color='white', size='md').classes('ml-2')
@@ -407,6 +701,8 @@ def edit_page(session_id: str):
         ui.space()
         state["ui"]["undo_btn"] = ui.button('撤销', icon='undo', on_click=undo).props('flat color=white')
         state["ui"]["undo_btn"].disable()
+        state["ui"]["redo_btn"] = ui.button('重做', icon='redo', on_click=redo).props('flat color=white')
+        state["ui"]["redo_btn"].disable()
         ui.button('保存并返回', on_click=save_to_gradio, icon='save').props('unelevated color=green-600')
 
     with ui.row().classes('w-full h-[calc(100vh-3.5rem)] no-wrap gap-0'):
@@ -428,7 +724,7 @@ def edit_page(session_id: str):
         with ui.column().classes('flex-grow h-full bg-gray-500 relative overflow-auto items-start justify-start'):
             img = ui.interactive_image(
                 img_src, 
-                events=['mousedown', 'mouseup', 'mousemove'], 
+                events=['mousedown'], 
                 on_mouse=handle_mouse, 
                 cross=True
             ).style('width: 100%; height: auto; transform-origin: top left;')
@@ -444,7 +740,18 @@ def edit_page(session_id: str):
                 ui.image(img_src).classes('w-full rounded')
 
     # 初始化
-    ui.timer(0.1, lambda: refresh_canvas(update_base=True), once=True)
-    ui.keyboard(on_key=lambda e: undo() if (e.modifiers.ctrl and e.key=='z') else (delete_selection() if e.key=='Delete' else None))
-
-ui.run(port=8060, title="NiceGUI Annotation Server", storage_secret="secret")
\ No newline at end of file
+    def init_canvas():
+        img.client.run_javascript(f'vizWatchViewport({json.dumps(img.html_id)}, {img_w}, {img_h})')
+        # 大图等浏览器报告视口后再按可见区域渲染，不先下发整图；报告迟迟不来时再整图兜底
+        if not state["tiles"] and not state["renderer"].culls(): refresh_canvas(update_base=True)
+    ui.on("viz_viewport", on_viewport, throttle=0.1)
+    ui.on("viz_draw_box", on_draw_box)
+    ui.timer(0.1, init_canvas, once=True)
+    ui.timer(3.0, lambda: state["shown_view"] or refresh_canvas(update_base=True), once=True)
+    def handle_key(e):
+        if e.modifiers.ctrl and (e.key == 'y' or (e.key == 'z' and e.modifiers.shift)): redo()
+        elif e.modifiers.ctrl and e.key == 'z': undo()
+        elif e.key == 'Delete': delete_selection()
+    ui.keyboard(on_key=handle_key)
+
+ui.run(port=int(os.environ.get("VIZ_PORT", 8060)), title="NiceGUI Annotation Server", storage_secret="secret")
\ No newline at end of file